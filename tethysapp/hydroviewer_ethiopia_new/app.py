@@ -64,6 +64,22 @@ class HydroviewerEthiopiaNew(TethysAppBase):
                 name='get-time-series',
                 url='ecmwf-rapid/get-time-series',
                 controller='{0}.controllers.ecmwf_get_time_series'.format(base_name)),
+            UrlMap(
+                name='get-reach',
+                url='get-reach',
+                controller='{0}.controllers.get_reach'.format(base_name)),
+            UrlMap(
+                name='get-reach',
+                url='ecmwf-rapid/get-reach',
+                controller='{0}.controllers.get_reach'.format(base_name)),
+            UrlMap(
+                name='get-reach-bundle',
+                url='get-reach-bundle',
+                controller='{0}.controllers.get_reach_bundle'.format(base_name)),
+            UrlMap(
+                name='get-reach-bundle',
+                url='ecmwf-rapid/get-reach-bundle',
+                controller='{0}.controllers.get_reach_bundle'.format(base_name)),
             UrlMap(
                 name='get-warning-points',
                 url='get-warning-points',
@@ -72,6 +88,14 @@ class HydroviewerEthiopiaNew(TethysAppBase):
                 name='get-warning-points',
                 url='ecmwf-rapid/get-warning-points',
                 controller='{0}.controllers.get_warning_points'.format(base_name)),
+            UrlMap(
+                name='get-warning-points-bbox',
+                url='get-warning-points-bbox',
+                controller='{0}.controllers.get_warning_points_bbox'.format(base_name)),
+            UrlMap(
+                name='get-warning-points-bbox',
+                url='ecmwf-rapid/get-warning-points-bbox',
+                controller='{0}.controllers.get_warning_points_bbox'.format(base_name)),
             UrlMap(
                 name='get-historic-data',
                 url='get-historic-data',
@@ -80,6 +104,14 @@ class HydroviewerEthiopiaNew(TethysAppBase):
                 name='get-flow-duration-curve',
                 url='get-flow-duration-curve',
                 controller='{0}.controllers.get_flow_duration_curve'.format(base_name)),
+            UrlMap(
+                name='get-flow-duration-data',
+                url='get-flow-duration-data',
+                controller='{0}.controllers.get_flow_duration_data'.format(base_name)),
+            UrlMap(
+                name='get-flow-duration-data',
+                url='ecmwf-rapid/get-flow-duration-data',
+                controller='{0}.controllers.get_flow_duration_data'.format(base_name)),
             UrlMap(
                 name='get-seasonal-avg-curve',
                 url='get-seasonal-avg-curve',
@@ -112,6 +144,14 @@ class HydroviewerEthiopiaNew(TethysAppBase):
                 name='get_forecast_data_csv',
                 url='ecmwf-rapid/get-forecast-data-csv',
                 controller='{0}.controllers.get_forecast_data_csv'.format(base_name)),
+            UrlMap(
+                name='bulk_export',
+                url='bulk-export',
+                controller='{0}.controllers.bulk_export'.format(base_name)),
+            UrlMap(
+                name='bulk_export',
+                url='ecmwf-rapid/bulk-export',
+                controller='{0}.controllers.bulk_export'.format(base_name)),
             UrlMap(
                 name='set_def_ws',
                 url='admin/setdefault',
@@ -124,6 +164,50 @@ class HydroviewerEthiopiaNew(TethysAppBase):
                 name='set_def_ws',
                 url='lis-rapid/admin/setdefault',
                 controller='{0}.controllers.setDefault'.format(base_name)),
+            UrlMap(
+                name='refresh_watersheds',
+                url='admin/refresh-watersheds',
+                controller='{0}.controllers.refresh_watersheds'.format(base_name)),
+            UrlMap(
+                name='refresh_watersheds',
+                url='ecmwf-rapid/admin/refresh-watersheds',
+                controller='{0}.controllers.refresh_watersheds'.format(base_name)),
+            UrlMap(
+                name='prefetch_status',
+                url='admin/prefetch-status',
+                controller='{0}.controllers.prefetch_status'.format(base_name)),
+            UrlMap(
+                name='prefetch_status',
+                url='ecmwf-rapid/admin/prefetch-status',
+                controller='{0}.controllers.prefetch_status'.format(base_name)),
+            UrlMap(
+                name='update_return_periods',
+                url='admin/update-return-periods',
+                controller='{0}.controllers.update_return_periods'.format(base_name)),
+            UrlMap(
+                name='update_return_periods',
+                url='ecmwf-rapid/admin/update-return-periods',
+                controller='{0}.controllers.update_return_periods'.format(base_name)),
+            UrlMap(
+                name='update-reach-catalogue',
+                url='admin/update-reach-catalogue',
+                controller='{0}.controllers.update_reach_catalogue'.format(base_name)),
+            UrlMap(
+                name='update-reach-catalogue',
+                url='ecmwf-rapid/admin/update-reach-catalogue',
+                controller='{0}.controllers.update_reach_catalogue'.format(base_name)),
+            UrlMap(
+                name='ingest-region-forecast',
+                url='admin/ingest-region-forecast',
+                controller='{0}.controllers.ingest_region_forecast'.format(base_name)),
+            UrlMap(
+                name='ingest-region-forecast',
+                url='ecmwf-rapid/admin/ingest-region-forecast',
+                controller='{0}.controllers.ingest_region_forecast'.format(base_name)),
+            UrlMap(
+                name='metrics',
+                url='metrics',
+                controller='{0}.controllers.metrics'.format(base_name)),
             UrlMap(
                 name='forecastpercent',
                 url='ecmwf-rapid/forecastpercent',
@@ -132,6 +216,62 @@ class HydroviewerEthiopiaNew(TethysAppBase):
                 name='forecastpercent',
                 url='forecastpercent',
                 controller='{0}.controllers.forecastpercent'.format(base_name)),
+            UrlMap(
+                name='async-get-time-series',
+                url='async/get-time-series',
+                controller='{0}.async_controllers.get_time_series'.format(base_name)),
+            UrlMap(
+                name='async-get-time-series',
+                url='ecmwf-rapid/async/get-time-series',
+                controller='{0}.async_controllers.ecmwf_get_time_series'.format(base_name)),
+            UrlMap(
+                name='async-get-warning-points',
+                url='async/get-warning-points',
+                controller='{0}.async_controllers.get_warning_points'.format(base_name)),
+            UrlMap(
+                name='async-get-warning-points',
+                url='ecmwf-rapid/async/get-warning-points',
+                controller='{0}.async_controllers.get_warning_points'.format(base_name)),
+            UrlMap(
+                name='async-get-warning-points-bbox',
+                url='async/get-warning-points-bbox',
+                controller='{0}.async_controllers.get_warning_points_bbox'.format(base_name)),
+            UrlMap(
+                name='async-get-warning-points-bbox',
+                url='ecmwf-rapid/async/get-warning-points-bbox',
+                controller='{0}.async_controllers.get_warning_points_bbox'.format(base_name)),
+            UrlMap(
+                name='async-get-historic-data',
+                url='async/get-historic-data',
+                controller='{0}.async_controllers.get_historic_data'.format(base_name)),
+            UrlMap(
+                name='async-get-historic-data',
+                url='ecmwf-rapid/async/get-historic-data',
+                controller='{0}.async_controllers.get_historic_data'.format(base_name)),
+            UrlMap(
+                name='async-get-flow-duration-curve',
+                url='async/get-flow-duration-curve',
+                controller='{0}.async_controllers.get_flow_duration_curve'.format(base_name)),
+            UrlMap(
+                name='async-get-flow-duration-curve',
+                url='ecmwf-rapid/async/get-flow-duration-curve',
+                controller='{0}.async_controllers.get_flow_duration_curve'.format(base_name)),
+            UrlMap(
+                name='async-get-seasonal-avg-curve',
+                url='async/get-seasonal-avg-curve',
+                controller='{0}.async_controllers.get_seasonal_avg_curve'.format(base_name)),
+            UrlMap(
+                name='async-get-seasonal-avg-curve',
+                url='ecmwf-rapid/async/get-seasonal-avg-curve',
+                controller='{0}.async_controllers.get_seasonal_avg_curve'.format(base_name)),
+            UrlMap(
+                name='async-forecastpercent',
+                url='async/forecastpercent',
+                controller='{0}.async_controllers.forecastpercent'.format(base_name)),
+            UrlMap(
+                name='async-forecastpercent',
+                url='ecmwf-rapid/async/forecastpercent',
+                controller='{0}.async_controllers.forecastpercent'.format(base_name)),
         )
 
         return url_maps
@@ -215,6 +355,34 @@ class HydroviewerEthiopiaNew(TethysAppBase):
                 description='Default Watershed Name: (e.g. "South America (Brazil)") ',
                 required=False
             ),
+            CustomSetting(
+                name='sentinel_reach',
+                type=CustomSetting.TYPE_INTEGER,
+                description='Reach ID polled for new forecasts. When set, the forecasts of the warning points are '
+                            'loaded in the background as soon as a new forecast is available',
+                required=False
+            ),
+            CustomSetting(
+                name='prefetch_reaches',
+                type=CustomSetting.TYPE_STRING,
+                description='Comma separated Reach IDs to load in the background on top of the warning points',
+                required=False
+            ),
+            CustomSetting(
+                name='region_forecast_url',
+                type=CustomSetting.TYPE_STRING,
+                description='Url or path of the ensemble forecast file of the whole region, with {date} (YYYYMMDD), '
+                            '{hour} (HH) or {cycle} placeholders. When set with the sentinel reach, the file of each '
+                            'new forecast is loaded into the app workspace and the forecasts are read from it',
+                required=False
+            ),
+            CustomSetting(
+                name='async_views',
+                type=CustomSetting.TYPE_BOOLEAN,
+                description='Load the forecast, historic and warning point data through the async views. Only '
+                            'useful when the portal is served with ASGI (e.g. daphne or uvicorn)',
+                required=False
+            ),
             CustomSetting(
                 name='show_dropdown',
                 type=CustomSetting.TYPE_BOOLEAN,
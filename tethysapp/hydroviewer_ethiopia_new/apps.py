@@ -0,0 +1,14 @@
+from django.apps import AppConfig
+
+
+class HydroviewerEthiopiaNewConfig(AppConfig):
+    """
+    Django config of the app, starts its background tasks in the processes that serve requests.
+    """
+
+    name = 'tethysapp.hydroviewer_ethiopia_new'
+    label = 'hydroviewer_ethiopia_new'
+
+    def ready(self):
+        from .startup import start_background_tasks
+        start_background_tasks()
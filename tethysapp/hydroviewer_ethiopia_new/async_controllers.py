@@ -0,0 +1,145 @@
+"""
+Async versions of the controllers that mostly wait on upstream services, for deployments served over ASGI.
+They only prefetch: the downloads are awaited concurrently with the async client, then the sync controller
+builds the response in a worker thread from the caches they filled, so both versions return the same responses.
+Nothing that reads or writes the stores, parses or plots runs on the event loop.
+"""
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+
+from . import controllers
+from .cache import ensemble_arrays_async
+from .conditional import conditional, error_response
+from .custom_settings import custom_setting
+from .exceedance import percent_table, read_ensemble_csv, read_return_periods
+from .historic_store import historic_simulation_async
+from .metrics import timed, upstream
+from .return_periods import lookup_return_periods
+from .upstream import async_get
+from .validators import forecast_plot_validators, historic_plot_validators
+from .warning_points import warning_points_async
+
+
+def _in_thread(func):
+    return sync_to_async(func, thread_sensitive=False)
+
+
+@sync_to_async
+def _spt_settings():
+    # Custom settings may be read from the database, which needs a sync context
+    return custom_setting('api_source'), custom_setting('spt_token')
+
+
+@timed
+@conditional(forecast_plot_validators)
+async def ecmwf_get_time_series(request):
+    try:
+        comid = request.GET['comid']
+        # The stats and ensembles are both computed from the ensembles in the forecast store
+        await asyncio.gather(ensemble_arrays_async(comid), historic_simulation_async(comid))
+    except Exception as e:
+        print(str(e))
+        return error_response('No data found for the selected reach.')
+
+    return await _in_thread(controllers.ecmwf_get_time_series)(request)
+
+
+@timed
+async def get_time_series(request):
+    return await ecmwf_get_time_series(request)
+
+
+async def _historic_view(request, controller, error):
+    try:
+        await historic_simulation_async(request.GET['comid'])
+    except Exception as e:
+        print(str(e))
+        return error_response(error)
+
+    return await _in_thread(controller)(request)
+
+
+@timed
+@conditional(historic_plot_validators)
+async def get_historic_data(request):
+    return await _historic_view(request, controllers.get_historic_data,
+                                'No historic data found for the selected reach.')
+
+
+@timed
+@conditional(historic_plot_validators)
+async def get_flow_duration_curve(request):
+    return await _historic_view(request, controllers.get_flow_duration_curve,
+                                'No historic data found for calculating flow duration curve.')
+
+
+@timed
+@conditional(historic_plot_validators)
+async def get_seasonal_avg_curve(request):
+    return await _historic_view(request, controllers.get_seasonal_avg_curve,
+                                'No historic data found for calculating flow duration curve.')
+
+
+async def _warning_view(request, controller):
+    get_data = request.GET
+    if get_data['model'] != 'ECMWF-RAPID':
+        return None
+    try:
+        api_source, spt_token = await _spt_settings()
+        await warning_points_async(api_source, spt_token, get_data['watershed'], get_data['subbasin'])
+    except Exception as e:
+        print(str(e))
+        return JsonResponse({'error': 'No data found for the selected reach.'})
+
+    return await _in_thread(controller)(request)
+
+
+@timed
+async def get_warning_points(request):
+    return await _warning_view(request, controllers.get_warning_points)
+
+
+@timed
+async def get_warning_points_bbox(request):
+    return await _warning_view(request, controllers.get_warning_points_bbox)
+
+
+@timed
+async def forecastpercent(request):
+    if not (request.is_ajax() and request.method == 'GET'):
+        return None
+
+    watershed = request.GET.get('watershed')
+    subbasin = request.GET.get('subbasin')
+    reach = request.GET.get('comid')
+    date = request.GET.get('startdate')
+    forecast = 'most_recent' if date == '' else str(date)
+
+    api_source, spt_token = await _spt_settings()
+    api = api_source + '/apps/streamflow-prediction-tool/api/'
+    request_headers = dict(Authorization='Token ' + spt_token)
+
+    async def ensembles():
+        arrays = await ensemble_arrays_async(reach) if forecast == 'most_recent' else None
+        if arrays is not None:
+            return arrays[0], arrays[1].T
+        with upstream('spt'):
+            ens = await async_get(api + 'GetEnsemble/', params=dict(watershed_name=watershed, subbasin_name=subbasin,
+                                                                    reach_id=reach, forecast_folder=forecast),
+                                  headers=request_headers, verify=False)
+        return await _in_thread(read_ensemble_csv)(ens.content)
+
+    async def return_periods():
+        thresholds = await _in_thread(lookup_return_periods)(reach)
+        if thresholds is not None:
+            return {'two': thresholds[2], 'ten': thresholds[10], 'twenty': thresholds[20]}
+        with upstream('spt'):
+            rpall = await async_get(api + 'GetReturnPeriods/', params=dict(watershed_name=watershed,
+                                                                            subbasin_name=subbasin, reach_id=reach),
+                                    headers=request_headers, verify=False)
+        return read_return_periods(rpall.content)
+
+    (timesteps, flows), rpdict = await asyncio.gather(ensembles(), return_periods())
+    return JsonResponse(await _in_thread(percent_table)(timesteps, flows, rpdict))
@@ -0,0 +1,157 @@
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import numpy as np
+
+from .downloads import forecast_stats_chunks, series_csv_chunks
+from .historic_store import historic_simulation, historic_store
+from .model import catalogue
+
+# Reaches fetched at the same time by one export
+BULK_WORKERS = 8
+MAX_BULK_REACHES = 2000
+# A wide csv keeps every reach mapped until the last row is written, so it takes fewer reaches than a zip archive
+MAX_WIDE_REACHES = 500
+# The rows of a wide csv need every reach, so the reaches missing from the historic store are all downloaded
+# before the first byte is sent. Larger selections have to be imported first (e.g. with a zip export).
+MAX_WIDE_DOWNLOADS = 50
+# Cells formatted at a time in a wide csv, the rows of a block are WIDE_CELLS / reaches
+WIDE_CELLS = 256 * 1024
+
+
+def subbasin_reaches(watershed, subbasin):
+    """
+    Returns the reach ids of a watershed/subbasin from the reach catalogue.
+    """
+    reach_ids = catalogue.subbasin_reaches(watershed.lower(), subbasin.lower())
+    if not reach_ids:
+        raise ValueError('No reaches of {0}-{1} in the reach catalogue'.format(watershed, subbasin))
+    return reach_ids
+
+
+def bounded_map(func, items, workers=BULK_WORKERS):
+    """
+    Yields (item, result, error) as the calls complete, with at most twice as many calls in flight as workers so
+    that finished results do not pile up while the response is being sent.
+    """
+    items = iter(items)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {}
+        for item in items:
+            pending[executor.submit(func, item)] = item
+            if len(pending) >= workers * 2:
+                break
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                item = pending.pop(future)
+                try:
+                    yield item, future.result(), None
+                except Exception as e:
+                    yield item, None, str(e)
+                for next_item in items:
+                    pending[executor.submit(func, next_item)] = next_item
+                    break
+
+
+def _historic_csv(comid):
+    return b''.join(series_csv_chunks(historic_simulation(comid), 'datetime,streamflow (m3/s)'))
+
+
+def _forecast_csv(comid):
+    # Same source and columns as the single reach download (downloads.forecast_stats_chunks)
+    return b''.join(forecast_stats_chunks(comid))
+
+
+def missing_reaches(reach_ids):
+    """
+    Returns the reaches that are not in the historic store yet, i.e. that an export has to download.
+    """
+    return [comid for comid in reach_ids if not historic_store.has(comid)]
+
+
+class _ZipStream(object):
+    """
+    Write-only, unseekable file object: zipfile writes into it and the generator drains what was written.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def zip_chunks(reach_ids, kind):
+    """
+    Yields a zip archive with one csv per reach. Reaches that fail are listed in errors.csv instead of aborting
+    the export.
+    """
+    fetch = _historic_csv if kind == 'historic' else _forecast_csv
+    name = 'historic_streamflow_{0}.csv' if kind == 'historic' else 'streamflow_forecast_{0}.csv'
+
+    stream = _ZipStream()
+    errors = []
+    with zipfile.ZipFile(stream, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for comid, data, error in bounded_map(fetch, reach_ids):
+            if error is not None:
+                errors.append('{0},{1}\n'.format(comid, error.replace('\n', ' ').replace(',', ';')))
+                continue
+            archive.writestr(name.format(comid), data)
+            yield stream.drain()
+        if errors:
+            archive.writestr('errors.csv', 'reach_id,error\n' + ''.join(errors))
+    yield stream.drain()
+
+
+def wide_historic(reach_ids):
+    """
+    Opens the historic simulation of every reach and returns the reaches that failed, as {comid: error}, and a
+    generator of one csv with a column per reach.
+
+    Every row needs a value from every reach, so all the series are opened before the first row is written. They
+    are memory maps of the historic store and only keep a file mapping per reach, not the flows: the pages are
+    read while a block is formatted and the OS can drop them afterwards. The formatted text of a block is bounded
+    by WIDE_CELLS cells whatever the number of reaches, and at most MAX_WIDE_REACHES maps are open per export.
+    The reaches missing from the store are downloaded before the generator is returned, at most
+    MAX_WIDE_DOWNLOADS of them.
+    """
+    if len(reach_ids) > MAX_WIDE_REACHES:
+        raise ValueError('A wide csv takes at most {0} reaches.'.format(MAX_WIDE_REACHES))
+    if len(missing_reaches(reach_ids)) > MAX_WIDE_DOWNLOADS:
+        raise ValueError('A wide csv downloads at most {0} reaches.'.format(MAX_WIDE_DOWNLOADS))
+
+    series, errors = {}, {}
+    for comid, historic_sim, error in bounded_map(historic_simulation, reach_ids):
+        if error is not None:
+            errors[comid] = error
+        else:
+            series[comid] = historic_sim[historic_sim.columns[0]].values
+    comids = [comid for comid in reach_ids if comid in series]
+
+    def chunks():
+        yield ('datetime,' + ','.join('{0} (m3/s)'.format(c) for c in comids) + '\n').encode('utf-8')
+        if not comids:
+            return
+        index = historic_store.dates()[:max(len(values) for values in series.values())]
+        rows = max(1, WIDE_CELLS // len(comids))
+        for start in range(0, len(index), rows):
+            stop = min(start + rows, len(index))
+            columns = []
+            for comid in comids:
+                values = series[comid][start:stop].astype(str)
+                # Reaches imported before the index was extended are shorter
+                columns.append(np.concatenate([values, np.full(stop - start - len(values), '')]))
+            dates = index[start:stop].strftime('%Y-%m-%d %H:%M:%S')
+            yield ''.join(d + ',' + ','.join(row) + '\n' for d, row in zip(dates, zip(*columns))).encode('utf-8')
+
+    return errors, chunks()
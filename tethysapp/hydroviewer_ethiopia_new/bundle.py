@@ -0,0 +1,94 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from .cache import probabilities_table, streamflow
+from .fdc import flow_duration_curve, flow_duration_curve_figure
+from .figures import compact_figure, figure_html
+from .historic_store import historic_simulation
+from .metrics import phase, record_error, submit
+from .return_periods import reach_return_periods
+from .seasonal import seasonal_average, seasonal_figure
+
+_executor = ThreadPoolExecutor(max_workers=16)
+
+
+def _run(tasks):
+    """
+    Runs a dict of name -> (func, args) on the shared pool and returns name -> result. A task that raises
+    is reported as None, its error is kept under errors[name] and counted in the error metrics.
+    """
+    futures = {name: submit(_executor, func, *args) for name, (func, args) in tasks.items()}
+    results, errors = {}, {}
+    for name, future in futures.items():
+        try:
+            results[name] = future.result()
+        except Exception as e:
+            record_error('bundle_' + name)
+            results[name] = None
+            errors[name] = str(e)
+    return results, errors
+
+
+def reach_bundle(comid, tot_drain_area, compact=False):
+    """
+    Returns every view of a reach: forecast plot and probability table, historic hydrograph, flow duration
+    curve and seasonal average. Each dataset is fetched once, concurrently, and shared by the views built
+    from it. The plots are compact figures if compact is set, html otherwise.
+    """
+    drain_area = tot_drain_area + " km<sup>2</sup>"
+
+    data, errors = _run({
+        'stats': (streamflow, ('forecast_stats', comid)),
+        'ensembles': (streamflow, ('forecast_ensembles', comid)),
+        'rperiods': (reach_return_periods, (comid,)),
+        'historic': (historic_simulation, (comid,)),
+    })
+
+    tasks = {}
+    if data['stats'] is not None and data['rperiods'] is not None:
+        tasks['forecast'] = (_forecast_plot, (data['stats'], data['rperiods'], comid, drain_area, compact))
+        if data['ensembles'] is not None:
+            tasks['table'] = (probabilities_table, (comid,))
+    if data['historic'] is not None:
+        if data['rperiods'] is not None:
+            tasks['historic'] = (_historical_plot, (data['historic'], data['rperiods'], comid, drain_area, compact))
+        tasks['fdc'] = (_flow_duration_curve_plot, (comid, drain_area, compact))
+        tasks['seasonal'] = (_seasonal_plot, (comid, drain_area, compact))
+
+    views, view_errors = _run(tasks)
+    errors.update(view_errors)
+
+    bundle = {name: views.get(name) for name in ('forecast', 'table', 'historic', 'fdc', 'seasonal')}
+    bundle['errors'] = errors
+    return bundle
+
+
+def _forecast_plot(stats, rperiods, comid, drain_area, compact):
+    import geoglows
+
+    with phase('plotting'):
+        plot = geoglows.streamflow.forecast_plot(stats, rperiods, reach_id=comid, drain_area=drain_area,
+                                                 outformat='plotly' if compact else 'plotly_html')
+    return compact_figure(plot) if compact else plot
+
+
+def _historical_plot(historic_sim, rperiods, comid, drain_area, compact):
+    import geoglows
+
+    with phase('plotting'):
+        plot = geoglows.streamflow.historical_plot(historic_sim, rperiods, reach_id=comid, drain_area=drain_area,
+                                                   outformat='plotly' if compact else 'plotly_html')
+    return compact_figure(plot) if compact else plot
+
+
+def _flow_duration_curve_plot(comid, drain_area, compact):
+    curve = flow_duration_curve(comid)
+    with phase('plotting'):
+        figure = flow_duration_curve_figure(curve, drain_area)
+    return compact_figure(figure) if compact else figure_html(figure)
+
+
+def _seasonal_plot(comid, drain_area, compact):
+    seasonal_avg = seasonal_average(comid)
+    with phase('plotting'):
+        figure = seasonal_figure(seasonal_avg, drain_area)
+    return compact_figure(figure) if compact else figure_html(figure)
@@ -0,0 +1,307 @@
+import asyncio
+import os
+import pickle
+import threading
+import time
+from io import StringIO
+
+import pandas as pd
+from asgiref.sync import sync_to_async
+
+from .app import HydroviewerEthiopiaNew as app
+from .ensemble_store import forecast_frame, frame_arrays
+from .forecast_store import forecast_store
+from .metrics import phase, record_cache, upstream
+from .return_periods import reach_return_periods
+from .upstream import async_get, session
+
+# Products that change with every ECMWF forecast cycle
+FORECAST_PRODUCTS = ('forecast_stats', 'forecast_ensembles')
+# Products derived from the historic simulation, which only changes when the model is re-run
+HISTORIC_PRODUCTS = ('historic_simulation', 'return_periods', 'seasonal_average')
+# Views computed in the app from the forecast products, cached with them
+FORECAST_VIEWS = ('probabilities_table',)
+
+CACHE_DIR = 'reach_cache'
+CACHE_MAX_BYTES = 512 * 1024 * 1024
+HISTORIC_TTL = 30 * 24 * 3600
+# How often the most recent forecast date is checked upstream
+CYCLE_TTL = 15 * 60
+# GEOGloWS region of the app, to look the forecast dates up when there is no reach at hand
+FORECAST_REGION = 'africa-geoglows'
+# Locks serializing the ensemble downloads of a reach (comid % ENSEMBLE_LOCKS)
+ENSEMBLE_LOCKS = 64
+
+
+class ReachCache(object):
+    """
+    Size-bounded LRU cache of pickled responses stored in the app workspace.
+
+    Every entry is one file, so the cache is shared by all the worker processes of the app. Reading an entry
+    touches its modification time, and the least recently used files are evicted once the directory grows
+    beyond max_bytes.
+    """
+
+    def __init__(self, path, max_bytes=CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._size = None
+        self._lock = threading.Lock()
+
+    def _file(self, key):
+        return os.path.join(self.path, key + '.pkl')
+
+    def get(self, key, max_age=None):
+        """
+        Returns the cached value for key, or None if it is missing or older than max_age seconds.
+        """
+        file_path = self._file(key)
+        try:
+            with open(file_path, 'rb') as f:
+                created, value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+        if max_age is not None and time.time() - created > max_age:
+            self.delete(key)
+            return None
+
+        try:
+            os.utime(file_path, None)
+        except OSError:
+            pass
+        return value
+
+    def set(self, key, value):
+        os.makedirs(self.path, exist_ok=True)
+        file_path = self._file(key)
+        tmp_path = '{0}.{1}.{2}.tmp'.format(file_path, os.getpid(), threading.get_ident())
+        with open(tmp_path, 'wb') as f:
+            pickle.dump((time.time(), value), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, file_path)
+
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan()[1]
+            else:
+                self._size += os.path.getsize(file_path)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def delete(self, key):
+        try:
+            os.remove(self._file(key))
+        except OSError:
+            pass
+
+    def purge(self, predicate):
+        """
+        Removes every entry whose key satisfies predicate.
+        """
+        for entry in self._scan()[0]:
+            if predicate(entry.name[:-len('.pkl')]):
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+        with self._lock:
+            self._size = None
+
+    def _scan(self):
+        try:
+            entries = [e for e in os.scandir(self.path) if e.name.endswith('.pkl')]
+        except OSError:
+            return [], 0
+        return entries, sum(e.stat().st_size for e in entries)
+
+    def _evict(self):
+        # Other processes write to the same directory, so evict from what is actually on disk
+        entries, size = self._scan()
+        entries.sort(key=lambda e: e.stat().st_mtime)
+        target = self.max_bytes * 0.9
+        for entry in entries:
+            if size <= target:
+                break
+            try:
+                entry_size = entry.stat().st_size
+                os.remove(entry.path)
+                size -= entry_size
+            except OSError:
+                pass
+        self._size = size
+
+
+reach_cache = ReachCache(os.path.join(app.get_app_workspace().path, CACHE_DIR))
+
+_cycle = {'dates': None, 'latest': None, 'checked': 0}
+_cycle_lock = threading.Lock()
+_ensemble_locks = [threading.Lock() for _ in range(ENSEMBLE_LOCKS)]
+# The same for the async views, which download on the event loop
+_async_ensemble_locks = [asyncio.Lock() for _ in range(ENSEMBLE_LOCKS)]
+
+
+def available_dates(comid=None, refresh=False):
+    """
+    Returns the available forecast dates. They are the same for every reach in the region, so a single
+    response is shared and only refreshed upstream every CYCLE_TTL seconds, or when refresh is set. Without a
+    reach, the dates of FORECAST_REGION are looked up.
+    """
+    dates = _cached_dates(refresh)
+    if dates is not None:
+        return dates
+
+    import geoglows
+    with upstream('geoglows'):
+        if comid is None:
+            dates = geoglows.streamflow.available_dates(region=FORECAST_REGION, s=session)
+        else:
+            dates = geoglows.streamflow.available_dates(comid, s=session)
+    return _update_cycle(dates)
+
+
+async def available_dates_async(comid=None, refresh=False):
+    """
+    available_dates for the async views, sharing the same cycle state.
+    """
+    dates = _cached_dates(refresh)
+    if dates is not None:
+        return dates
+
+    import geoglows
+    region = FORECAST_REGION if comid is None else geoglows.streamflow.reach_to_region(int(comid))
+    with upstream('geoglows'):
+        res = await async_get(geoglows.streamflow.ENDPOINT + 'AvailableDates/', params={'region': region})
+    res.raise_for_status()
+    return _update_cycle(res.json())
+
+
+def _cached_dates(refresh):
+    with _cycle_lock:
+        if not refresh and _cycle['dates'] is not None and time.time() - _cycle['checked'] < CYCLE_TTL:
+            return _cycle['dates']
+    return None
+
+
+def _update_cycle(dates):
+    latest = max(dates['available_dates'])
+
+    with _cycle_lock:
+        previous = _cycle['latest']
+        _cycle.update(dates=dates, latest=latest, checked=time.time())
+
+    if previous is not None and previous != latest:
+        # A new forecast cycle is out, entries from older cycles will never be read again
+        reach_cache.purge(lambda key: key.startswith(FORECAST_PRODUCTS + FORECAST_VIEWS) and
+                          not key.endswith('_' + latest))
+        forecast_store.purge()
+
+    return dates
+
+
+def forecast_cycle(comid=None):
+    """
+    Returns the initialization date of the most recent forecast.
+    """
+    available_dates(comid)
+    return _cycle['latest']
+
+
+async def forecast_cycle_async(comid=None):
+    await available_dates_async(comid)
+    return _cycle['latest']
+
+
+def ensemble_arrays(comid):
+    """
+    Returns (timesteps, flows of shape (members, timesteps)) of the most recent forecast of a reach from the
+    forecast store. A reach missing from the store is downloaded into it, once per forecast cycle.
+    """
+    comid = int(comid)
+    cycle = forecast_cycle(comid)
+    arrays = forecast_store.ensemble_arrays(comid, cycle)
+    record_cache('forecast_store', arrays is not None)
+    if arrays is not None:
+        return arrays
+
+    with _ensemble_locks[comid % ENSEMBLE_LOCKS]:
+        # Another thread may have downloaded it meanwhile
+        arrays = forecast_store.ensemble_arrays(comid, cycle)
+        if arrays is None:
+            import geoglows
+            with upstream('geoglows'):
+                ensembles = geoglows.streamflow.forecast_ensembles(comid, s=session)
+            arrays = forecast_store.save_reach(comid, cycle, *frame_arrays(ensembles))
+    return arrays
+
+
+async def ensemble_arrays_async(comid):
+    """
+    ensemble_arrays for the async views: the ensembles are downloaded with the async client, the store is read
+    and written in worker threads.
+    """
+    comid = int(comid)
+    cycle = await forecast_cycle_async(comid)
+    read = sync_to_async(forecast_store.ensemble_arrays, thread_sensitive=False)
+    arrays = await read(comid, cycle)
+    record_cache('forecast_store', arrays is not None)
+    if arrays is not None:
+        return arrays
+
+    async with _async_ensemble_locks[comid % ENSEMBLE_LOCKS]:
+        # Another request may have downloaded it meanwhile
+        arrays = await read(comid, cycle)
+        if arrays is None:
+            import geoglows
+            with upstream('geoglows'):
+                res = await async_get(geoglows.streamflow.ENDPOINT + 'ForecastEnsembles/',
+                                      params={'reach_id': comid, 'return_format': 'csv'})
+            res.raise_for_status()
+            arrays = await sync_to_async(_save_ensembles_csv, thread_sensitive=False)(comid, cycle, res.text)
+    return arrays
+
+
+def _save_ensembles_csv(comid, cycle, text):
+    # Parsed like geoglows does
+    ensembles = pd.read_csv(StringIO(text), index_col=0)
+    return forecast_store.save_reach(comid, cycle, *frame_arrays(ensembles))
+
+
+def streamflow(product, comid):
+    """
+    Returns geoglows.streamflow.<product>(comid). The forecast products are computed from the ensembles in the
+    forecast store, the others are served from the reach cache when possible.
+    """
+    comid = int(comid)
+    if product in FORECAST_PRODUCTS:
+        return forecast_frame(product, *ensemble_arrays(comid))
+    elif product not in HISTORIC_PRODUCTS:
+        raise ValueError('Unknown streamflow product: {0}'.format(product))
+    key = '{0}_{1}'.format(product, comid)
+
+    value = reach_cache.get(key, HISTORIC_TTL)
+    record_cache('reach_cache', value is not None)
+    if value is None:
+        import geoglows
+        with upstream('geoglows'):
+            value = getattr(geoglows.streamflow, product)(comid, s=session)
+        reach_cache.set(key, value)
+    return value
+
+
+def probabilities_table(comid):
+    """
+    Returns the probability table of the most recent forecast, computed once per reach and forecast cycle.
+    """
+    comid = int(comid)
+    key = 'probabilities_table_{0}_{1}'.format(comid, forecast_cycle(comid))
+    table = reach_cache.get(key)
+    record_cache('reach_cache', table is not None)
+    if table is None:
+        arrays = ensemble_arrays(comid)
+        stats, ensembles = forecast_frame('forecast_stats', *arrays), forecast_frame('forecast_ensembles', *arrays)
+        rperiods = reach_return_periods(comid)
+        import geoglows
+        with phase('plotting'):
+            table = geoglows.streamflow.probabilities_table(stats, ensembles, rperiods)
+        reach_cache.set(key, table)
+    return table
@@ -0,0 +1,97 @@
+import asyncio
+import functools
+import hashlib
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+
+def request_etag(request, version):
+    """
+    Returns the ETag of a response built from the given version of the data and the parameters of the request.
+    """
+    # Every parameter changes the body (reach, format, units, compression...), so they are all part of the tag
+    params = '&'.join('{0}={1}'.format(k, v) for k, v in sorted(request.GET.items()))
+    digest = hashlib.sha1('{0}?{1}#{2}'.format(request.path, params, version).encode('utf-8')).hexdigest()
+    return quote_etag(digest[:32])
+
+
+def _not_modified(request, validators):
+    etag, last_modified, max_age = validators
+    response = get_conditional_response(request, etag=etag, last_modified=int(last_modified))
+    if response is not None:
+        response['ETag'] = etag
+        patch_cache_control(response, public=True, max_age=max_age)
+    return response
+
+
+def error_response(message):
+    """
+    Returns the JSON error of a conditional controller. The page reads errors from 200 responses, so they are
+    marked no-store instead: they are never reused and never get validators.
+    """
+    response = JsonResponse({'error': message})
+    patch_cache_control(response, no_store=True)
+    return response
+
+
+def _set_validators(response, validators):
+    if response is None or response.status_code != 200 or validators is None:
+        return response
+    if 'no-store' in response.get('Cache-Control', ''):
+        return response
+    etag, last_modified, max_age = validators
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, public=True, max_age=max_age)
+    return response
+
+
+def _validate(validators, request):
+    try:
+        return validators(request)
+    except Exception as e:
+        # Invalid parameters or upstream down, the controller reports the error
+        print(str(e))
+        return None
+
+
+def conditional(validators):
+    """
+    Answers GET requests with 304 Not Modified, before the controller fetches or plots anything, when the
+    client already has the current response. Other responses get an ETag, Last-Modified and Cache-Control.
+    validators(request) returns (etag, last modified timestamp, max age), or None if the response cannot be
+    validated yet. Errors must be answered with error_response. Works on sync and async controllers.
+    """
+    def decorator(controller):
+        if asyncio.iscoroutinefunction(controller):
+            validate = sync_to_async(_validate, thread_sensitive=False)
+
+            @functools.wraps(controller)
+            async def async_wrapper(request, *args, **kwargs):
+                current = await validate(validators, request)
+                if current is not None:
+                    response = _not_modified(request, current)
+                    if response is not None:
+                        return response
+                response = await controller(request, *args, **kwargs)
+                return _set_validators(response, current or await validate(validators, request))
+
+            return async_wrapper
+
+        @functools.wraps(controller)
+        def wrapper(request, *args, **kwargs):
+            current = _validate(validators, request)
+            if current is not None:
+                response = _not_modified(request, current)
+                if response is not None:
+                    return response
+            response = controller(request, *args, **kwargs)
+            # A reach seen for the first time can be validated once the controller has stored it
+            return _set_validators(response, current or _validate(validators, request))
+
+        return wrapper
+
+    return decorator
@@ -1,31 +1,47 @@
 from django.shortcuts import render
 from tethys_sdk.permissions import login_required
 from tethys_sdk.gizmos import *
-from django.http import HttpResponse, JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from tethys_sdk.permissions import has_permission
 from tethys_sdk.base import TethysAppBase
 from io import StringIO
 
 import os
-import requests
-from requests.auth import HTTPBasicAuth
 import json
-import numpy as np
 
-from csv import writer as csv_writer
-import scipy.stats as sp
 import datetime as dt
-import ast
-import plotly.graph_objs as go
-import geoglows
 
 from .app import HydroviewerEthiopiaNew as app
-from .helpers import *
+from .custom_settings import custom_setting, settings_snapshot
+from .helpers import switch_model
+from .cache import available_dates, ensemble_arrays, forecast_cycle, probabilities_table, streamflow
+from .forecast_store import ingest_forecast
+from .historic_store import historic_simulation, historic_store
+from .return_periods import lookup_return_periods, reach_return_periods, return_period_table
+from .exceedance import percent_table, read_ensemble_csv, read_return_periods
+from .warning_points import warning_points
+from .warning_index import warning_index
+from .bundle import reach_bundle
+from .reach_index import DEFAULT_TOLERANCE, MAX_TOLERANCE, layer_features, reach_index
+from .model import catalogue, reach_drain_area
+from .reach_catalogue import region_subbasin
+from .watersheds import watershed_names as get_watershed_names
+from .figures import compact_figure, encode_array, figure_html
+from .fdc import DEFAULT_EXCEEDANCE, flow_duration_curve, flow_duration_curve_figure
+from .seasonal import seasonal_average, seasonal_figure
+from .prefetch import scheduler
+from .metrics import exposition, phase, timed, upstream
+from .conditional import conditional, error_response
+from .validators import (forecast_plot_validators, forecast_validators, historic_plot_validators,
+                         historic_validators)
+from .upstream import session
+from .downloads import csv_download, forecast_date, forecast_stats_chunks, series_csv_chunks
+from .bulk import (MAX_BULK_REACHES, MAX_WIDE_DOWNLOADS, MAX_WIDE_REACHES, missing_reaches, subbasin_reaches,
+                   wide_historic, zip_chunks)
 base_name = __package__.split('.')[-1]
 
 BYU_ENDPOINT = 'https://tethys2.byu.edu/localsptapi/api/'
 
-
 def set_custom_setting(defaultModelName, defaultWSName):
 
     from tethys_apps.models import TethysApp
@@ -40,11 +56,15 @@ def set_custom_setting(defaultModelName, defaultWSName):
     db_setting.value = defaultWSName
     db_setting.save()
 
+    # Every worker reads the settings again
+    settings_snapshot.invalidate()
+
 
+@timed
 def home(request):
 
     # Check if we have a default model. If we do, then redirect the user to the default model's page
-    default_model = app.get_custom_setting('default_model_type')
+    default_model = custom_setting('default_model_type')
     if default_model:
         model_func = switch_model(default_model)
         if model_func is not 'invalid':
@@ -64,7 +84,7 @@ def home_standard(request):
                               original=True)
 
     zoom_info = TextInput(display_text='',
-                          initial=json.dumps(app.get_custom_setting('zoom_info')),
+                          initial=json.dumps(custom_setting('zoom_info')),
                           name='zoom_info',
                           disabled=True)
 
@@ -75,10 +95,10 @@ def home_standard(request):
     my_geoserver = geoserver_engine.endpoint.replace('rest', '')
 
     geoserver_base_url = my_geoserver
-    geoserver_workspace = app.get_custom_setting('workspace')
-    region = app.get_custom_setting('region')
-    extra_feature = app.get_custom_setting('extra_feature')
-    layer_name = app.get_custom_setting('layer_name')
+    geoserver_workspace = custom_setting('workspace')
+    region = custom_setting('region')
+    extra_feature = custom_setting('extra_feature')
+    layer_name = custom_setting('layer_name')
 
     geoserver_endpoint = TextInput(display_text='',
                                    initial=json.dumps([geoserver_base_url, geoserver_workspace,
@@ -96,6 +116,7 @@ def home_standard(request):
     return render(request, '{0}/home.html'.format(base_name), context)
 
 
+@timed
 def ecmwf(request):
 
     # Can Set Default permissions : Only allowed for admin users
@@ -116,12 +137,12 @@ def ecmwf(request):
 
     # Check if we need to hide the WS options dropdown.
     hiddenAttr = ""
-    if app.get_custom_setting('show_dropdown') and app.get_custom_setting('default_model_type') and app.get_custom_setting('default_watershed_name'):
+    if custom_setting('show_dropdown') and custom_setting('default_model_type') and custom_setting('default_watershed_name'):
         hiddenAttr = "hidden"
 
-    default_model = app.get_custom_setting('default_model_type')
+    default_model = custom_setting('default_model_type')
     init_model_val = request.GET.get('model', False) or default_model or 'Select Model'
-    init_ws_val = app.get_custom_setting('default_watershed_name') or 'Select Watershed'
+    init_ws_val = custom_setting('default_watershed_name') or 'Select Watershed'
 
     model_input = SelectInput(display_text='',
                               name='model',
@@ -135,24 +156,20 @@ def ecmwf(request):
     geoserver_engine = app.get_spatial_dataset_service(
         name='main_geoserver', as_engine=True)
 
-    geos_username = geoserver_engine.username
-    geos_password = geoserver_engine.password
     my_geoserver = geoserver_engine.endpoint.replace('rest', '')
+    geoserver_workspace = custom_setting('workspace')
 
-    watershed_list = [['Select Watershed', '']]  # + watershed_list
-    res2 = requests.get(my_geoserver + 'rest/workspaces/' + app.get_custom_setting('workspace') +
-                        '/featuretypes.json', auth=HTTPBasicAuth(geos_username, geos_password), verify=False)
-
-    for i in range(len(json.loads(res2.content)['featureTypes']['featureType'])):
-        raw_feature = json.loads(res2.content)['featureTypes']['featureType'][i]['name']
-        if 'drainage_line' in raw_feature and any(n in raw_feature for n in app.get_custom_setting('keywords').replace(' ', '').split(',')):
-            feat_name = raw_feature.split('-')[0].replace('_', ' ').title() + ' (' + \
-                raw_feature.split('-')[1].replace('_', ' ').title() + ')'
-            if feat_name not in str(watershed_list):
-                watershed_list.append([feat_name, feat_name])
+    try:
+        watershed_names = get_watershed_names(my_geoserver, geoserver_engine.username, geoserver_engine.password,
+                                              geoserver_workspace, custom_setting('keywords'))
+        watershed_error = None
+    except Exception as e:
+        print(str(e))
+        watershed_names, watershed_error = [], str(e)
+    watershed_list = [['Select Watershed', '']] + [[name, name] for name in watershed_names]
 
     # Add the default WS if present and not already in the list
-    if default_model == 'ECMWF-RAPID' and init_ws_val and init_ws_val not in str(watershed_list):
+    if default_model == 'ECMWF-RAPID' and init_ws_val and init_ws_val not in watershed_names:
         watershed_list.append([init_ws_val, init_ws_val])
 
     watershed_select = SelectInput(display_text='',
@@ -165,21 +182,14 @@ def ecmwf(request):
                                    )
 
     zoom_info = TextInput(display_text='',
-                          initial=json.dumps(app.get_custom_setting('zoom_info')),
+                          initial=json.dumps(custom_setting('zoom_info')),
                           name='zoom_info',
                           disabled=True)
 
-    # Retrieve a geoserver engine and geoserver credentials.
-    geoserver_engine = app.get_spatial_dataset_service(
-        name='main_geoserver', as_engine=True)
-
-    my_geoserver = geoserver_engine.endpoint.replace('rest', '')
-
     geoserver_base_url = my_geoserver
-    geoserver_workspace = app.get_custom_setting('workspace')
-    region = app.get_custom_setting('region')
-    extra_feature = app.get_custom_setting('extra_feature')
-    layer_name = app.get_custom_setting('layer_name')
+    region = custom_setting('region')
+    extra_feature = custom_setting('extra_feature')
+    layer_name = custom_setting('layer_name')
 
     geoserver_endpoint = TextInput(display_text='',
                                    initial=json.dumps([geoserver_base_url, geoserver_workspace,
@@ -187,18 +197,27 @@ def ecmwf(request):
                                    name='geoserver_endpoint',
                                    disabled=True)
 
+    # Relative prefix of the data urls, 'async/' to load them through the async views
+    views_prefix = TextInput(display_text='',
+                             initial=json.dumps('async/' if custom_setting('async_views') else ''),
+                             name='views_prefix',
+                             disabled=True)
+
     context = {
         "base_name": base_name,
         "model_input": model_input,
         "watershed_select": watershed_select,
         "zoom_info": zoom_info,
         "geoserver_endpoint": geoserver_endpoint,
-        "defaultUpdateButton": defaultUpdateButton
+        "views_prefix": views_prefix,
+        "defaultUpdateButton": defaultUpdateButton,
+        "watershed_error": watershed_error
     }
 
     return render(request, '{0}/ecmwf.html'.format(base_name), context)
 
 
+@timed
 def get_warning_points(request):
     get_data = request.GET
     if get_data['model'] == 'ECMWF-RAPID':
@@ -206,26 +225,44 @@ def get_warning_points(request):
             watershed = get_data['watershed']
             subbasin = get_data['subbasin']
 
-            res20 = requests.get(
-                app.get_custom_setting('api_source') + '/apps/streamflow-prediction-tool/api/GetWarningPoints/?watershed_name=' +
-                watershed + '&subbasin_name=' + subbasin + '&return_period=20',
-                headers={'Authorization': 'Token ' + app.get_custom_setting('spt_token')}, verify=False)
+            warnings = warning_points(custom_setting('api_source'), custom_setting('spt_token'),
+                                      watershed, subbasin)
 
-            res10 = requests.get(
-                app.get_custom_setting('api_source') + '/apps/streamflow-prediction-tool/api/GetWarningPoints/?watershed_name=' +
-                watershed + '&subbasin_name=' + subbasin + '&return_period=10',
-                headers={'Authorization': 'Token ' + app.get_custom_setting('spt_token')}, verify=False)
+            return JsonResponse({
+                "success": "Data analysis complete!",
+                "warning20": warnings[20],
+                "warning10": warnings[10],
+                "warning2": warnings[2]
+            })
+        except Exception as e:
+            print(str(e))
+            return JsonResponse({'error': 'No data found for the selected reach.'})
+    else:
+        pass
+
+
+@timed
+def get_warning_points_bbox(request):
+    """
+    Returns only the warning points inside the map extent, clustered at low zoom levels
+    """
+    get_data = request.GET
+    if get_data['model'] == 'ECMWF-RAPID':
+        try:
+            watershed = get_data['watershed']
+            subbasin = get_data['subbasin']
+            bbox = [float(n) for n in get_data['bbox'].split(',')]
+            zoom = float(get_data['zoom'])
 
-            res2 = requests.get(
-                app.get_custom_setting('api_source') + '/apps/streamflow-prediction-tool/api/GetWarningPoints/?watershed_name=' +
-                watershed + '&subbasin_name=' + subbasin + '&return_period=2',
-                headers={'Authorization': 'Token ' + app.get_custom_setting('spt_token')}, verify=False)
+            warnings = warning_points(custom_setting('api_source'), custom_setting('spt_token'),
+                                      watershed, subbasin)
+            visible = warning_index(watershed, subbasin, warnings).visible(bbox, zoom)
 
             return JsonResponse({
                 "success": "Data analysis complete!",
-                "warning20": json.loads(res20.content)["features"],
-                "warning10": json.loads(res10.content)["features"],
-                "warning2": json.loads(res2.content)["features"]
+                "warning20": visible[20],
+                "warning10": visible[10],
+                "warning2": visible[2]
             })
         except Exception as e:
             print(str(e))
@@ -234,34 +271,94 @@ def get_warning_points(request):
         pass
 
 
+@timed
+@conditional(forecast_plot_validators)
 def ecmwf_get_time_series(request):
+    import geoglows
+
     get_data = request.GET
     try:
         # model = get_data['model']
         comid = get_data['comid']
-        tot_drain_area = get_data['tot_drain_area']
-
+        tot_drain_area = reach_drain_area(comid, get_data.get('tot_drain_area'))
+        compact = get_data.get('format') == 'compact'
 
         # New api
-        stats = geoglows.streamflow.forecast_stats(comid)
-        ensembles = geoglows.streamflow.forecast_ensembles(comid)
-        r_periods = geoglows.streamflow.return_periods(comid)
+        stats = streamflow('forecast_stats', comid)
+        r_periods = reach_return_periods(comid)
 
-        forecast_plot = geoglows.streamflow.forecast_plot(stats, r_periods, reach_id=comid, drain_area=tot_drain_area+" km<sup>2</sup>",
-                                                          outformat='plotly_html')
-        prob_table = geoglows.streamflow.probabilities_table(stats, ensembles, r_periods)
+        with phase('plotting'):
+            forecast_plot = geoglows.streamflow.forecast_plot(stats, r_periods, reach_id=comid, drain_area=tot_drain_area+" km<sup>2</sup>",
+                                                              outformat='plotly' if compact else 'plotly_html')
+        if compact:
+            forecast_plot = compact_figure(forecast_plot)
+        prob_table = probabilities_table(comid)
 
         return JsonResponse(dict(plot=forecast_plot, table=prob_table))
 
     except Exception as e:
         print(str(e))
-        return JsonResponse({'error': 'No data found for the selected reach.'})
+        return error_response('No data found for the selected reach.')
 
 
+@timed
 def get_time_series(request):
     return ecmwf_get_time_series(request)
 
 
+@timed
+def get_reach_bundle(request):
+    """
+    Returns the forecast, historic, flow duration and seasonal views of a reach in one response
+    """
+    get_data = request.GET
+
+    try:
+        comid = get_data['comid']
+        tot_drain_area = reach_drain_area(comid, get_data.get('tot_drain_area'))
+
+        bundle = reach_bundle(comid, tot_drain_area, get_data.get('format') == 'compact')
+        if all(bundle[view] is None for view in ('forecast', 'table', 'historic', 'fdc', 'seasonal')):
+            return JsonResponse({'error': 'No data found for the selected reach.'})
+
+        return JsonResponse(bundle)
+
+    except Exception as e:
+        print(str(e))
+        return JsonResponse({'error': 'No data found for the selected reach.'})
+
+
+@timed
+def get_reach(request):
+    """
+    Returns the attributes of the drainage line nearest to a point of the map, from the index of the layer
+    """
+    get_data = request.GET
+
+    try:
+        lon = float(get_data['lon'])
+        lat = float(get_data['lat'])
+        tolerance = min(float(get_data.get('tolerance', DEFAULT_TOLERANCE)), MAX_TOLERANCE)
+
+        geoserver_engine = app.get_spatial_dataset_service(
+            name='main_geoserver', as_engine=True)
+        index = reach_index(app.get_app_workspace().path, geoserver_engine.endpoint.replace('rest', ''),
+                            custom_setting('workspace'), custom_setting('layer_name'))
+
+        nearest = index.nearest(lon, lat, tolerance)
+        if nearest is None:
+            return JsonResponse({'error': 'No reach found at the selected point.'})
+        properties, distance = nearest
+
+        return JsonResponse({'properties': properties, 'distance': distance,
+                             'reach': catalogue.get(properties['COMID'])})
+
+    except Exception as e:
+        print(str(e))
+        return JsonResponse({'error': 'No reach found at the selected point.'})
+
+
+@timed
 def get_available_dates(request):
     get_data = request.GET
 
@@ -269,84 +366,118 @@ def get_available_dates(request):
     comid = int(comid)
 
     # New api
-    avail_dates = geoglows.streamflow.available_dates(comid)
-
+    avail_dates = available_dates(comid)
 
     return JsonResponse(avail_dates)
 
 
+@timed
+@conditional(historic_plot_validators)
 def get_historic_data(request):
     """""
     Returns ERA Interim hydrograph
     """""
+    import geoglows
 
     get_data = request.GET
 
     try:
         comid = get_data['comid']
-        tot_drain_area = get_data['tot_drain_area']
+        tot_drain_area = reach_drain_area(comid, get_data.get('tot_drain_area'))
+        compact = get_data.get('format') == 'compact'
 
+        # New api, the historic simulation first so that a reach new to the store gets fitted
+        historic_sim = historic_simulation(comid)
+        rperiods = reach_return_periods(comid)
 
-        # New api
-        rperiods = geoglows.streamflow.return_periods(comid)
-        historic_sim = geoglows.streamflow.historic_simulation(comid)
+        with phase('plotting'):
+            historic_plot = geoglows.streamflow.historical_plot(historic_sim, rperiods, reach_id=comid,
+                                                                drain_area=tot_drain_area+" km<sup>2</sup>",
+                                                                outformat='plotly' if compact else 'plotly_html')
+        if compact:
+            historic_plot = compact_figure(historic_plot)
 
-        return JsonResponse(dict(plot=geoglows.streamflow.historical_plot(historic_sim,
-                    rperiods, reach_id=comid, drain_area=tot_drain_area+" km<sup>2</sup>", outformat='plotly_html')))
+        return JsonResponse(dict(plot=historic_plot))
 
     except Exception as e:
         print(str(e))
-        return JsonResponse({'error': 'No historic data found for the selected reach.'})
+        return error_response('No historic data found for the selected reach.')
 
 
+@timed
+@conditional(historic_plot_validators)
 def get_flow_duration_curve(request):
     get_data = request.GET
 
     try:
         # model = get_data['model']
-        watershed = get_data['watershed']
-        subbasin = get_data['subbasin']
         comid = get_data['comid']
-        tot_drain_area = get_data['tot_drain_area']
-        region = get_data['region']
-        units = 'metric'
-
-        # New api
-        historic_sim = geoglows.streamflow.historic_simulation(comid)
-        flow_dur = geoglows.streamflow.flow_duration_curve_plot(historic_sim, drain_area=tot_drain_area+" km<sup>2</sup>",
-                                                                outformat='plotly_html')
+        tot_drain_area = reach_drain_area(comid, get_data.get('tot_drain_area'))
+        compact = get_data.get('format') == 'compact'
 
+        curve = flow_duration_curve(comid)
+        with phase('plotting'):
+            flow_dur = flow_duration_curve_figure(curve, tot_drain_area+" km<sup>2</sup>")
+        flow_dur = compact_figure(flow_dur) if compact else figure_html(flow_dur)
 
         return JsonResponse(dict(plot=flow_dur))
 
     except Exception as e:
         print(str(e))
-        return JsonResponse({'error': 'No historic data found for calculating flow duration curve.'})
+        return error_response('No historic data found for calculating flow duration curve.')
+
 
+@timed
+@conditional(historic_validators)
+def get_flow_duration_data(request):
+    """
+    Returns the flow duration curve of a reach as typed arrays, for the exceedance probabilities (%) requested
+    and optionally for every month
+    """
+    get_data = request.GET
+
+    try:
+        comid = get_data['comid']
+        monthly = get_data.get('monthly', 'false').lower() == 'true'
+        if get_data.get('exceedance'):
+            exceedance = [float(p) for p in get_data['exceedance'].split(',')]
+        else:
+            exceedance = DEFAULT_EXCEEDANCE
 
+        curve = flow_duration_curve(comid, exceedance, monthly)
+
+        data = {'exceedance': encode_array(curve['exceedance']), 'flow': encode_array(curve['flow'])}
+        if monthly:
+            data['monthly'] = {month: encode_array(flows) for month, flows in curve['monthly'].items()}
+        return JsonResponse(data)
+
+    except Exception as e:
+        print(str(e))
+        return error_response('No historic data found for calculating flow duration curve.')
+
+
+@timed
+@conditional(historic_plot_validators)
 def get_seasonal_avg_curve(request):
     get_data = request.GET
 
     try:
         # model = get_data['model']
-        watershed = get_data['watershed']
-        subbasin = get_data['subbasin']
         comid = get_data['comid']
-        tot_drain_area = get_data['tot_drain_area']
-        region = get_data['region']
-        units = 'metric'
-
-        # New api
-        seasonal_avg = geoglows.streamflow.seasonal_average(comid)
-        seasonal_plot = geoglows.streamflow.seasonal_plot(seasonal_avg, drain_area=tot_drain_area+" km<sup>2</sup>",
-                                                          outformat='plotly_html')
+        tot_drain_area = reach_drain_area(comid, get_data.get('tot_drain_area'))
+        units = get_data.get('units', 'metric')
+        compact = get_data.get('format') == 'compact'
 
+        seasonal_avg = seasonal_average(comid)
+        with phase('plotting'):
+            seasonal_plot = seasonal_figure(seasonal_avg, tot_drain_area+" km<sup>2</sup>", units)
+        seasonal_plot = compact_figure(seasonal_plot) if compact else figure_html(seasonal_plot)
 
         return JsonResponse(dict(plot=seasonal_plot))
 
     except Exception as e:
         print(str(e))
-        return JsonResponse({'error': 'No historic data found for calculating flow duration curve.'})
+        return error_response('No historic data found for calculating flow duration curve.')
 
 
 def get_return_period_ploty_info(request, datetime_start, datetime_end,
@@ -447,6 +578,8 @@ def get_return_period_ploty_info(request, datetime_start, datetime_end,
     return shapes, annotations
 
 
+@timed
+@conditional(historic_validators)
 def get_historic_data_csv(request):
     """""
     Returns ERA Interim data as csv
@@ -459,29 +592,20 @@ def get_historic_data_csv(request):
         watershed = get_data['watershed_name']
         subbasin = get_data['subbasin_name']
         comid = get_data['reach_id']
+        compress = get_data.get('compression') == 'gzip'
 
-        # New api
-        historic_sim = geoglows.streamflow.historic_simulation(comid, 'o314noias', return_format='request',
-                                                               endpoint=geoglows.streamflow.BYU_ENDPOINT)
-        qout_data = historic_sim.content.decode('utf-8').splitlines()
-
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = 'attachment; filename=historic_streamflow_{0}.csv'.format(comid)
-
-        writer = csv_writer(response)
-
-        writer.writerow(['datetime', 'streamflow (m3/s)'])
+        historic_sim = historic_simulation(comid)
 
-        for row_data in qout_data:
-            writer.writerow(row_data.split(','))
-
-        return response
+        return csv_download(series_csv_chunks(historic_sim, 'datetime,streamflow (m3/s)'),
+                            'historic_streamflow_{0}.csv'.format(comid), compress)
 
     except Exception as e:
         print(str(e))
-        return JsonResponse({'error': 'No historic data found.'})
+        return error_response('No historic data found.')
 
 
+@timed
+@conditional(forecast_validators)
 def get_forecast_data_csv(request):
     """""
     Returns Forecast data as csv
@@ -494,145 +618,189 @@ def get_forecast_data_csv(request):
         watershed = get_data['watershed_name']
         subbasin = get_data['subbasin_name']
         comid = get_data['reach_id']
-        if get_data['startdate'] != '':
+        if get_data.get('startdate', '') != '':
             startdate = get_data['startdate']
         else:
             startdate = 'most_recent'
+        compress = get_data.get('compression') == 'gzip'
 
         # New api
-        forecast_stats = geoglows.streamflow.forecast_stats(comid, return_format='request',
-                                                            endpoint=geoglows.streamflow.BYU_ENDPOINT)
+        date = forecast_date(startdate)
+        chunks = forecast_stats_chunks(comid, date)
 
+        init_time = date or forecast_cycle(comid).split('.')[0]
+        return csv_download(chunks, 'streamflow_forecast_{0}_{1}.csv'.format(comid, init_time), compress)
 
-        qout_data = forecast_stats.content.decode('utf-8').splitlines()
-
-        init_time = qout_data[0].split(',')[0].split(' ')[0]
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = 'attachment; filename=streamflow_forecast_{0}_{1}.csv'.format(comid, init_time)
+    except Exception as e:
+        print(str(e))
+        return error_response('No forecast data found.')
 
-        writer = csv_writer(response)
-        #writer.writerow(['datetime', 'high_res (m3/s)', 'max (m3/s)', 'mean (m3/s)', 'min (m3/s)', 'std_dev_range_lower (m3/s)',
-                         #'std_dev_range_upper (m3/s)'])
 
-        for row_data in qout_data:
-            writer.writerow(row_data.split(','))
+@timed
+def bulk_export(request):
+    """
+    Returns the historic or forecast data of many reaches, as a zip archive or, for historic data, one wide csv
+    """
+    get_data = request.GET
 
+    try:
+        kind = get_data.get('kind', 'historic')
+        out_format = get_data.get('format', 'zip')
+        if kind not in ('historic', 'forecast') or out_format not in ('zip', 'wide'):
+            return JsonResponse({'error': 'Unknown export kind or format.'}, status=400)
+        if kind == 'forecast' and out_format == 'wide':
+            return JsonResponse({'error': 'Forecasts can only be exported as a zip archive.'}, status=400)
+
+        if get_data.get('reach_ids'):
+            reach_ids = [int(n) for n in get_data['reach_ids'].replace(' ', '').split(',') if n]
+        else:
+            reach_ids = subbasin_reaches(get_data['watershed'], get_data['subbasin'])
+        max_reaches = MAX_BULK_REACHES if out_format == 'zip' else MAX_WIDE_REACHES
+        if not reach_ids or len(reach_ids) > max_reaches:
+            return JsonResponse({'error': 'Select between 1 and {0} reaches.'.format(max_reaches)}, status=400)
+
+        if out_format == 'zip':
+            response = StreamingHttpResponse(zip_chunks(reach_ids, kind), content_type='application/zip')
+            response['Content-Disposition'] = 'attachment; filename={0}_streamflow.zip'.format(kind)
+            return response
+
+        missing = len(missing_reaches(reach_ids))
+        if missing > MAX_WIDE_DOWNLOADS:
+            return JsonResponse({'error': '{0} of the selected reaches have no historic simulation on the server yet '
+                                          'and a wide csv downloads at most {1}. Export them as a zip archive '
+                                          'first, or select fewer reaches.'.format(missing, MAX_WIDE_DOWNLOADS)},
+                                status=400)
+
+        errors, chunks = wide_historic(reach_ids)
+        response = csv_download(chunks, 'historic_streamflow.csv', get_data.get('compression') == 'gzip')
+        if errors:
+            response['X-Failed-Reaches'] = ','.join(str(comid) for comid in sorted(errors))
         return response
 
     except Exception as e:
         print(str(e))
-        return JsonResponse({'error': 'No forecast data found.'})
-
-
-# def get_daily_seasonal_streamflow_chart(request):
-#     """
-#     Returns daily seasonal streamflow chart for unique river ID
-#     """
-#     units = request.GET.get('units')
-#     seasonal_data_file, river_id, watershed_name, subbasin_name =\
-#         validate_historical_data(request.GET,
-#                                  "seasonal_average*.nc",
-#                                  "Seasonal Average")
-#
-#     with rivid_exception_handler('Seasonal Average', river_id):
-#         with xarray.open_dataset(seasonal_data_file) as seasonal_nc:
-#             seasonal_data = seasonal_nc.sel(rivid=river_id)
-#             base_date = datetime.datetime(2017, 1, 1)
-#             day_of_year = \
-#                 [base_date + datetime.timedelta(days=ii)
-#                  for ii in range(seasonal_data.dims['day_of_year'])]
-#             season_avg = seasonal_data.average_flow.values
-#             season_std = seasonal_data.std_dev_flow.values
-#
-#             season_avg[season_avg < 0] = 0
-#
-#             avg_plus_std = season_avg + season_std
-#             avg_min_std = season_avg - season_std
-#
-#             avg_plus_std[avg_plus_std < 0] = 0
-#             avg_min_std[avg_min_std < 0] = 0
-#
-#     if units == 'english':
-#         # convert from m3/s to ft3/s
-#         season_avg *= M3_TO_FT3
-#         avg_plus_std *= M3_TO_FT3
-#         avg_min_std *= M3_TO_FT3
-#
-#     # generate chart
-#     avg_scatter = go.Scatter(
-#         name='Average',
-#         x=day_of_year,
-#         y=season_avg,
-#         line=dict(
-#             color='#0066ff'
-#         )
-#     )
-#
-#     std_plus_scatter = go.Scatter(
-#         name='Std. Dev. Upper',
-#         x=day_of_year,
-#         y=avg_plus_std,
-#         fill=None,
-#         mode='lines',
-#         line=dict(
-#             color='#98fb98'
-#         )
-#     )
-#
-#     std_min_scatter = go.Scatter(
-#         name='Std. Dev. Lower',
-#         x=day_of_year,
-#         y=avg_min_std,
-#         fill='tonexty',
-#         mode='lines',
-#         line=dict(
-#             color='#98fb98',
-#         )
-#     )
-#
-#     layout = go.Layout(
-#         title="Daily Seasonal Streamflow<br>"
-#               "<sub>{0} ({1}): {2}</sub>"
-#               .format(watershed_name, subbasin_name, river_id),
-#         xaxis=dict(
-#             title='Day of Year',
-#             tickformat="%b"),
-#         yaxis=dict(
-#             title='Streamflow ({}<sup>3</sup>/s)'
-#                   .format(get_units_title(units)))
-#     )
-#
-#     chart_obj = PlotlyView(
-#         go.Figure(data=[std_plus_scatter,
-#                         std_min_scatter,
-#                         avg_scatter],
-#                   layout=layout)
-#     )
-#
-#     context = {
-#         'gizmo_object': chart_obj,
-#     }
-#
-#     return render(request,
-#                   'streamflow_prediction_tool/gizmo_ajax.html',
-#                   context)
+        return JsonResponse({'error': 'No data found for the selected reaches.'})
+
 
+@timed
 def setDefault(request):
     get_data = request.GET
     set_custom_setting(get_data.get('ws_name'), get_data.get('model_name'))
     return JsonResponse({'success': True})
 
 
-def get_units_title(unit_type):
+@timed
+def refresh_watersheds(request):
+    """
+    Reloads the watershed catalogue and the drainage line index from GeoServer. Only allowed for admin users
+    """
+    if not has_permission(request, 'update_default'):
+        return JsonResponse({'error': 'Only administrators can refresh the watershed list.'}, status=403)
+
+    geoserver_engine = app.get_spatial_dataset_service(
+        name='main_geoserver', as_engine=True)
+
+    try:
+        watershed_names = get_watershed_names(geoserver_engine.endpoint.replace('rest', ''),
+                                              geoserver_engine.username, geoserver_engine.password,
+                                              custom_setting('workspace'), custom_setting('keywords'), refresh=True)
+    except Exception as e:
+        print(str(e))
+        return JsonResponse({'error': str(e)}, status=502)
+    reach_index(app.get_app_workspace().path, geoserver_engine.endpoint.replace('rest', ''),
+                custom_setting('workspace'), custom_setting('layer_name'), refresh=True)
+    return JsonResponse({'success': True, 'watersheds': watershed_names})
+
+
+@timed
+def update_return_periods(request):
+    """
+    Fits the return periods of the given comma separated reaches, or of every reach in the historic store, and
+    saves them to the lookup table. Only allowed for admin users
+    """
+    if not has_permission(request, 'update_default'):
+        return JsonResponse({'error': 'Only administrators can update the return periods.'}, status=403)
+
+    try:
+        comids = [n for n in request.GET.get('comids', '').replace(' ', '').split(',') if n]
+        for comid in comids:
+            historic_simulation(comid)
+        updated = return_period_table.update(comids or historic_store.comids())
+        return JsonResponse({'success': True, 'reaches': updated})
+
+    except Exception as e:
+        print(str(e))
+        return JsonResponse({'error': 'The return periods could not be updated.'})
+
+
+@timed
+def update_reach_catalogue(request):
+    """
+    Loads the reach catalogue from the drainage line layer, downloading it again if refresh is set. Only
+    allowed for admin users
+    """
+    if not has_permission(request, 'update_default'):
+        return JsonResponse({'error': 'Only administrators can update the reach catalogue.'}, status=403)
+
+    try:
+        geoserver_engine = app.get_spatial_dataset_service(
+            name='main_geoserver', as_engine=True)
+        features = layer_features(app.get_app_workspace().path, geoserver_engine.endpoint.replace('rest', ''),
+                                  custom_setting('workspace'), custom_setting('layer_name'),
+                                  request.GET.get('refresh', 'false').lower() == 'true')
+        # Layers without watershed attributes are all in the region of the app, e.g. nile-ethiopia
+        watershed, subbasin = region_subbasin(custom_setting('region'))
+        count = catalogue.load(features, watershed, subbasin, replace=True)
+
+        return JsonResponse({'success': True, 'reaches': count})
+
+    except Exception as e:
+        print(str(e))
+        return JsonResponse({'error': 'The reach catalogue could not be updated.'})
+
+
+@timed
+def ingest_region_forecast(request):
+    """
+    Loads the region forecast of a cycle (the cycle parameter, or else the most recent cycle of the sentinel
+    reach) into the forecast store. Only allowed for admin users
+    """
+    if not has_permission(request, 'update_default'):
+        return JsonResponse({'error': 'Only administrators can ingest the region forecast.'}, status=403)
+
+    try:
+        forecast_url = custom_setting('region_forecast_url')
+        if not forecast_url:
+            return JsonResponse({'error': 'The region forecast url is not set.'})
+        cycle = request.GET.get('cycle') or forecast_cycle(int(custom_setting('sentinel_reach')))
+        count = ingest_forecast(forecast_url, cycle)
+
+        return JsonResponse({'success': True, 'cycle': cycle, 'reaches': count})
+
+    except Exception as e:
+        print(str(e))
+        return JsonResponse({'error': 'The region forecast could not be ingested.'})
+
+
+@timed
+def prefetch_status(request):
     """
-    Get the title for units
+    Reports the progress of the background forecast prefetch. Only allowed for admin users
     """
-    units_title = "m"
-    if unit_type == 'english':
-        units_title = "ft"
-    return units_title
+    if not has_permission(request, 'update_default'):
+        return JsonResponse({'error': 'Only administrators can see the prefetch status.'}, status=403)
 
+    return JsonResponse(scheduler.status())
 
+
+def metrics(request):
+    """
+    Latency, upstream time, response size and cache metrics of every worker process in the Prometheus text format
+    """
+    return HttpResponse(exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@timed
 def forecastpercent(request):
 
     # Check if its an ajax post request
@@ -646,81 +814,30 @@ def forecastpercent(request):
             forecast = 'most_recent'
         else:
             forecast = str(date)
-        # res = requests.get(app.get_custom_setting('api_source') + '/apps/streamflow-prediction-tool/api/GetWatersheds/',
-            #                    headers={'Authorization': 'Token ' + app.get_custom_setting('spt_token')})
+        # res = requests.get(custom_setting('api_source') + '/apps/streamflow-prediction-tool/api/GetWatersheds/',
+            #                    headers={'Authorization': 'Token ' + custom_setting('spt_token')})
         request_params = dict(watershed_name=watershed, subbasin_name=subbasin, reach_id=reach,
                               forecast_folder=forecast)
-        request_headers = dict(Authorization='Token ' + app.get_custom_setting('spt_token'))
-        ens = requests.get(app.get_custom_setting('api_source') + '/apps/streamflow-prediction-tool/api/GetEnsemble/',
-                           params=request_params, headers=request_headers, verify=False)
-
-        request_params1 = dict(watershed_name=watershed, subbasin_name=subbasin, reach_id=reach)
-        rpall = requests.get(app.get_custom_setting('api_source') + '/apps/streamflow-prediction-tool/api/GetReturnPeriods/',
-                             params=request_params1, headers=request_headers, verify=False)
-
-        dicts = ens.content.splitlines()
-        dictstr = []
-
-        rpdict = ast.literal_eval(rpall.content.decode('utf-8'))
-        rpdict.pop('max', None)
-
-        rivperc = {}
-        riverpercent = {}
-        rivpercorder = {}
-
-        for q in rpdict:
-            rivperc[q] = {}
-            riverpercent[q] = {}
-
-        dictlen = len(dicts)
-        for i in range(1, dictlen):
-            dictstr.append(dicts[i].decode('utf-8').split(","))
-
-        for rps in rivperc:
-            rp = float(rpdict[rps])
-            for b in dictstr:
-                date = b[0][:10]
-                if date not in rivperc[rps]:
-                    rivperc[rps][date] = []
-                length = len(b)
-                for x in range(1, length):
-                    flow = float(b[x])
-                    if x not in rivperc[rps][date] and flow > rp:
-                        rivperc[rps][date].append(x)
-            for e in rivperc[rps]:
-                riverpercent[rps][e] = float(len(rivperc[rps][e])) / 51.0 * 100
-
-        for keyss in rivperc:
-            data = riverpercent[keyss]
-            ordered_data = sorted(list(data.items()), key=lambda x: dt.datetime.strptime(x[0], '%Y-%m-%d'))
-            rivpercorder[keyss] = ordered_data
-
-        rivdates = []
-        rivperctwo = []
-        rivpercten = []
-        rivperctwenty = []
-
-        for a in rivpercorder['two']:
-            rivdates.append(a[0])
-            rivperctwo.append(a[1])
-
-        for s in rivpercorder['ten']:
-            rivpercten.append(s[1])
-
-        for d in rivpercorder['twenty']:
-            rivperctwenty.append(d[1])
-
-        formatteddates = [str(elem)[-4:] for elem in rivdates]
-        formattedtwo = ["%.0f" % elem for elem in rivperctwo]
-        formattedten = ["%.0f" % elem for elem in rivpercten]
-        formattedtwenty = ["%.0f" % elem for elem in rivperctwenty]
-
-        formatteddates = formatteddates[:len(formatteddates) - 5]
-        formattedtwo = formattedtwo[:len(formattedtwo) - 5]
-        formattedten = formattedten[:len(formattedten) - 5]
-        formattedtwenty = formattedtwenty[:len(formattedtwenty) - 5]
-
-        dataformatted = {'percdates': formatteddates, 'two': formattedtwo, 'ten': formattedten,
-                         'twenty': formattedtwenty}
-
-        return JsonResponse(dataformatted)
+        request_headers = dict(Authorization='Token ' + custom_setting('spt_token'))
+
+        # The most recent forecast comes from the forecast store, shared with the forecast plot and table
+        if forecast == 'most_recent':
+            timesteps, flows = ensemble_arrays(reach)
+            flows = flows.T
+        else:
+            with upstream('spt'):
+                ens = session.get(custom_setting('api_source') + '/apps/streamflow-prediction-tool/api/GetEnsemble/',
+                                  params=request_params, headers=request_headers, verify=False)
+            timesteps, flows = read_ensemble_csv(ens.content)
+
+        thresholds = lookup_return_periods(reach)
+        if thresholds is not None:
+            rpdict = {'two': thresholds[2], 'ten': thresholds[10], 'twenty': thresholds[20]}
+        else:
+            request_params1 = dict(watershed_name=watershed, subbasin_name=subbasin, reach_id=reach)
+            with upstream('spt'):
+                rpall = session.get(custom_setting('api_source') + '/apps/streamflow-prediction-tool/api/GetReturnPeriods/',
+                                    params=request_params1, headers=request_headers, verify=False)
+            rpdict = read_return_periods(rpall.content)
+
+        return JsonResponse(percent_table(timesteps, flows, rpdict))
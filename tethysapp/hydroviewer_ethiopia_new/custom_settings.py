@@ -0,0 +1,87 @@
+import os
+import threading
+import time
+
+from .app import HydroviewerEthiopiaNew as app
+
+# File of the app workspace rewritten whenever the app changes its own settings
+VERSION_FILE = 'settings.version'
+# Settings edited elsewhere (e.g. the Tethys admin pages) do not touch the version file, they are picked up
+# after this many seconds
+SETTINGS_TTL = 5 * 60
+# Seconds between two reads of the version file by a process
+VERSION_CHECK_INTERVAL = 1
+
+
+class SettingsSnapshot(object):
+    """
+    Custom settings of the app kept in memory, so that a page render does not query the database once per
+    setting. Each setting is read from the database the first time it is used, then served from memory until
+    the version file changes (every worker process sees it within VERSION_CHECK_INTERVAL, see invalidate) or ttl
+    seconds have passed.
+    """
+
+    def __init__(self, version_path, ttl=SETTINGS_TTL):
+        self.version_path = version_path
+        self.ttl = ttl
+        self._values = {}
+        self._version = None
+        self._loaded = 0
+        self._seen = None
+        self._checked = 0
+        self._lock = threading.Lock()
+
+    def _current_version(self):
+        now = time.time()
+        with self._lock:
+            if now - self._checked < VERSION_CHECK_INTERVAL:
+                return self._seen
+        try:
+            with open(self.version_path) as f:
+                version = f.read()
+        except OSError:
+            version = None
+        with self._lock:
+            self._seen, self._checked = version, now
+        return version
+
+    def get(self, name):
+        version = self._current_version()
+        with self._lock:
+            if version != self._version or time.time() - self._loaded > self.ttl:
+                self._values = {}
+                self._version = version
+                self._loaded = time.time()
+            if name in self._values:
+                return self._values[name]
+
+        value = app.get_custom_setting(name)
+        with self._lock:
+            if self._version == version:
+                self._values[name] = value
+        return value
+
+    def invalidate(self):
+        """
+        Writes a new version, so that every process reads the settings from the database again.
+        """
+        version = '{0}-{1}'.format(time.time(), os.getpid())
+        tmp_path = '{0}.{1}.{2}.tmp'.format(self.version_path, os.getpid(), threading.get_ident())
+        with open(tmp_path, 'w') as f:
+            f.write(version)
+        os.replace(tmp_path, self.version_path)
+        with self._lock:
+            self._values = {}
+            self._version = None
+            # This process sees its own change at once
+            self._seen, self._checked = version, time.time()
+
+
+settings_snapshot = SettingsSnapshot(os.path.join(app.get_app_workspace().path, VERSION_FILE))
+
+
+def custom_setting(name):
+    """
+    Returns app.get_custom_setting(name), served from the settings snapshot.
+    """
+    return settings_snapshot.get(name)
@@ -0,0 +1,86 @@
+import re
+import zlib
+
+from django.http import StreamingHttpResponse
+
+from .metrics import upstream
+from .upstream import session
+
+# Rows formatted at a time when streaming a series from the historic store
+CSV_ROWS = 4096
+# Bytes read at a time from an upstream body
+UPSTREAM_CHUNK = 64 * 1024
+# (connect, read) timeouts in seconds for upstream downloads
+DOWNLOAD_TIMEOUT = (5, 60)
+
+
+def series_csv_chunks(series, header):
+    """
+    Yields a single column DataFrame (such as the memory-mapped historic simulation) as csv, a block of rows
+    at a time.
+    """
+    yield (header + '\n').encode('utf-8')
+    values = series.iloc[:, 0].values
+    for start in range(0, len(values), CSV_ROWS):
+        dates = series.index[start:start + CSV_ROWS].strftime('%Y-%m-%d %H:%M:%S')
+        block = values[start:start + CSV_ROWS].astype(str)
+        yield ''.join('{0},{1}\n'.format(d, v) for d, v in zip(dates, block)).encode('utf-8')
+
+
+def forecast_date(startdate):
+    """
+    Returns the YYYYMMDD date expected by the forecast API from a date picked in the app (e.g. 20200610.00
+    or 2020-06-10), or None for the most recent forecast.
+    """
+    if not startdate or startdate == 'most_recent':
+        return None
+    digits = re.sub(r'[^0-9]', '', startdate.split('.')[0])
+    if len(digits) < 8:
+        raise ValueError('Invalid forecast date: {0}'.format(startdate))
+    return digits[:8]
+
+
+def forecast_stats_chunks(comid, date=None):
+    """
+    Opens the forecast stats csv of a reach and returns a generator passing the upstream body through in chunks.
+    """
+    import geoglows
+
+    params = {'reach_id': comid, 'return_format': 'csv'}
+    if date is not None:
+        params['date'] = date
+    with upstream('geoglows'):
+        res = session.get(geoglows.streamflow.BYU_ENDPOINT + 'ForecastStats/', params=params, stream=True,
+                          timeout=DOWNLOAD_TIMEOUT)
+    res.raise_for_status()
+
+    def chunks():
+        try:
+            for chunk in res.iter_content(chunk_size=UPSTREAM_CHUNK):
+                yield chunk
+        finally:
+            res.close()
+
+    return chunks()
+
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def csv_download(chunks, filename, compress=False):
+    """
+    Streams csv chunks as a file download, gzipped into filename.gz if compress is set.
+    """
+    if compress:
+        response = StreamingHttpResponse(gzip_chunks(chunks), content_type='application/gzip')
+        filename += '.gz'
+    else:
+        response = StreamingHttpResponse(chunks, content_type='text/csv')
+    response['Content-Disposition'] = 'attachment; filename={0}'.format(filename)
+    return response
@@ -0,0 +1,270 @@
+import os
+import re
+import shutil
+import threading
+import warnings
+
+import numpy as np
+import pandas as pd
+
+# Directory of the store holding, per cycle, the ensembles of the reaches downloaded one at a time
+REACHES_DIR = 'reaches'
+# Forecast cycles kept on disk, the most recent ones
+KEEP_CYCLES = 2
+# Reaches read from the NetCDF file at a time while ingesting it
+REACH_CHUNK = 2048
+
+# Names in the region forecast files: a flow variable with reach, ensemble member and time dimensions
+FLOW_VARIABLE = 'Qout'
+REACH_DIMENSION = 'rivid'
+ENSEMBLE_DIMENSION = 'ensemble'
+TIME_DIMENSION = 'time'
+# Id of the high resolution run, the statistics are computed over the other members. The flows of the store
+# have one row per member id, member n being row n - 1, so the row of a member missing from a forecast is nan.
+HIGH_RES_MEMBER = 52
+ENSEMBLE_COLUMN = re.compile(r'^ensemble_(\d+)_')
+
+STATS_COLUMNS = ('flow_25%_m^3/s', 'flow_75%_m^3/s', 'flow_avg_m^3/s', 'flow_max_m^3/s', 'flow_med_m^3/s',
+                 'flow_min_m^3/s', 'high_res_m^3/s')
+
+
+def ensemble_column(member):
+    return 'ensemble_{0:02d}_m^3/s'.format(member)
+
+
+def ensembles_frame(times, flows):
+    """
+    Returns the flows of a reach, (members, times), as the DataFrame of geoglows.streamflow.forecast_ensembles.
+    """
+    frame = pd.DataFrame(flows.T, index=pd.DatetimeIndex(times, name='datetime'),
+                         columns=[ensemble_column(m + 1) for m in range(len(flows))])
+    return frame.dropna(how='all')
+
+
+def member_rows(members):
+    """
+    Returns the rows of the flows of the store of the given member ids. Fails if the ids are not unique positive
+    integers or if the high resolution member is not among them.
+    """
+    members = np.asarray(members).astype(np.int64)
+    if len(np.unique(members)) != len(members) or (members < 1).any():
+        raise ValueError('Invalid ensemble member ids: {0}'.format(list(members)))
+    if HIGH_RES_MEMBER not in members:
+        raise ValueError('The forecast has no high resolution member ({0})'.format(HIGH_RES_MEMBER))
+    return members - 1
+
+
+def frame_arrays(ensembles):
+    """
+    Returns (timesteps, flows of shape (members, timesteps)) of a geoglows.streamflow.forecast_ensembles DataFrame,
+    the members being identified by the number in their column names.
+    """
+    columns = [column for column in ensembles.columns if ENSEMBLE_COLUMN.match(column)]
+    rows = member_rows([ENSEMBLE_COLUMN.match(column).group(1) for column in columns])
+    flows = np.full((rows.max() + 1, len(ensembles)), np.nan, dtype=np.float32)
+    flows[rows] = ensembles[columns].to_numpy(dtype=np.float32).T
+    return pd.to_datetime(ensembles.index).values.astype('datetime64[s]'), flows
+
+
+def stats_frame(times, flows):
+    """
+    Returns the statistics of the flows of a reach, (members, times), as the DataFrame of
+    geoglows.streamflow.forecast_stats.
+    """
+    flows = np.asarray(flows, dtype=np.float64)
+    if len(flows) >= HIGH_RES_MEMBER:
+        ensemble, high_res = np.delete(flows, HIGH_RES_MEMBER - 1, axis=0), flows[HIGH_RES_MEMBER - 1]
+    else:
+        ensemble, high_res = flows, np.full(flows.shape[1], np.nan)
+    with warnings.catch_warnings():
+        # Timesteps of the high resolution member only have no ensemble values
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        p25, median, p75 = np.nanpercentile(ensemble, (25, 50, 75), axis=0)
+        columns = (p25, p75, np.nanmean(ensemble, axis=0), np.nanmax(ensemble, axis=0), median,
+                   np.nanmin(ensemble, axis=0), high_res)
+    frame = pd.DataFrame(dict(zip(STATS_COLUMNS, columns)), index=pd.DatetimeIndex(times, name='datetime'),
+                         columns=list(STATS_COLUMNS))
+    return frame.dropna(how='all')
+
+
+def forecast_frame(product, times, flows):
+    """
+    Returns the forecast_stats or forecast_ensembles DataFrame of the flows of a reach, (members, times).
+    """
+    if product == 'forecast_ensembles':
+        return ensembles_frame(times, flows)
+    elif product == 'forecast_stats':
+        return stats_frame(times, flows)
+    raise ValueError('Unknown forecast product: {0}'.format(product))
+
+
+class ForecastStore(object):
+    """
+    Ensemble forecasts, one directory per forecast cycle. The forecast of a whole region holds the sorted reach
+    ids (rivids.npy), the timesteps (times.npy) and the flows as a float32 reach x member x time array
+    (ensembles.npy). Reaches outside of it are saved one at a time under reaches/<cycle>, as a float32
+    member x time array (<comid>.npy) and its timesteps (<comid>.times.npy). The flows are memory-mapped, so
+    every worker process shares them through the page cache and reading a reach only touches its own rows.
+    """
+
+    def __init__(self, path, keep_cycles=KEEP_CYCLES):
+        self.path = path
+        self.keep_cycles = keep_cycles
+        self._open_cycles = {}
+        self._lock = threading.Lock()
+
+    def _dir(self, cycle):
+        return os.path.join(self.path, cycle)
+
+    def cycles(self):
+        if not os.path.isdir(self.path):
+            return []
+        # Skips the directories of cycles being ingested or replaced
+        return sorted(name for name in os.listdir(self.path)
+                      if name != REACHES_DIR and not name.endswith('.tmp') and '.old.' not in name and
+                      os.path.exists(os.path.join(self.path, name, 'ensembles.npy')))
+
+    def _open(self, cycle):
+        try:
+            version = os.stat(os.path.join(self._dir(cycle), 'ensembles.npy')).st_mtime_ns
+        except OSError:
+            return None
+        with self._lock:
+            opened = self._open_cycles.get(cycle)
+            if opened is None or opened[0] != version:
+                directory = self._dir(cycle)
+                opened = (version, np.load(os.path.join(directory, 'rivids.npy')),
+                          np.load(os.path.join(directory, 'times.npy')),
+                          np.load(os.path.join(directory, 'ensembles.npy'), mmap_mode='r'))
+                # Drops the cycles removed since they were opened
+                self._open_cycles = {name: value for name, value in self._open_cycles.items()
+                                     if os.path.isdir(self._dir(name))}
+                self._open_cycles[cycle] = opened
+        return opened[1:]
+
+    def _reach_file(self, comid, cycle):
+        return os.path.join(self.path, REACHES_DIR, cycle, '{0}.npy'.format(int(comid)))
+
+    def ensemble_arrays(self, comid, cycle):
+        """
+        Returns (timesteps, flows of shape (members, timesteps)) of a reach for a forecast cycle, from the region
+        forecast or else the reach's own file, or None if the store does not have the reach.
+        """
+        opened = self._open(cycle)
+        if opened is not None:
+            rivids, times, cube = opened
+            i = np.searchsorted(rivids, int(comid))
+            if i < len(rivids) and rivids[i] == int(comid):
+                return times, np.asarray(cube[i])
+
+        file_path = self._reach_file(comid, cycle)
+        try:
+            flows = np.load(file_path, mmap_mode='r')
+            times = np.load(file_path[:-len('.npy')] + '.times.npy')
+        except (OSError, ValueError):
+            return None
+        return times, flows
+
+    def save_reach(self, comid, cycle, times, flows):
+        """
+        Saves the flows of a reach, (members, timesteps), for a forecast cycle. Returns them as ensemble_arrays
+        does.
+        """
+        file_path = self._reach_file(comid, cycle)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        suffix = '.{0}.{1}.tmp'.format(os.getpid(), threading.get_ident())
+        # The flows are written last, readers only look for the timesteps once the flows are there
+        for path, array in ((file_path[:-len('.npy')] + '.times.npy', np.asarray(times, dtype='datetime64[s]')),
+                            (file_path, np.asarray(flows, dtype=np.float32))):
+            with open(path + suffix, 'wb') as f:
+                np.save(f, array)
+            os.replace(path + suffix, path)
+        return self.ensemble_arrays(comid, cycle)
+
+    def purge(self):
+        """
+        Removes the forecasts of the cycles older than the most recent keep_cycles.
+        """
+        for old in self.cycles()[:-self.keep_cycles]:
+            shutil.rmtree(self._dir(old), ignore_errors=True)
+        reaches_dir = os.path.join(self.path, REACHES_DIR)
+        if os.path.isdir(reaches_dir):
+            for old in sorted(os.listdir(reaches_dir))[:-self.keep_cycles]:
+                shutil.rmtree(os.path.join(reaches_dir, old), ignore_errors=True)
+
+    def ingest(self, nc_path, cycle):
+        """
+        Loads a region forecast NetCDF file as the given cycle, replacing the cycle if it is already stored, and
+        removes the cycles older than the most recent keep_cycles. Returns the number of reaches.
+        """
+        import netCDF4
+
+        os.makedirs(self.path, exist_ok=True)
+        tmp_dir = '{0}.{1}.{2}.tmp'.format(self._dir(cycle), os.getpid(), threading.get_ident())
+        os.makedirs(tmp_dir)
+        try:
+            with netCDF4.Dataset(nc_path) as dataset:
+                flows = dataset.variables[FLOW_VARIABLE]
+                dimensions = flows.dimensions
+                rivids = np.asarray(dataset.variables[REACH_DIMENSION][:], dtype=np.int64)
+                time_variable = dataset.variables[TIME_DIMENSION]
+                times = np.array(netCDF4.num2date(time_variable[:], time_variable.units,
+                                                  only_use_cftime_datetimes=False,
+                                                  only_use_python_datetimes=True), dtype='datetime64[s]')
+                # Member ids from the coordinate variable of the ensemble dimension, else numbered from 1
+                if ENSEMBLE_DIMENSION in dataset.variables:
+                    member_index = member_rows(dataset.variables[ENSEMBLE_DIMENSION][:])
+                else:
+                    member_index = member_rows(np.arange(1, len(dataset.dimensions[ENSEMBLE_DIMENSION]) + 1))
+                in_order = np.array_equal(member_index, np.arange(len(member_index)))
+
+                # Rows of the store are sorted by reach id so that a reach is found by binary search
+                order = np.argsort(rivids, kind='stable')
+                rows = np.empty_like(order)
+                rows[order] = np.arange(len(order))
+                axes = [dimensions.index(name) for name in (REACH_DIMENSION, ENSEMBLE_DIMENSION, TIME_DIMENSION)]
+
+                shape = (len(rivids), int(member_index.max()) + 1, len(times))
+                cube = np.lib.format.open_memmap(os.path.join(tmp_dir, 'ensembles.npy'), mode='w+',
+                                                 dtype=np.float32, shape=shape)
+                if not in_order:
+                    cube[:, np.setdiff1d(np.arange(shape[1]), member_index)] = np.nan
+                for start in range(0, len(rivids), REACH_CHUNK):
+                    index = [slice(None)] * len(dimensions)
+                    index[axes[0]] = slice(start, start + REACH_CHUNK)
+                    chunk = np.ma.filled(flows[tuple(index)].astype(np.float32), np.nan).transpose(axes)
+                    if in_order:
+                        cube[rows[start:start + REACH_CHUNK]] = chunk
+                    else:
+                        cube[rows[start:start + REACH_CHUNK, np.newaxis], member_index] = chunk
+                cube.flush()
+                del cube
+
+            np.save(os.path.join(tmp_dir, 'rivids.npy'), rivids[order])
+            np.save(os.path.join(tmp_dir, 'times.npy'), times)
+            self._replace(tmp_dir, self._dir(cycle))
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+
+        self.purge()
+        return len(rivids)
+
+    def _replace(self, tmp_dir, directory):
+        # Open memory maps of a replaced cycle stay valid until the processes using them reopen the cycle
+        if os.path.exists(directory):
+            old_dir = '{0}.old.{1}'.format(directory, os.getpid())
+            os.replace(directory, old_dir)
+            os.replace(tmp_dir, directory)
+            shutil.rmtree(old_dir, ignore_errors=True)
+        else:
+            os.replace(tmp_dir, directory)
+
+
+def forecast_file_url(url_template, cycle):
+    """
+    Returns the location of the region forecast file of a cycle (e.g. 20200610.00) from a template with {date}
+    (YYYYMMDD), {hour} (HH) and {cycle} placeholders.
+    """
+    date, _, hour = cycle.partition('.')
+    return url_template.format(date=date, hour=hour or '00', cycle=cycle)
@@ -0,0 +1,90 @@
+import ast
+import json
+from io import StringIO
+
+import numpy as np
+import pandas as pd
+
+# Days at the end of the forecast left out of the forecastpercent table
+HIDDEN_DAYS = 5
+
+
+def read_ensemble_csv(content):
+    """
+    Parses a GetEnsemble csv (datetime followed by one column per member) into a datetime64 array of
+    timesteps and a 2D float array of shape (timesteps, members). Missing values become NaN.
+    """
+    if isinstance(content, bytes):
+        content = content.decode('utf-8')
+    lines = content.splitlines()[1:]
+    try:
+        columns = lines[0].count(',') + 1
+        flows = np.loadtxt(lines, delimiter=',', usecols=range(1, columns), ndmin=2)
+        timesteps = np.array([line[:line.index(',')] for line in lines], dtype='datetime64[s]')
+    except (IndexError, ValueError):
+        # Members with gaps (e.g. the high resolution member ends before the others) or timestamps numpy
+        # cannot parse, let pandas deal with them
+        df = pd.read_csv(StringIO(content), index_col=0)
+        return pd.to_datetime(df.index).values, df.to_numpy(dtype=np.float64)
+    return timesteps, flows
+
+
+def read_return_periods(content):
+    """
+    Parses a GetReturnPeriods response into a dict of floats.
+    """
+    if isinstance(content, bytes):
+        content = content.decode('utf-8')
+    try:
+        rpdict = json.loads(content)
+    except ValueError:
+        # Older versions of the API answer with a python dict literal
+        rpdict = ast.literal_eval(content)
+    return {name: float(value) for name, value in rpdict.items()}
+
+
+def exceedance_percent(timesteps, flows, thresholds):
+    """
+    Computes, for every day and every threshold, the percentage of ensemble members that exceed the threshold
+    at least once during that day.
+
+    timesteps: datetime64 array of length T
+    flows: array of shape (T, M), one column per member, NaN where a member has no value
+    thresholds: sequence of R flows
+
+    Returns the sorted days (datetime64[D], length D) and an array of percentages of shape (R, D). The
+    percentage is relative to the members that have data on that day, so ensembles of any size are handled.
+    """
+    days = np.asarray(timesteps).astype('datetime64[D]')
+    flows = np.asarray(flows, dtype=np.float64)
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+    if len(days) == 0:
+        return days, np.zeros((len(thresholds), 0))
+
+    order = np.argsort(days, kind='stable')
+    days = days[order]
+    flows = flows[order]
+    unique_days, starts = np.unique(days, return_index=True)
+
+    # (R, T, M): comparisons against NaN are False, so missing members never count as exceeding
+    exceeds = flows[np.newaxis, :, :] > thresholds[:, np.newaxis, np.newaxis]
+    daily_exceeds = np.logical_or.reduceat(exceeds, starts, axis=1)
+    members = np.logical_or.reduceat(~np.isnan(flows), starts, axis=0).sum(axis=1)
+
+    percent = daily_exceeds.sum(axis=2) * 100.0 / np.maximum(members, 1)
+    return unique_days, percent
+
+
+def percent_table(timesteps, flows, rpdict):
+    """
+    Returns the forecastpercent table: the days as MM-DD and, for the two, ten and twenty year return periods,
+    the rounded percentage of members above it. The last days of the forecast are not shown.
+    """
+    rp_names = ['two', 'ten', 'twenty']
+    days, percent = exceedance_percent(timesteps, flows, [rpdict[name] for name in rp_names])
+    shown = max(len(days) - HIDDEN_DAYS, 0)
+
+    table = {'percdates': [str(elem)[-4:] for elem in np.datetime_as_string(days[:shown], unit='D')]}
+    for name, values in zip(rp_names, percent):
+        table[name] = ["%.0f" % elem for elem in values[:shown]]
+    return table
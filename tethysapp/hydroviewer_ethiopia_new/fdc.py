@@ -0,0 +1,52 @@
+from functools import lru_cache
+
+import numpy as np
+
+from .flow_stats import exceedance_flows
+from .historic_store import historic_simulation, historic_store
+
+# Exceedance probabilities (%) of the curve, every half percent
+DEFAULT_EXCEEDANCE = tuple(np.linspace(0, 100, 201))
+# Curves kept in memory, one per reach, probabilities and monthly flag
+FDC_CACHE_SIZE = 1024
+
+
+@lru_cache(maxsize=FDC_CACHE_SIZE)
+def _curve(comid, version, exceedance, monthly):
+    series = historic_store.series(comid)
+    values = series.iloc[:, 0].values.astype(np.float64)
+
+    curve = {'exceedance': np.array(exceedance), 'flow': exceedance_flows(values, exceedance)}
+    if monthly:
+        months = series.index.month
+        curve['monthly'] = {month: exceedance_flows(values[months == month], exceedance) for month in range(1, 13)}
+
+    # The arrays are shared by every request for this reach
+    for array in [curve['exceedance'], curve['flow']] + list(curve.get('monthly', {}).values()):
+        array.flags.writeable = False
+    return curve
+
+
+def flow_duration_curve(comid, exceedance=DEFAULT_EXCEEDANCE, monthly=False):
+    """
+    Returns the flow duration curve of a reach from its historic simulation as
+    {'exceedance': probabilities (%), 'flow': flows, 'monthly': {month: flows}}, 'monthly' only if requested.
+    Curves are cached per reach until its historic simulation is updated.
+    """
+    comid = int(comid)
+    historic_simulation(comid)
+    return _curve(comid, historic_store.version(comid), tuple(float(p) for p in exceedance), bool(monthly))
+
+
+def flow_duration_curve_figure(curve, drain_area):
+    """
+    Returns a plotly figure of a flow duration curve, laid out like the one of geoglows.
+    """
+    import plotly.graph_objs as go
+
+    layout = go.Layout(
+        title='Flow Duration Curve<br><sub>Drainage Area: {0}</sub>'.format(drain_area),
+        xaxis={'title': 'Exceedance Probability (%)', 'range': [0, 100]},
+        yaxis={'title': 'Streamflow (m<sup>3</sup>/s)', 'range': [0, 'auto']},
+    )
+    return go.Figure([go.Scatter(name='Flow Duration Curve', x=curve['exceedance'], y=curve['flow'])], layout=layout)
@@ -0,0 +1,68 @@
+import base64
+import datetime as dt
+import json
+
+import numpy as np
+import pandas as pd
+
+from .metrics import phase
+
+# Trace attributes sent as typed arrays, everything else is small and sent as plain JSON
+ARRAY_ATTRIBUTES = ('x', 'y')
+
+
+def encode_array(values):
+    """
+    Encodes a trace array as base64 typed array bytes. Dates become float64 milliseconds since the epoch (UTC),
+    or just a start and a step when they are evenly spaced, and numbers float32. Arrays that are neither
+    (e.g. category labels) are returned as a plain list.
+    """
+    arr = np.asarray(values)
+    is_date = arr.dtype.kind == 'M' or (
+        arr.dtype == object and arr.size and isinstance(arr.flat[0], (dt.date, np.datetime64)))
+    if is_date:
+        millis = pd.to_datetime(arr.ravel()).values.astype('datetime64[ms]').astype('<f8')
+        steps = np.diff(millis)
+        if len(steps) and np.all(steps == steps[0]):
+            # Regular series (e.g. daily historic flows) only need their first date and the step
+            return {'type': 'date', 'start': millis[0], 'step': steps[0], 'length': len(millis)}
+        return {'dtype': 'float64', 'type': 'date', 'bdata': base64.b64encode(millis.tobytes()).decode('ascii')}
+
+    try:
+        numbers = arr.astype('<f4')
+    except (TypeError, ValueError):
+        return arr.tolist()
+    return {'dtype': 'float32', 'bdata': base64.b64encode(numbers.tobytes()).decode('ascii')}
+
+
+def _to_json(obj):
+    from plotly.utils import PlotlyJSONEncoder
+
+    return json.loads(json.dumps(obj, cls=PlotlyJSONEncoder))
+
+
+def compact_figure(figure):
+    """
+    Returns a plotly figure as a compact spec, {'data': [...], 'layout': {...}}, where the x and y arrays of every
+    trace are typed arrays (see encode_array) that wms.js decodes before calling Plotly.newPlot.
+    """
+    with phase('serialization'):
+        data = []
+        for trace in figure.data:
+            trace = trace.to_plotly_json()
+            arrays = {name: trace.pop(name) for name in ARRAY_ATTRIBUTES if trace.get(name) is not None}
+            trace = _to_json(trace)
+            trace.update((name, encode_array(values)) for name, values in arrays.items())
+            data.append(trace)
+        return {'data': data, 'layout': _to_json(figure.layout.to_plotly_json())}
+
+
+def figure_html(figure):
+    """
+    Returns a plotly figure as an html div, the same as the plotly_html output of geoglows.
+    """
+    from plotly.offline import plot as offline_plot
+
+    with phase('serialization'):
+        return offline_plot(figure, config={'autosizable': True, 'responsive': True}, output_type='div',
+                            include_plotlyjs=False)
@@ -0,0 +1,75 @@
+import numpy as np
+
+# Days of the seasonal average, day of year 1 to 366
+DAYS_IN_YEAR = 366
+# Return periods (years) of the table, largest first as in the API
+RETURN_PERIODS = (100, 50, 25, 20, 10, 5, 2)
+# Fraction of the timesteps of a year a reach needs for the year maximum to be used
+COMPLETE_YEAR = 0.9
+# Complete years a reach needs for its return periods to be fitted
+MIN_YEARS = 2
+
+
+def exceedance_flows(values, exceedance):
+    """
+    Returns the flows exceeded with the given probabilities (%). The values are sorted once and the quantiles
+    interpolated on Weibull plotting positions, rank / (n + 1), as in the flow duration curve of geoglows.
+    """
+    values = np.sort(values[~np.isnan(values)])
+    if not len(values):
+        return np.full(len(exceedance), np.nan)
+    positions = np.arange(1, len(values) + 1) / (len(values) + 1.0)
+    return np.interp(1 - np.asarray(exceedance) / 100.0, positions, values)
+
+
+def day_of_year_stats(dates, values):
+    """
+    Returns the average and standard deviation of the values of every day of year (1 to 366), grouped with
+    bincount over the day of year of each date. Days without values are nan, and so is the standard deviation
+    of days with a single value.
+    """
+    valid = ~np.isnan(values)
+    days = np.asarray(dates.dayofyear)[valid] - 1
+    values = values[valid]
+
+    counts = np.bincount(days, minlength=DAYS_IN_YEAR).astype(np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        average = np.bincount(days, values, minlength=DAYS_IN_YEAR) / counts
+        # Sample standard deviation, like pandas
+        squares = np.bincount(days, (values - average[days]) ** 2, minlength=DAYS_IN_YEAR)
+        std = np.sqrt(squares / (counts - 1))
+    std[counts < 2] = np.nan
+    return average, std
+
+
+def annual_maxima(dates, values):
+    """
+    Returns the maximum of every year for a block of series, values being (reaches, timesteps) with nan where
+    a reach has no value. Years a reach does not cover for at least COMPLETE_YEAR are nan.
+    """
+    years = np.asarray(dates.year)
+    starts = np.flatnonzero(np.r_[True, years[1:] != years[:-1]])
+    lengths = np.diff(np.r_[starts, len(years)])
+
+    valid = np.add.reduceat(~np.isnan(values), starts, axis=1)
+    maxima = np.fmax.reduceat(values, starts, axis=1)
+    maxima[valid < COMPLETE_YEAR * lengths.max()] = np.nan
+    return maxima
+
+
+def gumbel_return_periods(maxima, return_periods=RETURN_PERIODS):
+    """
+    Fits a Gumbel distribution to the annual maxima of every reach by the method of moments and returns the
+    flows of the return periods, as (reaches, return periods). Reaches with less than MIN_YEARS maxima are nan.
+    """
+    import scipy.stats as sp
+
+    years = np.sum(~np.isnan(maxima), axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.nansum(maxima, axis=1) / years
+        std = np.sqrt(np.nansum((maxima - mean[:, np.newaxis]) ** 2, axis=1) / (years - 1))
+    std[years < MIN_YEARS] = np.nan
+    scale = std * np.sqrt(6) / np.pi
+    loc = mean - np.euler_gamma * scale
+    probabilities = 1 - 1.0 / np.array(return_periods, dtype=np.float64)
+    return sp.gumbel_r.ppf(probabilities[np.newaxis, :], loc[:, np.newaxis], scale[:, np.newaxis])
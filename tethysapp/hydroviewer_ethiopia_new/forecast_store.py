@@ -0,0 +1,38 @@
+import os
+import threading
+
+from .app import HydroviewerEthiopiaNew as app
+from .ensemble_store import ForecastStore, forecast_file_url
+from .metrics import upstream
+from .upstream import session
+
+STORE_DIR = 'forecast_store'
+# Bytes read at a time when downloading a region forecast
+DOWNLOAD_CHUNK = 1024 * 1024
+
+forecast_store = ForecastStore(os.path.join(app.get_app_workspace().path, STORE_DIR))
+
+
+def ingest_forecast(url_template, cycle):
+    """
+    Downloads the region forecast file of a cycle into the app workspace and ingests it. The template may also
+    point to a local path. Returns the number of reaches.
+    """
+    location = forecast_file_url(url_template, cycle)
+    if not location.startswith(('http://', 'https://')):
+        return forecast_store.ingest(location, cycle)
+
+    os.makedirs(forecast_store.path, exist_ok=True)
+    tmp_path = os.path.join(forecast_store.path, '{0}.{1}.{2}.nc.tmp'.format(cycle, os.getpid(),
+                                                                             threading.get_ident()))
+    try:
+        with upstream('forecast_file'):
+            with session.get(location, stream=True, timeout=(5, 300)) as res:
+                res.raise_for_status()
+                with open(tmp_path, 'wb') as f:
+                    for chunk in res.iter_content(DOWNLOAD_CHUNK):
+                        f.write(chunk)
+        return forecast_store.ingest(tmp_path, cycle)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
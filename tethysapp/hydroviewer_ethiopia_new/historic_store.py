@@ -0,0 +1,167 @@
+import fcntl
+import os
+import threading
+from contextlib import contextmanager
+from io import StringIO
+
+import numpy as np
+import pandas as pd
+from asgiref.sync import sync_to_async
+
+from .app import HydroviewerEthiopiaNew as app
+from .metrics import record_cache, upstream
+from .upstream import async_get, session
+
+STORE_DIR = 'historic_store'
+INDEX_FILE = 'dates.npy'
+# Serializes the date index updates of every process
+LOCK_FILE = 'dates.lock'
+FLOW_COLUMN = 'streamflow_m^3/s'
+
+
+class HistoricStore(object):
+    """
+    Binary store of historic simulations: one float32 .npy file per reach plus a date index shared by every
+    reach. Reach files are memory-mapped, so readers never parse or copy the series. Reaches imported before
+    the index was extended are simply shorter and use the head of the index.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._index = None
+        self._index_mtime = None
+        self._lock = threading.Lock()
+
+    def _file(self, comid):
+        return os.path.join(self.path, '{0}.npy'.format(int(comid)))
+
+    def _save(self, file_path, array):
+        tmp_path = '{0}.{1}.{2}.tmp'.format(file_path, os.getpid(), threading.get_ident())
+        with open(tmp_path, 'wb') as f:
+            np.save(f, array)
+        os.replace(tmp_path, file_path)
+
+    @contextmanager
+    def _index_lock(self):
+        with self._lock:
+            with open(os.path.join(self.path, LOCK_FILE), 'w') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def has(self, comid):
+        return os.path.exists(self._file(comid))
+
+    def comids(self):
+        """
+        Returns the ids of the reaches in the store.
+        """
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(int(name[:-4]) for name in os.listdir(self.path)
+                      if name.endswith('.npy') and name != INDEX_FILE)
+
+    def version(self, comid):
+        """
+        Returns a value that changes whenever the series of a reach is rewritten, to key derived results.
+        """
+        return os.path.getmtime(self._file(comid))
+
+    def dates(self):
+        """
+        Returns the shared date index as a DatetimeIndex, reloaded only when another process extends it.
+        """
+        index_path = os.path.join(self.path, INDEX_FILE)
+        mtime = os.path.getmtime(index_path)
+        with self._lock:
+            if self._index is None or mtime != self._index_mtime:
+                self._index = pd.DatetimeIndex(np.load(index_path), name='datetime')
+                self._index_mtime = mtime
+            return self._index
+
+    def values(self, comid):
+        """
+        Returns the memory-mapped float32 flows of a reach. The map is copy-on-write, so a consumer that
+        modifies the array in place gets private pages instead of corrupting the store.
+        """
+        return np.load(self._file(comid), mmap_mode='c')
+
+    def series(self, comid):
+        """
+        Returns the historic simulation of a reach as a DataFrame backed by the memory map.
+        """
+        values = self.values(comid)
+        return pd.DataFrame(values.reshape(-1, 1), index=self.dates()[:len(values)], columns=[FLOW_COLUMN],
+                            copy=False)
+
+    def write(self, comid, dates, values):
+        dates = np.asarray(dates, dtype='datetime64[s]')
+        values = np.asarray(values, dtype=np.float32)
+        if len(dates) != len(values):
+            raise ValueError('Dates and values have different lengths for reach {0}'.format(comid))
+
+        os.makedirs(self.path, exist_ok=True)
+        index_path = os.path.join(self.path, INDEX_FILE)
+        # The index is read, checked and extended by one process at a time
+        with self._index_lock():
+            if os.path.exists(index_path):
+                index = np.load(index_path)
+                common = min(len(index), len(dates))
+                if not np.array_equal(index[:common], dates[:common]):
+                    raise ValueError('Historic simulation of reach {0} does not match the stored '
+                                     'date index'.format(comid))
+                if len(dates) > len(index):
+                    self._save(index_path, dates)
+            else:
+                self._save(index_path, dates)
+
+        self._save(self._file(comid), values)
+
+    def import_csv(self, comid, csv_file):
+        """
+        Parses a historic simulation csv once and writes it to the store. Both the API format
+        (datetime,streamflow_m^3/s) and the workspace format with a leading row index
+        (,datetime,streamflow (m3/s)) are accepted.
+        """
+        df = pd.read_csv(csv_file)
+        if 'datetime' not in df.columns:
+            df = df.rename(columns={df.columns[0]: 'datetime'})
+        dates = pd.to_datetime(df['datetime']).values
+        self.write(comid, dates, df[df.columns[-1]].values)
+
+
+historic_store = HistoricStore(os.path.join(app.get_app_workspace().path, STORE_DIR))
+
+
+def historic_simulation(comid):
+    """
+    Returns the historic simulation of a reach from the store, downloading and importing it on first use.
+    """
+    stored = historic_store.has(comid)
+    record_cache('historic_store', stored)
+    if not stored:
+        import geoglows
+        with upstream('geoglows'):
+            res = geoglows.streamflow.historic_simulation(comid, return_format='request', s=session)
+        res.raise_for_status()
+        historic_store.import_csv(comid, StringIO(res.text))
+    return historic_store.series(comid)
+
+
+async def historic_simulation_async(comid):
+    """
+    historic_simulation for the async views: the download is awaited, the store is read and written in worker
+    threads.
+    """
+    stored = historic_store.has(comid)
+    record_cache('historic_store', stored)
+    if not stored:
+        import geoglows
+        with upstream('geoglows'):
+            res = await async_get(geoglows.streamflow.ENDPOINT + 'HistoricSimulation/',
+                                  params={'reach_id': int(comid), 'return_format': 'csv'})
+        res.raise_for_status()
+        await sync_to_async(historic_store.import_csv, thread_sensitive=False)(comid, StringIO(res.text))
+    return await sync_to_async(historic_store.series, thread_sensitive=False)(comid)
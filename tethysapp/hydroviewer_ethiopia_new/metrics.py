@@ -0,0 +1,412 @@
+import asyncio
+import atexit
+import bisect
+import contextvars
+import fcntl
+import functools
+import json
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+# Histogram bucket upper bounds, seconds and bytes
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+
+# Spans recorded outside of a request, e.g. by the prefetch thread
+BACKGROUND = 'background'
+# Seconds between two writes of the metrics of a process to the shared directory
+SHARE_INTERVAL = 5
+# Seconds without a write after which the file of a process of another host is taken as the one of a process
+# that exited
+STALE_AFTER = 60 * SHARE_INTERVAL
+# Files of the shared directory summing the metrics of the processes that exited, and serializing its updates
+DEAD_FILE = 'dead.json'
+LOCK_FILE = 'metrics.lock'
+
+_current = contextvars.ContextVar('hydroviewer_request', default=None)
+
+
+class Histogram(object):
+    """
+    Prometheus style histogram with one series per label set.
+    """
+
+    def __init__(self, name, help_text, labels, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0, 0.0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += 1
+            series[2] += value
+
+    def state(self):
+        with self._lock:
+            return [[list(k), list(v[0]), v[1], v[2]] for k, v in self._series.items()]
+
+    def merge(self, states):
+        """
+        Returns the sum of the state() of several processes, as a state.
+        """
+        merged = {}
+        for state in states:
+            for label_values, counts, count, total in state:
+                series = merged.setdefault(tuple(label_values), [[0] * len(self.buckets), 0, 0.0])
+                series[0] = [a + b for a, b in zip(series[0], counts)]
+                series[1] += count
+                series[2] += total
+        return [[list(k), v[0], v[1], v[2]] for k, v in merged.items()]
+
+    def expose(self, states):
+        """
+        Returns the exposition lines of the series of several processes, states being the state() of each.
+        """
+        lines = ['# HELP {0} {1}'.format(self.name, self.help_text), '# TYPE {0} histogram'.format(self.name)]
+        for label_values, counts, count, total in sorted(self.merge(states)):
+            labels = _labels(self.labels, label_values)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append('{0}_bucket{{{1}le="{2}"}} {3}'.format(self.name, labels + ',' if labels else '',
+                                                                     bound, cumulative))
+            lines.append('{0}_bucket{{{1}le="+Inf"}} {2}'.format(self.name, labels + ',' if labels else '', count))
+            lines.append('{0}_sum{{{1}}} {2}'.format(self.name, labels, total))
+            lines.append('{0}_count{{{1}}} {2}'.format(self.name, labels, count))
+        return lines
+
+
+class Counter(object):
+
+    def __init__(self, name, help_text, labels):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values):
+        with self._lock:
+            self._series[label_values] = self._series.get(label_values, 0) + 1
+
+    def state(self):
+        with self._lock:
+            return [[list(k), v] for k, v in self._series.items()]
+
+    def merge(self, states):
+        merged = {}
+        for state in states:
+            for label_values, value in state:
+                merged[tuple(label_values)] = merged.get(tuple(label_values), 0) + value
+        return [[list(k), v] for k, v in merged.items()]
+
+    def expose(self, states):
+        lines = ['# HELP {0} {1}'.format(self.name, self.help_text), '# TYPE {0} counter'.format(self.name)]
+        for label_values, value in sorted(self.merge(states)):
+            lines.append('{0}{{{1}}} {2}'.format(self.name, _labels(self.labels, label_values), value))
+        return lines
+
+
+def _labels(names, values):
+    return ','.join('{0}="{1}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                    for name, value in zip(names, values))
+
+
+request_seconds = Histogram('hydroviewer_request_seconds', 'Total latency of the controllers.',
+                            ('endpoint',), LATENCY_BUCKETS)
+upstream_seconds = Histogram('hydroviewer_upstream_seconds',
+                             'Time spent per request waiting on an upstream service (geoglows, spt, geoserver).',
+                             ('endpoint', 'service'), LATENCY_BUCKETS)
+phase_seconds = Histogram('hydroviewer_phase_seconds',
+                          'Time spent per request building plots and serializing them.',
+                          ('endpoint', 'phase'), LATENCY_BUCKETS)
+response_bytes = Histogram('hydroviewer_response_bytes', 'Size of the response bodies.', ('endpoint',),
+                           SIZE_BUCKETS)
+requests_total = Counter('hydroviewer_requests_total', 'Requests answered by the controllers.',
+                         ('endpoint', 'status'))
+cache_total = Counter('hydroviewer_cache_requests_total', 'Cache lookups by cache and result (hit or miss).',
+                      ('cache', 'result'))
+errors_total = Counter('hydroviewer_errors_total', 'Errors handled without failing the request, by source.',
+                       ('endpoint', 'source'))
+
+REGISTRY = (request_seconds, upstream_seconds, phase_seconds, response_bytes, requests_total, cache_total,
+            errors_total)
+
+
+class _Request(object):
+    """
+    Time spent in each upstream service and phase during one request, summed over the threads working for it.
+    """
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.spans = {}
+        self.lock = threading.Lock()
+
+    def add(self, kind, name, elapsed):
+        with self.lock:
+            self.spans[(kind, name)] = self.spans.get((kind, name), 0.0) + elapsed
+
+
+def _observe(endpoint, kind, name, elapsed):
+    if kind == 'upstream':
+        upstream_seconds.observe(elapsed, endpoint, name)
+    else:
+        phase_seconds.observe(elapsed, endpoint, name)
+
+
+@contextmanager
+def span(kind, name):
+    """
+    Times a block as an upstream call (kind 'upstream', name the service) or a phase of the request
+    (kind 'phase', name 'plotting' or 'serialization').
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        current = _current.get()
+        if current is not None:
+            current.add(kind, name, elapsed)
+        else:
+            _observe(BACKGROUND, kind, name, elapsed)
+
+
+def upstream(service):
+    return span('upstream', service)
+
+
+def phase(name):
+    return span('phase', name)
+
+
+def record_cache(cache, hit):
+    cache_total.inc(cache, 'hit' if hit else 'miss')
+
+
+def record_error(source):
+    current = _current.get()
+    errors_total.inc(current.endpoint if current is not None else BACKGROUND, source)
+
+
+def submit(executor, func, *args):
+    """
+    Submits func to an executor so that the spans it records count towards the current request.
+    """
+    return executor.submit(contextvars.copy_context().run, func, *args)
+
+
+def _count_bytes(chunks, endpoint):
+    size = 0
+    try:
+        for chunk in chunks:
+            size += len(chunk)
+            yield chunk
+    finally:
+        response_bytes.observe(size, endpoint)
+
+
+def _finish(current, start, response):
+    endpoint = current.endpoint
+    request_seconds.observe(time.perf_counter() - start, endpoint)
+    requests_total.inc(endpoint, getattr(response, 'status_code', 200) if response is not None else 500)
+    for (kind, name), elapsed in current.spans.items():
+        _observe(endpoint, kind, name, elapsed)
+    if response is not None:
+        if getattr(response, 'streaming', False):
+            # Counted as the body is sent
+            response.streaming_content = _count_bytes(response.streaming_content, endpoint)
+        elif hasattr(response, 'content'):
+            response_bytes.observe(len(response.content), endpoint)
+
+
+def timed(controller):
+    """
+    Records the latency, response size and upstream/phase breakdown of a controller, sync or async (labelled
+    <name>_async). Calls nested in another timed controller are counted once, by the outer one.
+    """
+    if asyncio.iscoroutinefunction(controller):
+        @functools.wraps(controller)
+        async def async_wrapper(request, *args, **kwargs):
+            if _current.get() is not None:
+                return await controller(request, *args, **kwargs)
+
+            current = _Request(controller.__name__ + '_async')
+            token = _current.set(current)
+            start = time.perf_counter()
+            response = None
+            try:
+                response = await controller(request, *args, **kwargs)
+                return response
+            finally:
+                _current.reset(token)
+                _finish(current, start, response)
+
+        return async_wrapper
+
+    @functools.wraps(controller)
+    def wrapper(request, *args, **kwargs):
+        if _current.get() is not None:
+            return controller(request, *args, **kwargs)
+
+        current = _Request(controller.__name__)
+        token = _current.set(current)
+        start = time.perf_counter()
+        response = None
+        try:
+            response = controller(request, *args, **kwargs)
+            return response
+        finally:
+            _current.reset(token)
+            _finish(current, start, response)
+
+    return wrapper
+
+
+class _SharedDirectory(object):
+    """
+    Directory where every worker process writes its metrics, one json file per host and process id, so that the
+    worker answering a scrape can expose the metrics of all of them. A worker writes its file every
+    SHARE_INTERVAL seconds and when it exits.
+
+    The files of processes that exited are added to DEAD_FILE before they are removed, so the exposed totals
+    never decrease when workers are recycled. A process of this host is gone when its pid is; the pid of a
+    process of another host (or container) means nothing here, so its file is taken as gone once it has not been
+    written for STALE_AFTER seconds.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.name = '{0}-{1}.json'.format(socket.gethostname(), os.getpid())
+        os.makedirs(path, exist_ok=True)
+
+    def start(self):
+        threading.Thread(target=self._run, name='hydroviewer-metrics', daemon=True).start()
+        atexit.register(self.write)
+
+    @contextmanager
+    def _locked(self, operation):
+        with open(os.path.join(self.path, LOCK_FILE), 'a') as lock_file:
+            fcntl.flock(lock_file, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _write_json(self, name, data):
+        tmp_path = '{0}.{1}.tmp'.format(os.path.join(self.path, name), os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, os.path.join(self.path, name))
+
+    def _read_json(self, name):
+        try:
+            with open(os.path.join(self.path, name)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def write(self):
+        self._write_json(self.name, {metric.name: metric.state() for metric in REGISTRY})
+
+    def _run(self):
+        while True:
+            time.sleep(SHARE_INTERVAL)
+            try:
+                self.write()
+            except Exception as e:
+                print(str(e))
+
+    def _processes(self):
+        return [name for name in os.listdir(self.path)
+                if name.endswith('.json') and name not in (DEAD_FILE, self.name)]
+
+    def _alive(self, name):
+        host, _, pid = name[:-len('.json')].rpartition('-')
+        if host == socket.gethostname():
+            try:
+                os.kill(int(pid), 0)
+            except ProcessLookupError:
+                return False
+            except (PermissionError, ValueError):
+                pass
+            return True
+        try:
+            return time.time() - os.path.getmtime(os.path.join(self.path, name)) < STALE_AFTER
+        except OSError:
+            return False
+
+    def fold_dead(self):
+        """
+        Adds the metrics of the processes that exited to DEAD_FILE and removes their files.
+        """
+        dead = [name for name in self._processes() if not self._alive(name)]
+        if not dead:
+            return
+        with self._locked(fcntl.LOCK_EX):
+            totals = self._read_json(DEAD_FILE) or {}
+            folded = []
+            for name in dead:
+                # None if another scrape folded it first
+                process = self._read_json(name)
+                if process is None:
+                    continue
+                for metric in REGISTRY:
+                    totals[metric.name] = metric.merge([totals.get(metric.name, []), process.get(metric.name, [])])
+                folded.append(name)
+            if folded:
+                self._write_json(DEAD_FILE, totals)
+                for name in folded:
+                    os.remove(os.path.join(self.path, name))
+
+    def states(self):
+        """
+        Returns the metrics of the other processes, live or exited, as {metric name: [states]}.
+        """
+        self.fold_dead()
+        states = {}
+        # A fold writes DEAD_FILE and then removes the files it added, both are read in between
+        with self._locked(fcntl.LOCK_SH):
+            for name in [DEAD_FILE] + self._processes():
+                for metric_name, state in (self._read_json(name) or {}).items():
+                    states.setdefault(metric_name, []).append(state)
+        return states
+
+
+_shared = None
+
+
+def share_metrics(path):
+    """
+    Makes exposition() return the metrics of every process that shares the directory, instead of those of the
+    process answering the scrape only. Called once per worker process.
+    """
+    global _shared
+    if _shared is None:
+        _shared = _SharedDirectory(path)
+        _shared.start()
+
+
+def exposition():
+    """
+    Returns the metrics in the Prometheus text format: summed over the worker processes if they share a
+    directory, else the metrics of this process only.
+    """
+    others = _shared.states() if _shared is not None else {}
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.expose([metric.state()] + others.get(metric.name, [])))
+    return '\n'.join(lines) + '\n'
@@ -1 +1,22 @@
 # Put your persistent store models in this file
+import os
+
+from .app import HydroviewerEthiopiaNew as app
+from .reach_catalogue import ReachCatalogue
+
+CATALOGUE_FILE = 'reach_catalogue.sqlite3'
+
+catalogue = ReachCatalogue(os.path.join(app.get_app_workspace().path, CATALOGUE_FILE))
+
+
+def reach_drain_area(comid, default=None):
+    """
+    Returns the drainage area of a reach as shown in the plots (km2, no decimals), from the catalogue or else
+    the default given by the client.
+    """
+    reach = catalogue.get(comid)
+    if reach is not None and reach['drain_area'] is not None:
+        return '{0:.0f}'.format(reach['drain_area'])
+    if default is None:
+        raise ValueError('Unknown drainage area of reach {0}'.format(comid))
+    return default
@@ -0,0 +1,158 @@
+import fcntl
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .app import HydroviewerEthiopiaNew as app
+from .cache import available_dates, ensemble_arrays, probabilities_table
+from .custom_settings import custom_setting
+from .forecast_store import ingest_forecast
+from .warning_points import warning_reaches
+from .watersheds import watershed_key
+
+# Seconds between two checks for a new forecast cycle
+POLL_INTERVAL = 10 * 60
+# Reaches warmed at the same time
+PREFETCH_WORKERS = 4
+
+LOCK_FILE = 'prefetch.lock'
+STATUS_FILE = 'prefetch_status.json'
+
+
+class PrefetchScheduler(object):
+    """
+    Background thread that watches a sentinel reach for new forecast cycles and, when one appears, ingests the
+    region forecast file (if there is one) and warms the reach cache with the forecast stats, ensembles and
+    probability tables of a list of reaches. Each step is retried at every poll until it has succeeded for the
+    latest cycle, e.g. while the region file of a new cycle is not published yet.
+
+    Every process of the app starts the scheduler, but only the one holding the lock file runs it. The others
+    wait for the lock, so one of them takes over when that process exits. The progress is written to a status
+    file so that any process can report it.
+    """
+
+    def __init__(self, path, poll_interval=POLL_INTERVAL, max_workers=PREFETCH_WORKERS):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.max_workers = max_workers
+        self._thread = None
+        self._lock_file = None
+        self._lock = threading.Lock()
+        self._status = {'state': 'stopped', 'cycle': None, 'ingested_cycle': None, 'warmed_cycle': None,
+                        'reaches': 0, 'warmed': 0, 'failed': 0, 'ingested': None, 'last_poll': None,
+                        'started': None, 'finished': None, 'error': None}
+
+    def start(self, sentinel, reaches, forecast_url=None):
+        """
+        Starts the scheduler thread of this process unless it is already started. sentinel is the reach polled
+        for new cycles, reaches a callable returning the reach ids to warm and forecast_url the template of the
+        region forecast files (see forecast_store.forecast_file_url).
+        """
+        with self._lock:
+            if self._thread is not None:
+                return
+            os.makedirs(self.path, exist_ok=True)
+            self._thread = threading.Thread(target=self._run, args=(int(sentinel), reaches, forecast_url),
+                                            name='hydroviewer-prefetch', daemon=True)
+            self._thread.start()
+
+    def status(self):
+        try:
+            with open(os.path.join(self.path, STATUS_FILE)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return dict(self._status)
+
+    def _update(self, **kwargs):
+        self._status.update(kwargs)
+        status_path = os.path.join(self.path, STATUS_FILE)
+        tmp_path = status_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self._status, f)
+        os.replace(tmp_path, status_path)
+
+    def _acquire(self):
+        # Blocks while another process runs the scheduler, the lock is released when that process exits
+        lock_file = open(os.path.join(self.path, LOCK_FILE), 'w')
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        self._lock_file = lock_file
+
+    def _run(self, sentinel, reaches, forecast_url):
+        self._acquire()
+        self._update(state='idle')
+        while True:
+            try:
+                # Refreshing also moves the reach cache of this process to the new cycle
+                dates = available_dates(sentinel, refresh=True)
+                cycle = max(dates['available_dates'])
+                self._update(cycle=cycle, last_poll=time.time())
+                if forecast_url and self._status['ingested_cycle'] != cycle:
+                    self.ingest(cycle, forecast_url)
+                if self._status['warmed_cycle'] != cycle:
+                    self.warm(cycle, sorted(set(reaches()) | {sentinel}))
+            except Exception as e:
+                print(str(e))
+                self._update(state='idle', error=str(e))
+            time.sleep(self.poll_interval)
+
+    def ingest(self, cycle, forecast_url):
+        self._update(state='ingesting', ingested=None, started=time.time(), error=None)
+        try:
+            self._update(ingested=ingest_forecast(forecast_url, cycle), ingested_cycle=cycle)
+        except Exception as e:
+            # The reaches are still warmed from the API, the ingest is retried at the next poll
+            print(str(e))
+            self._update(state='idle', error=str(e))
+
+    def warm(self, cycle, reach_ids):
+        self._update(state='warming', reaches=len(reach_ids), warmed=0, failed=0, started=time.time(),
+                     finished=None)
+
+        def warm_reach(comid):
+            try:
+                ensemble_arrays(comid)
+                probabilities_table(comid)
+                return True
+            except Exception as e:
+                print(str(e))
+                return False
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for warmed in executor.map(warm_reach, reach_ids):
+                if warmed:
+                    self._update(warmed=self._status['warmed'] + 1)
+                else:
+                    self._update(failed=self._status['failed'] + 1)
+
+        self._update(state='idle', warmed_cycle=cycle, finished=time.time())
+
+
+scheduler = PrefetchScheduler(app.get_app_workspace().path)
+
+
+def start_prefetch(sentinel, prefetch_reaches, api_source, spt_token, default_watershed=None, forecast_url=None):
+    """
+    Starts warming the cache in the background. The reaches warmed are the comma separated prefetch_reaches
+    plus the warning points of the default watershed and of every watershed loaded by this process. With a
+    forecast_url, the region forecast of every new cycle is ingested first.
+    """
+    if not sentinel:
+        return
+    configured = {int(n) for n in (prefetch_reaches or '').replace(' ', '').split(',') if n}
+    watersheds = [watershed_key(default_watershed)] if default_watershed and ' (' in default_watershed else []
+    scheduler.start(sentinel, lambda: configured | warning_reaches(api_source, spt_token, watersheds), forecast_url)
+
+
+def start_prefetch_from_settings():
+    """
+    start_prefetch with the custom settings of the app, called when a process loads the app.
+    """
+    try:
+        start_prefetch(custom_setting('sentinel_reach'), custom_setting('prefetch_reaches'),
+                       custom_setting('api_source'), custom_setting('spt_token'),
+                       custom_setting('default_watershed_name'), custom_setting('region_forecast_url'))
+    except Exception as e:
+        # e.g. the settings are not in the database yet while the app is being installed
+        print(str(e))
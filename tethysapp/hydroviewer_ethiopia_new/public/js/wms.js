@@ -15,7 +15,13 @@ var default_extent,
     ten_year_warning,
     twenty_year_warning,
     map,
-    wms_layers;
+    wms_layers,
+    warning_watershed;
+
+/* Prefix of the data urls, 'async/' when the async views are enabled */
+function views_prefix() {
+    return $('#views_prefix').length ? JSON.parse($('#views_prefix').val()) : '';
+}
 
 
 var $loading = $('#view-file-loading');
@@ -164,44 +170,46 @@ function init_map() {
         source: new ol.source.Vector()
     });
 
+    //triangles of the warning points, a cluster of several points is drawn larger with its number of points
+    function warning_style(color) {
+        var styles = {};
+        return function(feature) {
+            var count = feature.get('point_count') || 1;
+            if (!styles[count]) {
+                styles[count] = new ol.style.Style({
+                    image: new ol.style.RegularShape({
+                        fill: new ol.style.Fill({ color: color }),
+                        stroke: new ol.style.Stroke({ color: 'black', width: 0.5 }),
+                        points: 3,
+                        radius: count > 1 ? 14 : 10,
+                        angle: 0
+                    }),
+                    text: count > 1 ? new ol.style.Text({
+                        text: String(count),
+                        offsetY: 3,
+                        font: 'bold 10px sans-serif',
+                        fill: new ol.style.Fill({ color: 'black' }),
+                        stroke: new ol.style.Stroke({ color: 'white', width: 2 })
+                    }) : undefined
+                });
+            }
+            return styles[count];
+        };
+    }
+
     two_year_warning = new ol.layer.Vector({
         source: new ol.source.Vector(),
-        style: new ol.style.Style({
-            image: new ol.style.RegularShape({
-                fill: new ol.style.Fill({ color: 'yellow' }),
-                stroke: new ol.style.Stroke({ color: 'black', width: 0.5 }),
-                points: 3,
-                radius: 10,
-                angle: 0
-            })
-
-        })
+        style: warning_style('yellow')
     });
 
     ten_year_warning = new ol.layer.Vector({
         source: new ol.source.Vector(),
-        style: new ol.style.Style({
-            image: new ol.style.RegularShape({
-                fill: new ol.style.Fill({ color: 'red' }),
-                stroke: new ol.style.Stroke({ color: 'black', width: 0.5 }),
-                points: 3,
-                radius: 10,
-                angle: 0
-            })
-        })
+        style: warning_style('red')
     });
 
     twenty_year_warning = new ol.layer.Vector({
         source: new ol.source.Vector(),
-        style: new ol.style.Style({
-            image: new ol.style.RegularShape({
-                fill: new ol.style.Fill({ color: 'rgba(128,0,128,0.8)' }),
-                stroke: new ol.style.Stroke({ color: 'black', width: 0.5 }),
-                points: 3,
-                radius: 10,
-                angle: 0
-            })
-        })
+        style: warning_style('rgba(128,0,128,0.8)')
     });
 
 
@@ -302,6 +310,7 @@ function view_watershed() {
 
     } else {
 
+        warning_watershed = undefined;
         map.updateSize();
         //map.removeInteraction(select_interaction);
         map.removeLayer(wmsLayer);
@@ -310,14 +319,19 @@ function view_watershed() {
 }
 
 function get_warning_points(model, watershed, subbasin) {
+    //only the points in the current extent are requested, they are requested again when the map moves
+    warning_watershed = [model, watershed, subbasin];
+    var extent = ol.proj.transformExtent(map.getView().calculateExtent(map.getSize()), 'EPSG:3857', 'EPSG:4326');
     $.ajax({
         type: 'GET',
-        url: 'get-warning-points/',
+        url: views_prefix() + 'get-warning-points-bbox/',
         dataType: 'json',
         data: {
             'model': model,
             'watershed': watershed,
-            'subbasin': subbasin
+            'subbasin': subbasin,
+            'bbox': extent.join(','),
+            'zoom': map.getView().getZoom()
         },
         error: function(error) {
             console.log(error);
@@ -337,11 +351,12 @@ function get_warning_points(model, watershed, subbasin) {
                         'EPSG:4326', 'EPSG:3857'));
                     var feature = new ol.Feature({
                         geometry: geometry,
-                        point_size: result.warning2[i].properties.size
+                        point_size: result.warning2[i].properties.size,
+                        point_count: result.warning2[i].properties.point_count
                     });
                     map.getLayers().item(1).getSource().addFeature(feature);
                 }
-                map.getLayers().item(1).setVisible(false);
+                map.getLayers().item(1).setVisible($('#stp-2-toggle').prop('checked'));
             }
 
             if (result.warning10 != 'undefined') {
@@ -353,11 +368,12 @@ function get_warning_points(model, watershed, subbasin) {
                         'EPSG:4326', 'EPSG:3857'));
                     var feature = new ol.Feature({
                         geometry: geometry,
-                        point_size: result.warning10[j].properties.size
+                        point_size: result.warning10[j].properties.size,
+                        point_count: result.warning10[j].properties.point_count
                     });
                     map.getLayers().item(2).getSource().addFeature(feature);
                 }
-                map.getLayers().item(2).setVisible(false);
+                map.getLayers().item(2).setVisible($('#stp-10-toggle').prop('checked'));
             }
 
             if (result.warning20 != 'undefined') {
@@ -369,17 +385,60 @@ function get_warning_points(model, watershed, subbasin) {
                         'EPSG:4326', 'EPSG:3857'));
                     var feature = new ol.Feature({
                         geometry: geometry,
-                        point_size: result.warning20[k].properties.size
+                        point_size: result.warning20[k].properties.size,
+                        point_count: result.warning20[k].properties.point_count
                     });
                     map.getLayers().item(3).getSource().addFeature(feature);
                 }
-                map.getLayers().item(3).setVisible(false);
+                map.getLayers().item(3).setVisible($('#stp-20-toggle').prop('checked'));
             }
 
         }
     });
 }
 
+//decode a typed array sent by the compact figure format
+function decode_figure_array(encoded) {
+    if (!encoded || encoded.type === undefined && encoded.bdata === undefined) {
+        return encoded;
+    }
+
+    var values;
+    if (encoded.bdata !== undefined) {
+        var binary = atob(encoded.bdata);
+        var bytes = new Uint8Array(binary.length);
+        for (var i = 0; i < binary.length; ++i) {
+            bytes[i] = binary.charCodeAt(i);
+        }
+        values = encoded.dtype === 'float64' ? new Float64Array(bytes.buffer) : new Float32Array(bytes.buffer);
+    } else {
+        values = new Float64Array(encoded.length);
+        for (var j = 0; j < encoded.length; ++j) {
+            values[j] = encoded.start + j * encoded.step;
+        }
+    }
+
+    if (encoded.type === 'date') {
+        //dates are sent as UTC milliseconds, give them to plotly as timezone-free strings
+        return Array.from(values, function(ms) {
+            return new Date(ms).toISOString().slice(0, 19).replace('T', ' ');
+        });
+    }
+    return values;
+}
+
+//build a plotly chart inside a container from a compact figure
+function plot_compact_figure(container, figure) {
+    var data = figure.data.map(function(trace) {
+        trace.x = decode_figure_array(trace.x);
+        trace.y = decode_figure_array(trace.y);
+        return trace;
+    });
+    var plot_div = $('<div></div>');
+    $(container).empty().append(plot_div);
+    Plotly.newPlot(plot_div[0], data, figure.layout);
+}
+
 function get_available_dates(model, watershed, subbasin, comid) {
     if (model === 'ECMWF-RAPID') {
         $.ajax({
@@ -412,57 +471,60 @@ function get_available_dates(model, watershed, subbasin, comid) {
     }
 }
 
+function show_view_error(message) {
+    $('#info').html('<p class="alert alert-danger" style="text-align: center"><strong>' + message + '</strong></p>');
+    $('#info').removeClass('hidden');
+
+    setTimeout(function() {
+        $('#info').addClass('hidden')
+    }, 5000);
+}
+
+function show_forecast(data, watershed, subbasin, comid, startdate) {
+    $('#dates').removeClass('hidden');
+    $loading.addClass('hidden');
+    $('#long-term-chart').removeClass('hidden');
+    plot_compact_figure('#long-term-chart', data['plot']);
+    $('#mytable').html(data['table']);
+
+    //resize main graph
+    Plotly.Plots.resize($("#long-term-chart .js-plotly-plot")[0]);
+
+    var params = {
+        watershed_name: watershed,
+        subbasin_name: subbasin,
+        reach_id: comid,
+        startdate: startdate,
+    };
+
+    $('#submit-download-forecast').attr({
+        target: '_blank',
+        href: 'get-forecast-data-csv?' + jQuery.param(params)
+    });
+
+    $('#download_forecast').removeClass('hidden');
+}
+
 function get_time_series(model, watershed, subbasin, comid, startdate, tot_drain_area, region) {
     $loading.removeClass('hidden');
     $('#long-term-chart').addClass('hidden');
     $('#dates').addClass('hidden');
     $.ajax({
         type: 'GET',
-        url: 'get-time-series/',
+        url: views_prefix() + 'get-time-series/',
         data: {
             'comid': comid,
-            'tot_drain_area': tot_drain_area
+            'tot_drain_area': tot_drain_area,
+            'format': 'compact'
         },
         error: function() {
-            $('#info').html('<p class="alert alert-danger" style="text-align: center"><strong>An unknown error occurred while retrieving the forecast</strong></p>');
-            $('#info').removeClass('hidden');
-
-            setTimeout(function() {
-                $('#info').addClass('hidden')
-            }, 5000);
+            show_view_error('An unknown error occurred while retrieving the forecast');
         },
         success: function(data) {
             if (!data.error) {
-                $('#dates').removeClass('hidden');
-                $loading.addClass('hidden');
-                $('#long-term-chart').removeClass('hidden');
-                $('#long-term-chart').html(data['plot']);
-                $('#mytable').html(data['table']);
-
-                //resize main graph
-                Plotly.Plots.resize($("#long-term-chart .js-plotly-plot")[0]);
-
-                var params = {
-                    watershed_name: watershed,
-                    subbasin_name: subbasin,
-                    reach_id: comid,
-                    startdate: startdate,
-                };
-
-                $('#submit-download-forecast').attr({
-                    target: '_blank',
-                    href: 'get-forecast-data-csv?' + jQuery.param(params)
-                });
-
-                $('#download_forecast').removeClass('hidden');
-
+                show_forecast(data, watershed, subbasin, comid, startdate);
             } else if (data.error) {
-                $('#info').html('<p class="alert alert-danger" style="text-align: center"><strong>An unknown error occurred while retrieving the forecast</strong></p>');
-                $('#info').removeClass('hidden');
-
-                setTimeout(function() {
-                    $('#info').addClass('hidden')
-                }, 5000);
+                show_view_error('An unknown error occurred while retrieving the forecast');
             } else {
                 $('#info').html('<p><strong>An unexplainable error occurred.</strong></p>').removeClass('hidden');
             }
@@ -471,127 +533,94 @@ function get_time_series(model, watershed, subbasin, comid, startdate, tot_drain
 }
 
 
-function get_historic_data(model, watershed, subbasin, comid, startdate, tot_drain_area, region) {
-    $('#his-view-file-loading').removeClass('hidden');
+function show_historic(data, watershed, subbasin, comid) {
     m_downloaded_historical_streamflow = true;
-    $.ajax({
-        type: 'GET',
-        url: 'get-historic-data',
-        data: {
-            'comid': comid,
-            'tot_drain_area': tot_drain_area
-
-        },
-        success: function(data) {
-            if (!data.error) {
-                $('#his-view-file-loading').addClass('hidden');
-                $('#historical-chart').removeClass('hidden');
-                $('#historical-chart').html(data['plot']);
-
-                var params = {
-                    watershed_name: watershed,
-                    subbasin_name: subbasin,
-                    reach_id: comid,
-                    daily: false
-                };
-
-                $('#submit-download-interim-csv').attr({
-                    target: '_blank',
-                    href: 'get-historic-data-csv?' + jQuery.param(params)
-                });
-
-                $('#download_interim').removeClass('hidden');
-
-            } else if (data.error) {
-                $('#info').html('<p class="alert alert-danger" style="text-align: center"><strong>An unknown error occurred while retrieving the historic data</strong></p>');
-                $('#info').removeClass('hidden');
+    $('#his-view-file-loading').addClass('hidden');
+    $('#historical-chart').removeClass('hidden');
+    plot_compact_figure('#historical-chart', data['plot']);
+
+    var params = {
+        watershed_name: watershed,
+        subbasin_name: subbasin,
+        reach_id: comid,
+        daily: false
+    };
 
-                setTimeout(function() {
-                    $('#info').addClass('hidden')
-                }, 5000);
-            } else {
-                $('#info').html('<p><strong>An unexplainable error occurred.</strong></p>').removeClass('hidden');
-            }
-        }
+    $('#submit-download-interim-csv').attr({
+        target: '_blank',
+        href: 'get-historic-data-csv?' + jQuery.param(params)
     });
-};
 
+    $('#download_interim').removeClass('hidden');
+}
 
-function get_flow_duration_curve(model, watershed, subbasin, comid, startdate, tot_drain_area, region) {
-    $('#fdc-view-file-loading').removeClass('hidden');
+function show_flow_duration_curve(data) {
     m_downloaded_flow_duration = true;
-    $.ajax({
-        type: 'GET',
-        url: 'get-flow-duration-curve',
-        data: {
-            'model': model,
-            'watershed': watershed,
-            'subbasin': subbasin,
-            'comid': comid,
-            'startdate': startdate,
-            'tot_drain_area': tot_drain_area,
-            'region': region
-        },
-        success: function(data) {
-            if (!data.error) {
-                $('#fdc-view-file-loading').addClass('hidden');
-                $('#fdc-chart').removeClass('hidden');
-                $('#fdc-chart').html(data['plot']);
-            } else if (data.error) {
-                $('#info').html('<p class="alert alert-danger" style="text-align: center"><strong>An unknown error occurred while retrieving the historic data</strong></p>');
-                $('#info').removeClass('hidden');
-
-                setTimeout(function() {
-                    $('#info').addClass('hidden')
-                }, 5000);
-            } else {
-                $('#info').html('<p><strong>An unexplainable error occurred.</strong></p>').removeClass('hidden');
-            }
-        }
-    });
-};
+    $('#fdc-view-file-loading').addClass('hidden');
+    $('#fdc-chart').removeClass('hidden');
+    plot_compact_figure('#fdc-chart', data['plot']);
+}
 
+function show_seasonal_avg_curve(data) {
+    m_downloaded_seasonal_avg = true;
+    $('#savg-view-file-loading').addClass('hidden');
+    $('#savg-chart').removeClass('hidden');
+    plot_compact_figure('#savg-chart', data['plot']);
+}
 
-function get_seasonal_avg_curve(model, watershed, subbasin, comid, startdate, tot_drain_area, region) {
+//every view of a reach in one request, each dataset is downloaded once by the server
+function get_reach_bundle(model, watershed, subbasin, comid, startdate, tot_drain_area) {
+    $loading.removeClass('hidden');
+    $('#long-term-chart').addClass('hidden');
+    $('#dates').addClass('hidden');
+    $('#his-view-file-loading').removeClass('hidden');
+    $('#fdc-view-file-loading').removeClass('hidden');
     $('#savg-view-file-loading').removeClass('hidden');
-    m_downloaded_seasonal_avg = true;
     $.ajax({
         type: 'GET',
-        url: 'get-seasonal-avg-curve',
+        url: 'get-reach-bundle/',
         data: {
-            'model': model,
-            'watershed': watershed,
-            'subbasin': subbasin,
             'comid': comid,
-            'startdate': startdate,
             'tot_drain_area': tot_drain_area,
-            'region': region
+            'format': 'compact'
+        },
+        error: function() {
+            show_view_error('An unknown error occurred while retrieving the data of the reach');
         },
         success: function(data) {
-            if (!data.error) {
-                $('#savg-view-file-loading').addClass('hidden');
-                $('#savg-chart').removeClass('hidden');
-                $('#savg-chart').html(data['plot']);
-            } else if (data.error) {
-                $('#info').html('<p class="alert alert-danger" style="text-align: center"><strong>An unknown error occurred while retrieving the historic data</strong></p>');
-                $('#info').removeClass('hidden');
+            if (data.error) {
+                show_view_error('An unknown error occurred while retrieving the data of the reach');
+                return;
+            }
 
-                setTimeout(function() {
-                    $('#info').addClass('hidden')
-                }, 5000);
+            if (data['forecast']) {
+                show_forecast({'plot': data['forecast'], 'table': data['table']}, watershed, subbasin, comid,
+                              startdate);
             } else {
-                $('#info').html('<p><strong>An unexplainable error occurred.</strong></p>').removeClass('hidden');
+                show_view_error('An unknown error occurred while retrieving the forecast');
+            }
+            if (data['historic']) {
+                show_historic({'plot': data['historic']}, watershed, subbasin, comid);
+            }
+            if (data['fdc']) {
+                show_flow_duration_curve({'plot': data['fdc']});
+            }
+            if (data['seasonal']) {
+                show_seasonal_avg_curve({'plot': data['seasonal']});
+            }
+            if (!data['historic'] || !data['fdc'] || !data['seasonal']) {
+                show_view_error('An unknown error occurred while retrieving the historic data');
             }
         }
     });
-};
+}
 
 
 
 function get_forecast_percent(watershed, subbasin, comid, startdate) {
     $('#mytable').addClass('hidden');
     $.ajax({
-        url: 'forecastpercent/',
+        url: views_prefix() + 'forecastpercent/',
         type: 'GET',
         data: {
             'comid': comid,
@@ -667,6 +696,12 @@ function get_forecast_percent(watershed, subbasin, comid, startdate) {
 }
 
 function map_events() {
+    map.on('moveend', function() {
+        if (warning_watershed) {
+            get_warning_points(warning_watershed[0], warning_watershed[1], warning_watershed[2]);
+        }
+    });
+
     map.on('pointermove', function(evt) {
         if (evt.dragging) {
             return;
@@ -702,62 +737,87 @@ function map_events() {
 
             if (model === 'ECMWF-RAPID') {
                 var wms_url = current_layer.getSource().getGetFeatureInfoUrl(evt.coordinate, viewResolution, view.getProjection(), { 'INFO_FORMAT': 'application/json' }); //Get the wms url for the clicked point
-
-                if (wms_url) {
-                    $loading.removeClass('hidden');
-                    //Retrieving the details for clicked point via the url
-                    $('#dates').addClass('hidden');
-                    //$('#plot').addClass('hidden');
-                    $.ajax({
-                        type: "GET",
-                        url: wms_url,
-                        dataType: 'json',
-                        success: function(result) {
-                            var model = $('#model option:selected').text();
-                            var comid = result["features"][0]["properties"]["COMID"];
-                            var tot_drain_area = result["features"][0]["properties"]["Tot_Drain_"];
-                            tot_drain_area = (tot_drain_area/1000000).toFixed(0)
-                            var region = result["features"][0]["properties"]["region"];
-
-                            var startdate = '';
-                            if ("derived_fr" in (result["features"][0]["properties"])) {
-                                var watershed = (result["features"][0]["properties"]["derived_fr"]).toLowerCase().split('-')[0];
-                                var subbasin = (result["features"][0]["properties"]["derived_fr"]).toLowerCase().split('-')[1];
-                            } else if (JSON.parse($('#geoserver_endpoint').val())[2]) {
-                                var watershed = JSON.parse($('#geoserver_endpoint').val())[2].split('-')[0]
-                                var subbasin = JSON.parse($('#geoserver_endpoint').val())[2].split('-')[1];
-                            } else {
-                                var watershed = (result["features"][0]["properties"]["watershed"]).toLowerCase();
-                                var subbasin = (result["features"][0]["properties"]["subbasin"]).toLowerCase();
-                            }
-
-                            get_available_dates(model, watershed, subbasin, comid);
-                            get_time_series(model, watershed, subbasin, comid, startdate, tot_drain_area, region);
-                            get_historic_data(model, watershed, subbasin, comid, startdate, tot_drain_area, region);
-                            get_flow_duration_curve(model, watershed, subbasin, comid, startdate, tot_drain_area, region);
-                            get_seasonal_avg_curve(model, watershed, subbasin, comid, startdate, tot_drain_area, region);
-
-//                            if (model === 'ECMWF-RAPID') {
-//                                get_forecast_percent(watershed, subbasin, comid, startdate);
-//                            };
-
-                            var workspace = JSON.parse($('#geoserver_endpoint').val())[1];
-
-                            $('#info').addClass('hidden');
-                            add_feature(model, workspace, comid);
-
-                        },
-                        error: function(XMLHttpRequest, textStatus, errorThrown) {
-                            console.log(Error);
+                var lonlat = ol.proj.toLonLat(evt.coordinate);
+
+                $loading.removeClass('hidden');
+                $('#dates').addClass('hidden');
+                //Retrieving the details for clicked point from the reach index, GeoServer is only asked if it fails
+                $.ajax({
+                    type: "GET",
+                    url: 'get-reach/',
+                    dataType: 'json',
+                    data: {
+                        'lon': lonlat[0],
+                        'lat': lonlat[1],
+                        // 5 pixels around the click, in degrees
+                        'tolerance': viewResolution * 5 / 111320
+                    },
+                    success: function(result) {
+                        if ("error" in result) {
+                            get_feature_info(wms_url);
+                        } else {
+                            load_reach(result["properties"]);
                         }
-                    });
-                }
+                    },
+                    error: function(XMLHttpRequest, textStatus, errorThrown) {
+                        get_feature_info(wms_url);
+                    }
+                });
             }
         };
     });
 
 }
 
+function get_feature_info(wms_url) {
+    if (!wms_url) {
+        return;
+    }
+    $.ajax({
+        type: "GET",
+        url: wms_url,
+        dataType: 'json',
+        success: function(result) {
+            load_reach(result["features"][0]["properties"]);
+        },
+        error: function(XMLHttpRequest, textStatus, errorThrown) {
+            console.log(Error);
+        }
+    });
+}
+
+function load_reach(properties) {
+    var model = $('#model option:selected').text();
+    var comid = properties["COMID"];
+    var tot_drain_area = properties["Tot_Drain_"];
+    tot_drain_area = (tot_drain_area/1000000).toFixed(0)
+    var region = properties["region"];
+
+    var startdate = '';
+    if ("derived_fr" in properties) {
+        var watershed = (properties["derived_fr"]).toLowerCase().split('-')[0];
+        var subbasin = (properties["derived_fr"]).toLowerCase().split('-')[1];
+    } else if (JSON.parse($('#geoserver_endpoint').val())[2]) {
+        var watershed = JSON.parse($('#geoserver_endpoint').val())[2].split('-')[0]
+        var subbasin = JSON.parse($('#geoserver_endpoint').val())[2].split('-')[1];
+    } else {
+        var watershed = (properties["watershed"]).toLowerCase();
+        var subbasin = (properties["subbasin"]).toLowerCase();
+    }
+
+    get_available_dates(model, watershed, subbasin, comid);
+    get_reach_bundle(model, watershed, subbasin, comid, startdate, tot_drain_area);
+
+//    if (model === 'ECMWF-RAPID') {
+//        get_forecast_percent(watershed, subbasin, comid, startdate);
+//    };
+
+    var workspace = JSON.parse($('#geoserver_endpoint').val())[1];
+
+    $('#info').addClass('hidden');
+    add_feature(model, workspace, comid);
+}
+
 function add_feature(model, workspace, comid) {
     map.removeLayer(featureOverlay);
 
@@ -0,0 +1,189 @@
+import os
+import sqlite3
+import threading
+import time
+
+# Rows inserted per statement by the bulk loader
+LOAD_BATCH = 5000
+# Attributes of the drainage line layers holding the downstream reach, by naming convention of the layer
+DOWNSTREAM_ATTRIBUTES = ('NextDownID', 'DSLINKNO', 'next_down')
+# Square meters to square kilometers
+M2_TO_KM2 = 1e-6
+
+COLUMNS = ('comid', 'drain_area', 'watershed', 'subbasin', 'region', 'downstream',
+           'min_lon', 'min_lat', 'max_lon', 'max_lat')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reaches (
+    comid INTEGER PRIMARY KEY,
+    drain_area REAL,
+    watershed TEXT,
+    subbasin TEXT,
+    region TEXT,
+    downstream INTEGER,
+    min_lon REAL,
+    min_lat REAL,
+    max_lon REAL,
+    max_lat REAL
+);
+CREATE INDEX IF NOT EXISTS reaches_downstream ON reaches (downstream);
+CREATE INDEX IF NOT EXISTS reaches_subbasin ON reaches (watershed, subbasin);
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value REAL
+);
+"""
+
+
+def _points(coordinates):
+    # Points are [lon, lat(, elevation)], every other geometry type nests lists of them
+    if not isinstance(coordinates, (list, tuple)):
+        raise TypeError('Invalid GeoJSON coordinates: {0!r}'.format(coordinates))
+    if coordinates and isinstance(coordinates[0], (int, float)):
+        yield coordinates
+    else:
+        for part in coordinates:
+            yield from _points(part)
+
+
+def _geometry_points(geometry):
+    if geometry['type'] == 'GeometryCollection':
+        for part in geometry['geometries']:
+            yield from _geometry_points(part)
+    else:
+        yield from _points(geometry['coordinates'])
+
+
+def _bbox(geometry):
+    """
+    Returns (min lon, min lat, max lon, max lat) of a GeoJSON geometry of any type, or Nones without a geometry
+    or with one that cannot be bounded.
+    """
+    if not geometry:
+        return None, None, None, None
+    try:
+        points = list(_geometry_points(geometry))
+        lons = [float(point[0]) for point in points]
+        lats = [float(point[1]) for point in points]
+    except (KeyError, IndexError, TypeError, ValueError):
+        return None, None, None, None
+    if not points:
+        return None, None, None, None
+    return min(lons), min(lats), max(lons), max(lats)
+
+
+def region_subbasin(region):
+    """
+    Returns the (watershed, subbasin) of a region setting such as nile-ethiopia, or Nones if it has no subbasin.
+    """
+    parts = (region or '').lower().split('-')
+    if len(parts) < 2 or not all(parts[:2]):
+        return None, None
+    return parts[0], parts[1]
+
+
+def feature_row(feature, watershed=None, subbasin=None):
+    """
+    Returns the catalogue row of a drainage line feature. The watershed and subbasin come from the derived_fr
+    attribute (e.g. nile-ethiopia), then the watershed/subbasin attributes, then the defaults given. A derived_fr
+    without a subbasin is ignored.
+    """
+    properties = feature['properties']
+    derived = region_subbasin(str(properties.get('derived_fr') or ''))
+    if derived[0] is not None:
+        watershed, subbasin = derived
+    elif properties.get('watershed') and properties.get('subbasin'):
+        watershed, subbasin = str(properties['watershed']).lower(), str(properties['subbasin']).lower()
+
+    downstream = next((properties[name] for name in DOWNSTREAM_ATTRIBUTES if properties.get(name) is not None),
+                      None)
+    drain_area = properties.get('Tot_Drain_')
+    return ((int(properties['COMID']),
+             float(drain_area) * M2_TO_KM2 if drain_area is not None else None,
+             watershed, subbasin, properties.get('region'),
+             int(downstream) if downstream is not None and int(downstream) > 0 else None) +
+            _bbox(feature.get('geometry')))
+
+
+class ReachCatalogue(object):
+    """
+    Catalogue of the reaches of the drainage line layers (drainage area in km2, watershed, subbasin, region,
+    downstream reach and bounding box) in a SQLite file of the app workspace, shared by every worker process.
+    Lookups by reach id and by downstream reach go through B-tree indexes.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            connection = sqlite3.connect(self.db_path, timeout=30)
+            connection.row_factory = sqlite3.Row
+            # Readers of other processes are not blocked while the catalogue is loaded
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.executescript(SCHEMA)
+            self._local.connection = connection
+        return connection
+
+    def load(self, features, watershed=None, subbasin=None, replace=False):
+        """
+        Bulk loads drainage line features, in a single transaction. With replace, the reaches of the
+        catalogue are dropped first, in the same transaction: a load that fails leaves the catalogue as it was.
+        Returns the number of reaches loaded.
+        """
+        connection = self._connection()
+        statement = 'INSERT OR REPLACE INTO reaches ({0}) VALUES ({1})'.format(
+            ', '.join(COLUMNS), ', '.join('?' * len(COLUMNS)))
+        count = 0
+        with connection:
+            # Explicit, so that the delete and every insert are one transaction whatever sqlite3 would begin
+            connection.execute('BEGIN IMMEDIATE')
+            if replace:
+                connection.execute('DELETE FROM reaches')
+            batch = []
+            for feature in features:
+                batch.append(feature_row(feature, watershed, subbasin))
+                if len(batch) == LOAD_BATCH:
+                    connection.executemany(statement, batch)
+                    count += len(batch)
+                    batch = []
+            connection.executemany(statement, batch)
+            count += len(batch)
+            connection.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('version', ?)", (time.time(),))
+        return count
+
+    def version(self):
+        """
+        Returns the time of the last load, 0 if the catalogue was never loaded.
+        """
+        row = self._connection().execute("SELECT value FROM meta WHERE name = 'version'").fetchone()
+        return row[0] if row is not None else 0
+
+    def get(self, comid):
+        """
+        Returns the catalogue entry of a reach as a dict, with the ids of the reaches flowing into it as
+        'upstream', or None if the reach is not in the catalogue.
+        """
+        connection = self._connection()
+        row = connection.execute('SELECT * FROM reaches WHERE comid = ?', (int(comid),)).fetchone()
+        if row is None:
+            return None
+        reach = dict(row)
+        reach['upstream'] = self.upstream(comid)
+        return reach
+
+    def upstream(self, comid):
+        rows = self._connection().execute('SELECT comid FROM reaches WHERE downstream = ? ORDER BY comid',
+                                          (int(comid),))
+        return [row[0] for row in rows]
+
+    def subbasin_reaches(self, watershed, subbasin):
+        rows = self._connection().execute(
+            'SELECT comid FROM reaches WHERE watershed = ? AND subbasin = ? ORDER BY comid', (watershed, subbasin))
+        return [row[0] for row in rows]
+
+    def count(self):
+        return self._connection().execute('SELECT COUNT(*) FROM reaches').fetchone()[0]
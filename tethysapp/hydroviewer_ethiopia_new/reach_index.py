@@ -0,0 +1,118 @@
+import json
+import os
+import threading
+
+from .metrics import record_cache, upstream
+from .upstream import session
+
+INDEX_DIR = 'drainage_lines'
+# Degrees around a click searched for a reach when the client does not send a tolerance
+DEFAULT_TOLERANCE = 0.01
+MAX_TOLERANCE = 0.5
+
+_indexes = {}
+# One lock per layer, so that a layer being downloaded or indexed does not block the lookups of the others
+_layer_locks = {}
+_lock = threading.Lock()
+
+
+class ReachIndex(object):
+    """
+    STRtree over the drainage lines of a layer, answering which reach is nearest to a point.
+    """
+
+    def __init__(self, features):
+        from shapely.geometry import shape
+        from shapely.strtree import STRtree
+
+        features = [feature for feature in features if feature.get('geometry')]
+        self.properties = [feature['properties'] for feature in features]
+        self.tree = STRtree([shape(feature['geometry']) for feature in features])
+
+    def __len__(self):
+        return len(self.properties)
+
+    def nearest(self, lon, lat, tolerance=DEFAULT_TOLERANCE):
+        """
+        Returns (properties, distance in degrees) of the reach nearest to lon/lat, or None if there is none within
+        tolerance degrees.
+        """
+        from shapely.geometry import Point
+
+        indices, distances = self.tree.query_nearest(Point(lon, lat), max_distance=tolerance, return_distance=True)
+        if not len(indices):
+            return None
+        return self.properties[int(indices[0])], float(distances[0])
+
+
+def _download(geoserver_url, workspace, layer_name, file_path):
+    with upstream('geoserver'):
+        res = session.get(geoserver_url.rstrip('/') + '/wfs', params={
+            'service': 'WFS',
+            'version': '1.0.0',
+            'request': 'GetFeature',
+            'typeName': '{0}:{1}'.format(workspace, layer_name),
+            'srsName': 'EPSG:4326',
+            'outputFormat': 'application/json',
+        }, timeout=(5, 300), verify=False)
+    res.raise_for_status()
+
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    tmp_path = '{0}.{1}.{2}.tmp'.format(file_path, os.getpid(), threading.get_ident())
+    with open(tmp_path, 'wb') as f:
+        f.write(res.content)
+    os.replace(tmp_path, file_path)
+
+
+def layer_features(workspace_path, geoserver_url, workspace, layer_name, refresh=False):
+    """
+    Returns the GeoJSON features of a GeoServer layer, downloaded once into the app workspace.
+    """
+    file_path = os.path.join(workspace_path, INDEX_DIR, '{0}-{1}.geojson'.format(workspace, layer_name))
+    if refresh or not os.path.exists(file_path):
+        _download(geoserver_url, workspace, layer_name, file_path)
+    with open(file_path) as f:
+        return json.load(f)['features']
+
+
+def _layer_lock(key):
+    with _lock:
+        return _layer_locks.setdefault(key, threading.Lock())
+
+
+def reach_index(workspace_path, geoserver_url, workspace, layer_name, refresh=False):
+    """
+    Returns the index of the drainage lines of a GeoServer layer. The layer is downloaded once into the app
+    workspace, where every worker process loads it from, and indexed once per process.
+    """
+    key = (geoserver_url, workspace, layer_name)
+    index = _indexes.get(key)
+    if index is not None and not refresh:
+        record_cache('reach_index', True)
+        return index
+
+    # Only the requests for this layer wait while it is downloaded and indexed
+    with _layer_lock(key):
+        index = _indexes.get(key)
+        if index is not None and not refresh:
+            # Built by another thread while this one waited
+            record_cache('reach_index', True)
+            return index
+        record_cache('reach_index', False)
+        index = ReachIndex(layer_features(workspace_path, geoserver_url, workspace, layer_name, refresh))
+        with _lock:
+            _indexes[key] = index
+    return index
+
+
+def warm_reach_index(workspace_path, geoserver_url, workspace, layer_name):
+    """
+    Builds the index of a layer in a background thread, so that the first click on the map does not wait for it.
+    """
+    def warm():
+        try:
+            reach_index(workspace_path, geoserver_url, workspace, layer_name)
+        except Exception as e:
+            print(str(e))
+
+    threading.Thread(target=warm, name='hydroviewer-reach-index', daemon=True).start()
@@ -0,0 +1,182 @@
+import fcntl
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+from .app import HydroviewerEthiopiaNew as app
+from .flow_stats import RETURN_PERIODS, annual_maxima, gumbel_return_periods
+from .historic_store import historic_store
+from .metrics import record_cache
+
+TABLE_FILE = 'return_periods.npz'
+COLUMNS = ('max_flow',) + tuple('return_period_{0}'.format(n) for n in RETURN_PERIODS)
+# Reaches fitted at a time, (reaches x timesteps) float64 block
+BATCH_REACHES = 256
+
+
+class ReturnPeriodTable(object):
+    """
+    Lookup table of the return periods of every reach estimated from the historic store, persisted in one .npz
+    file. Each row remembers the version of the series it was fitted on, so re-imported reaches are refitted.
+    Reaches without enough complete years to fit are left out of the table.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._rows = {}
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _file_lock(self):
+        # Other processes update the table too, the load and save of one update must not interleave with theirs
+        with self._lock:
+            with open(self.file_path + '.lock', 'w') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _load(self):
+        # Called with the lock held, picks up rows written by other processes
+        try:
+            mtime = os.path.getmtime(self.file_path)
+        except OSError:
+            return
+        if mtime == self._mtime:
+            return
+        with np.load(self.file_path) as table:
+            self._rows = {int(comid): (version, tuple(row))
+                          for comid, version, row in zip(table['comids'], table['versions'], table['values'])}
+        self._mtime = mtime
+
+    def _save(self):
+        comids = sorted(self._rows)
+        tmp_path = '{0}.{1}.{2}.tmp'.format(self.file_path, os.getpid(), threading.get_ident())
+        with open(tmp_path, 'wb') as f:
+            values = np.array([self._rows[c][1] for c in comids], dtype=np.float64).reshape(-1, len(COLUMNS))
+            np.savez(f, comids=np.array(comids, dtype=np.int64),
+                     versions=np.array([self._rows[c][0] for c in comids], dtype=np.float64), values=values)
+        os.replace(tmp_path, self.file_path)
+        self._mtime = os.path.getmtime(self.file_path)
+
+    def get(self, comid):
+        """
+        Returns {column: flow} for a reach, or None if it was never fitted or its series changed since.
+        """
+        comid = int(comid)
+        with self._lock:
+            self._load()
+            row = self._rows.get(comid)
+        if row is None or not historic_store.has(comid) or historic_store.version(comid) != row[0]:
+            return None
+        return dict(zip(COLUMNS, (float(flow) for flow in row[1])))
+
+    def version(self, comid):
+        """
+        Returns the version of the series a reach was last fitted on, 0 if it was never fitted (the return periods
+        of the API are served instead).
+        """
+        with self._lock:
+            self._load()
+            row = self._rows.get(int(comid))
+        return row[0] if row is not None else 0
+
+    def update(self, comids):
+        """
+        Fits the reaches of the historic store in batches and saves them to the table. Returns the number of
+        reaches fitted, reaches with less than MIN_YEARS complete years are not saved.
+        """
+        comids = [int(comid) for comid in comids if historic_store.has(comid)]
+        if not comids:
+            return 0
+        dates = historic_store.dates()
+
+        rows = {}
+        for start in range(0, len(comids), BATCH_REACHES):
+            batch = comids[start:start + BATCH_REACHES]
+            versions = [historic_store.version(comid) for comid in batch]
+            values = np.full((len(batch), len(dates)), np.nan)
+            for i, comid in enumerate(batch):
+                series = historic_store.values(comid)
+                values[i, :len(series)] = series
+
+            with np.errstate(invalid='ignore'):
+                max_flow = np.nanmax(values, axis=1)
+            flows = gumbel_return_periods(annual_maxima(dates, values))
+            for comid, version, max_value, row in zip(batch, versions, max_flow, flows):
+                if not np.isnan(row).any():
+                    rows[comid] = (version, (max_value,) + tuple(row))
+
+        if rows:
+            with self._file_lock():
+                self._load()
+                self._rows.update(rows)
+                self._save()
+        return len(rows)
+
+
+return_period_table = ReturnPeriodTable(os.path.join(app.get_app_workspace().path, TABLE_FILE))
+
+
+def lookup_return_periods(comid):
+    """
+    Returns the return periods of a reach from the table as {years: flow, 'max': flow}, or None if the reach
+    has not been fitted yet. Never downloads anything.
+    """
+    row = return_period_table.get(comid)
+    if row is None:
+        return None
+    thresholds = {n: row['return_period_{0}'.format(n)] for n in RETURN_PERIODS}
+    thresholds['max'] = row['max_flow']
+    return thresholds
+
+
+# Fits requested by the views run one at a time in the background, never on the thread of a request
+_fit_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='hydroviewer-return-periods')
+_pending = set()
+_pending_lock = threading.Lock()
+
+
+def _fit(comid):
+    try:
+        return_period_table.update([comid])
+    except Exception as e:
+        print(str(e))
+    finally:
+        with _pending_lock:
+            _pending.discard(comid)
+
+
+def fit_in_background(comid):
+    """
+    Queues the fit of a reach whose historic simulation is in the store, unless it is already queued. Reaches
+    that are not in the store are left to update_return_periods.
+    """
+    comid = int(comid)
+    with _pending_lock:
+        if comid in _pending or not historic_store.has(comid):
+            return
+        _pending.add(comid)
+    _fit_executor.submit(_fit, comid)
+
+
+def reach_return_periods(comid):
+    """
+    Returns the return periods of a reach as a one row DataFrame in the format of the geoglows API. Reaches not
+    in the table get the return periods of the API (kept in the reach cache) while they are fitted in the
+    background.
+    """
+    comid = int(comid)
+    row = return_period_table.get(comid)
+    record_cache('return_periods', row is not None)
+    if row is None:
+        fit_in_background(comid)
+        from .cache import streamflow
+        return streamflow('return_periods', comid)
+    return pd.DataFrame([row], index=pd.Index([comid], name='rivid'), columns=list(COLUMNS))
@@ -0,0 +1,80 @@
+import datetime
+from functools import lru_cache
+
+import numpy as np
+
+from .flow_stats import DAYS_IN_YEAR, day_of_year_stats
+from .historic_store import historic_simulation, historic_store
+
+# Cubic meters to cubic feet
+M3_TO_FT3 = 35.3146667
+# Seasonal averages kept in memory, one per reach
+SEASONAL_CACHE_SIZE = 1024
+
+
+def get_units_title(unit_type):
+    """
+    Get the title for units
+    """
+    units_title = "m"
+    if unit_type == 'english':
+        units_title = "ft"
+    return units_title
+
+
+@lru_cache(maxsize=SEASONAL_CACHE_SIZE)
+def _seasonal(comid, version):
+    series = historic_store.series(comid)
+    average, std = day_of_year_stats(series.index, series.iloc[:, 0].values.astype(np.float64))
+
+    seasonal = {'day_of_year': np.arange(1, DAYS_IN_YEAR + 1), 'average': average, 'std': std}
+    # The arrays are shared by every request for this reach
+    for array in seasonal.values():
+        array.flags.writeable = False
+    return seasonal
+
+
+def seasonal_average(comid):
+    """
+    Returns the daily seasonal average of a reach from its historic simulation as
+    {'day_of_year': 1 to 366, 'average': flows, 'std': standard deviations} in m3/s. Cached per reach until
+    its historic simulation is updated.
+    """
+    comid = int(comid)
+    historic_simulation(comid)
+    return _seasonal(comid, historic_store.version(comid))
+
+
+def seasonal_figure(seasonal, drain_area, units='metric'):
+    """
+    Returns a plotly figure of the seasonal average with its standard deviation band, in ft3/s if units is
+    'english'.
+    """
+    import plotly.graph_objs as go
+
+    season_avg = np.clip(seasonal['average'], 0, None)
+    avg_plus_std = np.clip(season_avg + seasonal['std'], 0, None)
+    avg_min_std = np.clip(season_avg - seasonal['std'], 0, None)
+
+    if units == 'english':
+        # convert from m3/s to ft3/s
+        season_avg = season_avg * M3_TO_FT3
+        avg_plus_std = avg_plus_std * M3_TO_FT3
+        avg_min_std = avg_min_std * M3_TO_FT3
+
+    # Days of a leap year, so that day 366 has a date
+    base_date = datetime.datetime(2020, 1, 1)
+    day_of_year = [base_date + datetime.timedelta(days=int(day) - 1) for day in seasonal['day_of_year']]
+
+    std_plus_scatter = go.Scatter(name='Std. Dev. Upper', x=day_of_year, y=avg_plus_std, fill=None, mode='lines',
+                                  line=dict(color='#98fb98'))
+    std_min_scatter = go.Scatter(name='Std. Dev. Lower', x=day_of_year, y=avg_min_std, fill='tonexty',
+                                 mode='lines', line=dict(color='#98fb98'))
+    avg_scatter = go.Scatter(name='Average', x=day_of_year, y=season_avg, line=dict(color='#0066ff'))
+
+    layout = go.Layout(
+        title='Daily Seasonal Streamflow<br><sub>Drainage Area: {0}</sub>'.format(drain_area),
+        xaxis=dict(title='Day of Year', tickformat="%b"),
+        yaxis=dict(title='Streamflow ({}<sup>3</sup>/s)'.format(get_units_title(units)), range=[0, 'auto']),
+    )
+    return go.Figure(data=[std_plus_scatter, std_min_scatter, avg_scatter], layout=layout)
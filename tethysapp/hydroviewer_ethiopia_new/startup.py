@@ -0,0 +1,64 @@
+import os
+import sys
+import threading
+
+from .app import HydroviewerEthiopiaNew as app
+from .custom_settings import custom_setting
+from .metrics import share_metrics
+from .prefetch import start_prefetch_from_settings
+from .reach_index import warm_reach_index
+
+# Commands of manage.py / tethys that serve requests, every other command (migrate, collectstatic, test,
+# syncstores...) loads the app without starting its background tasks
+SERVER_COMMANDS = ('runserver',)
+# Set to 0 to never start the background tasks, e.g. in the processes spawned by tests and benchmarks
+ENABLE_VARIABLE = 'HYDROVIEWER_BACKGROUND_TASKS'
+
+_lock = threading.Lock()
+_started = False
+
+
+def is_server_process(argv=None):
+    """
+    Whether this process serves requests: a WSGI/ASGI worker, or runserver, not a management command.
+    """
+    argv = sys.argv if argv is None else argv
+    if os.environ.get(ENABLE_VARIABLE, '1') == '0' or 'pytest' in sys.modules:
+        return False
+    program = os.path.basename(argv[0]) if argv else ''
+    if program in ('manage.py', 'django-admin', 'django-admin.py', 'tethys'):
+        return any(command in argv[1:] for command in SERVER_COMMANDS)
+    return True
+
+
+def _warm_reach_index():
+    # Index the drainage lines while the worker starts instead of on the first click on the map
+    geoserver_engine = app.get_spatial_dataset_service(name='main_geoserver', as_engine=True)
+    warm_reach_index(app.get_app_workspace().path, geoserver_engine.endpoint.replace('rest', ''),
+                     custom_setting('workspace'), custom_setting('layer_name'))
+
+
+def _start():
+    # Every worker process writes its metrics to the workspace, so that one scrape returns the metrics of all of them
+    share_metrics(os.path.join(app.get_app_workspace().path, 'metrics'))
+    # Warm the forecasts of the warning points in the background whenever a new forecast is out
+    start_prefetch_from_settings()
+    try:
+        _warm_reach_index()
+    except Exception as e:
+        # e.g. the settings are not in the database yet while the app is being installed
+        print(str(e))
+
+
+def start_background_tasks():
+    """
+    Starts the metrics sharing, the prefetch scheduler and the warm-up of the reach index of this process, once.
+    Called when Django loads the app; the settings are read from a thread since the database must not be queried
+    while the apps are loading.
+    """
+    global _started
+    with _lock:
+        if _started or not is_server_process():
+            return
+        _started = True
+    threading.Thread(target=_start, name='hydroviewer-startup', daemon=True).start()
@@ -0,0 +1,66 @@
+"""
+Points the app to the local stand-in of the upstream services (see standin.py) for the benchmarks. Only
+imports the standard library, so that the startup benchmark measures the imports of the app alone.
+"""
+import os
+import types
+
+
+def redirect_geoglows(geoglows, url):
+    """
+    Points the geoglows streamflow functions to url. Their endpoint defaults are bound when geoglows is
+    imported, so the defaults are rewritten as well as the module constants.
+    """
+    streamflow = geoglows.streamflow
+    old = {getattr(streamflow, name) for name in ('ENDPOINT', 'BYU_ENDPOINT') if hasattr(streamflow, name)}
+    for name in ('ENDPOINT', 'BYU_ENDPOINT'):
+        if hasattr(streamflow, name):
+            setattr(streamflow, name, url)
+    for func in vars(streamflow).values():
+        if isinstance(func, types.FunctionType) and func.__defaults__:
+            func.__defaults__ = tuple(url if d in old else d for d in func.__defaults__)
+
+
+def patch_app(server, workspace):
+    """
+    Replaces the settings, services and workspace of the app with ones pointing to the stand-in server. Must
+    run before anything imports the app modules that read the workspace.
+    """
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tethys_portal.settings')
+    # The prefetch scheduler, shared metrics and index warm-up of startup.py would read the real settings
+    os.environ['HYDROVIEWER_BACKGROUND_TASKS'] = '0'
+    import django
+    django.setup()
+
+    from ...app import HydroviewerEthiopiaNew
+
+    settings = {
+        'api_source': server.url.rstrip('/'),
+        'spt_token': 'benchmark',
+        'workspace': 'hydroviewer_ethiopia',
+        'layer_name': 'ethiopia-drainage_line',
+        'region': 'africa-geoglows',
+        'keywords': 'nile,awash,omo',
+        'zoom_info': '39.6,8.6,5',
+        'extra_feature': '',
+        'default_model_type': 'ECMWF-RAPID',
+        'default_watershed_name': 'Nile (Ethiopia)',
+        'sentinel_reach': None,
+        'prefetch_reaches': '',
+        'show_dropdown': False,
+        'async_views': False,
+        'region_forecast_url': None,
+    }
+    geoserver = types.SimpleNamespace(endpoint=server.url + 'geoserver/rest/', username='admin',
+                                      password='geoserver')
+
+    HydroviewerEthiopiaNew.get_custom_setting = classmethod(lambda cls, name: settings.get(name))
+    HydroviewerEthiopiaNew.get_spatial_dataset_service = classmethod(lambda cls, name, as_engine=False: geoserver)
+    HydroviewerEthiopiaNew.get_app_workspace = classmethod(lambda cls: types.SimpleNamespace(path=workspace))
+
+
+def make_request(factory, path, params):
+    from django.contrib.auth.models import AnonymousUser
+    request = factory.get(path, params, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+    request.user = AnonymousUser()
+    return request
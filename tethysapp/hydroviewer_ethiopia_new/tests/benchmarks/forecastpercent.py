@@ -0,0 +1,118 @@
+"""
+Compares the vectorized exceedance engine used by forecastpercent with the original pure python loops.
+
+To run:
+    python -m tethysapp.hydroviewer_ethiopia_new.tests.benchmarks.forecastpercent
+"""
+import ast
+import datetime as dt
+import timeit
+
+import numpy as np
+
+from ...exceedance import exceedance_percent, read_ensemble_csv, read_return_periods
+
+MEMBERS = 52
+DAYS = 15
+
+RETURN_PERIODS = b"{'max': 420.0, 'twenty': 260.0, 'ten': 210.0, 'two': 130.0}"
+
+
+def make_ensemble_csv(members=MEMBERS, days=DAYS, seed=0):
+    """
+    Builds a GetEnsemble-like csv: 3-hourly steps for the first 6 days and 6-hourly steps after that, which
+    gives the ~85 timesteps of an ECMWF-RAPID forecast.
+    """
+    rng = np.random.RandomState(seed)
+    start = dt.datetime(2020, 6, 1)
+    hours = list(range(0, 144, 3)) + list(range(144, days * 24, 6))
+    base = 100 + 80 * np.sin(np.linspace(0, 3, len(hours)))
+    flows = base[:, np.newaxis] * rng.lognormal(0, 0.35, size=(len(hours), members))
+
+    lines = ['datetime,' + ','.join('ensemble_{0:02d}_m^3/s'.format(m + 1) for m in range(members))]
+    for h, row in zip(hours, flows):
+        stamp = (start + dt.timedelta(hours=h)).strftime('%Y-%m-%d %H:%M:%S')
+        lines.append(stamp + ',' + ','.join('{0:.3f}'.format(v) for v in row))
+    return '\n'.join(lines).encode('utf-8')
+
+
+def legacy_forecastpercent(ens_content, rp_content):
+    """
+    The forecastpercent computation as it was before the vectorized engine.
+    """
+    dicts = ens_content.splitlines()
+    dictstr = []
+
+    rpdict = ast.literal_eval(rp_content.decode('utf-8'))
+    rpdict.pop('max', None)
+
+    rivperc = {}
+    riverpercent = {}
+
+    for q in rpdict:
+        rivperc[q] = {}
+        riverpercent[q] = {}
+
+    for i in range(1, len(dicts)):
+        dictstr.append(dicts[i].decode('utf-8').split(","))
+
+    for rps in rivperc:
+        rp = float(rpdict[rps])
+        for b in dictstr:
+            date = b[0][:10]
+            if date not in rivperc[rps]:
+                rivperc[rps][date] = []
+            for x in range(1, len(b)):
+                flow = float(b[x])
+                if x not in rivperc[rps][date] and flow > rp:
+                    rivperc[rps][date].append(x)
+        for e in rivperc[rps]:
+            riverpercent[rps][e] = float(len(rivperc[rps][e])) / 51.0 * 100
+
+    return riverpercent
+
+
+def vectorized_forecastpercent(ens_content, rp_content):
+    timesteps, flows = read_ensemble_csv(ens_content)
+    rpdict = read_return_periods(rp_content)
+    rpdict.pop('max', None)
+    names = list(rpdict)
+    days, percent = exceedance_percent(timesteps, flows, [rpdict[name] for name in names])
+    return days, dict(zip(names, percent))
+
+
+def check_agreement(ens_content, rp_content):
+    """
+    Both implementations must flag the same members. The original divides by a hard-coded 51 members,
+    so the member counts are compared instead of the percentages.
+    """
+    legacy = legacy_forecastpercent(ens_content, rp_content)
+    days, percent = vectorized_forecastpercent(ens_content, rp_content)
+    day_names = np.datetime_as_string(days, unit='D')
+    for name, values in percent.items():
+        legacy_counts = np.array([legacy[name][d] for d in day_names]) * 51.0 / 100
+        np.testing.assert_allclose(values * MEMBERS / 100, legacy_counts)
+
+
+def main(repeat=5, number=20):
+    ens_content = make_ensemble_csv()
+    check_agreement(ens_content, RETURN_PERIODS)
+
+    print('{0} members, {1} timesteps'.format(MEMBERS, len(ens_content.splitlines()) - 1))
+    results = {}
+    for name, func in (('legacy', legacy_forecastpercent), ('vectorized', vectorized_forecastpercent)):
+        timer = timeit.Timer(lambda: func(ens_content, RETURN_PERIODS))
+        results[name] = min(timer.repeat(repeat=repeat, number=number)) / number
+        print('{0:>10}: {1:8.3f} ms per request'.format(name, results[name] * 1000))
+    print('{0:>10}: {1:8.1f}x'.format('speedup', results['legacy'] / results['vectorized']))
+
+    # The broadcasted pass alone, without csv parsing
+    timesteps, flows = read_ensemble_csv(ens_content)
+    thresholds = [260.0, 210.0, 130.0]
+    timer = timeit.Timer(lambda: exceedance_percent(timesteps, flows, thresholds))
+    print('{0:>10}: {1:8.3f} ms per request'.format(
+        'exceedance', min(timer.repeat(repeat=repeat, number=number)) / number * 1000))
+
+
+if __name__ == '__main__':
+    main()
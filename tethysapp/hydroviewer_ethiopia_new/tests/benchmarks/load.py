@@ -0,0 +1,226 @@
+"""
+Drives the controllers of the app under concurrent load against the local stand-in of the upstream APIs
+(see standin.py) and reports, per endpoint, p50/p95/p99 latency, throughput and peak memory. Each run is
+saved as results/<commit>.json so that two commits can be compared.
+
+Needs a Tethys environment with the app installed. To run:
+    python -m tethysapp.hydroviewer_ethiopia_new.tests.benchmarks.load
+    python -m tethysapp.hydroviewer_ethiopia_new.tests.benchmarks.load --compare results/<other commit>.json
+
+The app workspace, custom settings and GeoServer service are replaced for the run, so the caches start empty
+and nothing leaves the machine.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .app_setup import make_request, patch_app, redirect_geoglows
+from .standin import StandInServer
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+
+REACHES = (160064246, 160064247, 160064248, 160064249)
+WATERSHED, SUBBASIN = 'nile', 'ethiopia'
+DRAIN_AREA = '1520.5'
+
+
+def _reach_params(comid):
+    return {'watershed': WATERSHED, 'subbasin': SUBBASIN, 'comid': comid, 'tot_drain_area': DRAIN_AREA,
+            'region': 'africa-geoglows', 'model': 'ECMWF-RAPID'}
+
+
+def _csv_params(comid):
+    return {'watershed_name': WATERSHED, 'subbasin_name': SUBBASIN, 'reach_id': comid}
+
+
+# (label, controller, query parameters for a reach)
+SCENARIOS = (
+    ('home', 'home', lambda comid: {}),
+    ('ecmwf', 'ecmwf', lambda comid: {'model': 'ECMWF-RAPID'}),
+    ('get_warning_points', 'get_warning_points', _reach_params),
+    ('get_warning_points_bbox', 'get_warning_points_bbox',
+     lambda comid: dict(_reach_params(comid), bbox='36,6,42,12', zoom=7)),
+    ('ecmwf_get_time_series', 'ecmwf_get_time_series', _reach_params),
+    ('ecmwf_get_time_series?format=compact', 'ecmwf_get_time_series',
+     lambda comid: dict(_reach_params(comid), format='compact')),
+    ('get_reach', 'get_reach', lambda comid: {'lon': 39.6, 'lat': 8.6, 'tolerance': 0.5}),
+    ('get_reach_bundle', 'get_reach_bundle', _reach_params),
+    ('get_available_dates', 'get_available_dates', _reach_params),
+    ('get_historic_data', 'get_historic_data', _reach_params),
+    ('get_historic_data?format=compact', 'get_historic_data',
+     lambda comid: dict(_reach_params(comid), format='compact')),
+    ('get_flow_duration_curve', 'get_flow_duration_curve', _reach_params),
+    ('get_flow_duration_data', 'get_flow_duration_data', lambda comid: dict(_reach_params(comid), monthly='true')),
+    ('get_seasonal_avg_curve', 'get_seasonal_avg_curve', _reach_params),
+    ('get_historic_data_csv', 'get_historic_data_csv', _csv_params),
+    ('get_forecast_data_csv', 'get_forecast_data_csv', _csv_params),
+    ('bulk_export?kind=historic&format=wide', 'bulk_export',
+     lambda comid: {'kind': 'historic', 'format': 'wide', 'reach_ids': ','.join(str(r) for r in REACHES)}),
+    ('bulk_export?kind=forecast', 'bulk_export',
+     lambda comid: {'kind': 'forecast', 'reach_ids': ','.join(str(r) for r in REACHES)}),
+    ('forecastpercent', 'forecastpercent', lambda comid: dict(_reach_params(comid), startdate='')),
+    ('update_return_periods', 'update_return_periods', lambda comid: {'comids': comid}),
+    ('prefetch_status', 'prefetch_status', lambda comid: {}),
+    ('metrics', 'metrics', lambda comid: {}),
+)
+
+
+def setup_app(server, workspace):
+    """
+    Points the app and geoglows to the stand-in server, then imports the controllers.
+    """
+    patch_app(server, workspace)
+    import geoglows
+    redirect_geoglows(geoglows, server.url)
+
+    from ... import controllers
+    # Admin endpoints are benchmarked as an administrator
+    controllers.has_permission = lambda request, permission: True
+    return controllers
+
+
+def call(controller, request):
+    """
+    Runs a controller and consumes the response body, returning (seconds, bytes, error).
+    """
+    start = time.perf_counter()
+    try:
+        response = controller(request)
+        if getattr(response, 'streaming', False):
+            size = sum(len(chunk) for chunk in response.streaming_content)
+        else:
+            size = len(response.content)
+        error = None
+        if response.status_code >= 400:
+            error = 'HTTP {0}'.format(response.status_code)
+        elif response.get('Content-Type', '').startswith('application/json') and b'"error"' in response.content[:64]:
+            error = json.loads(response.content)['error']
+    except Exception as e:
+        size, error = 0, '{0}: {1}'.format(type(e).__name__, e)
+    return time.perf_counter() - start, size, error
+
+
+def run_scenario(controller, requests, concurrency):
+    """
+    Sends the requests with concurrency threads and returns the latency percentiles and throughput.
+    """
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        start = time.perf_counter()
+        results = list(executor.map(lambda request: call(controller, request), requests))
+        wall = time.perf_counter() - start
+
+    latencies = np.array([seconds for seconds, _, _ in results]) * 1000
+    errors = sorted({error for _, _, error in results if error})
+    return {
+        'requests': len(results),
+        'errors': sum(1 for _, _, error in results if error),
+        'error_messages': errors[:3],
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p95_ms': float(np.percentile(latencies, 95)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+        'throughput_rps': len(results) / wall,
+        'mean_bytes': float(np.mean([size for _, size, _ in results])),
+    }
+
+
+def peak_memory(controller, requests):
+    """
+    Peak python allocations (MB) while serving the requests one after the other. Measured in a separate pass
+    because tracing slows every allocation down.
+    """
+    tracemalloc.start()
+    try:
+        for request in requests:
+            call(controller, request)
+        return tracemalloc.get_traced_memory()[1] / 2 ** 20
+    finally:
+        tracemalloc.stop()
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(__file__),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def report(results, baseline=None):
+    header = '{0:<40} {1:>9} {2:>9} {3:>9} {4:>9} {5:>9} {6:>7}'.format(
+        'endpoint', 'p50 ms', 'p95 ms', 'p99 ms', 'req/s', 'peak MB', 'errors')
+    print(header)
+    print('-' * len(header))
+    for label, result in results.items():
+        print('{0:<40} {p50_ms:9.1f} {p95_ms:9.1f} {p99_ms:9.1f} {throughput_rps:9.1f} {peak_mb:9.1f} {errors:7d}'
+              .format(label, **result))
+        if baseline and label in baseline:
+            before = baseline[label]
+            print('{0:<40} {1:>+8.0%} {2:>+8.0%} {3:>+8.0%} {4:>+8.0%}'.format(
+                '  vs baseline', *[result[k] / before[k] - 1 if before[k] else 0.0
+                                   for k in ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps')]))
+        for message in result['error_messages']:
+            print('  error: {0}'.format(message))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=40, help='measured requests per endpoint')
+    parser.add_argument('--concurrency', type=int, default=8, help='requests in flight at the same time')
+    parser.add_argument('--delay', type=float, default=0.05, help='seconds the stand-in waits before answering')
+    parser.add_argument('--memory-requests', type=int, default=4, help='requests of the peak memory pass')
+    parser.add_argument('--only', default='', help='comma separated endpoint labels to run')
+    parser.add_argument('--compare', help='results file of another run to compare with')
+    parser.add_argument('--output', default=RESULTS_DIR, help='directory of the results files')
+    args = parser.parse_args(argv)
+
+    server = StandInServer(delay=args.delay).start()
+    workspace = tempfile.mkdtemp(prefix='hydroviewer-benchmark-')
+    controllers = setup_app(server, workspace)
+
+    from django.test import RequestFactory
+    factory = RequestFactory()
+
+    only = [label for label in args.only.split(',') if label]
+    results = {}
+    for label, name, params in SCENARIOS:
+        if only and label not in only:
+            continue
+        controller = getattr(controllers, name)
+        path = '/apps/hydroviewer-ethiopia-new/ecmwf-rapid/{0}/'.format(name.replace('_', '-'))
+        # One cold request per reach fills the caches, the measured requests then cycle over the reaches
+        cold = [call(controller, make_request(factory, path, params(comid)))[0] * 1000 for comid in REACHES]
+        requests = [make_request(factory, path, params(REACHES[i % len(REACHES)])) for i in range(args.requests)]
+        result = run_scenario(controller, requests, args.concurrency)
+        result['cold_ms'] = float(np.mean(cold))
+        result['peak_mb'] = peak_memory(controller, requests[:args.memory_requests])
+        results[label] = result
+
+    server.stop()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+    report(results, baseline)
+    print('upstream calls: {0}'.format(json.dumps(server.calls, sort_keys=True)))
+
+    os.makedirs(args.output, exist_ok=True)
+    output = os.path.join(args.output, '{0}.json'.format(git_commit()))
+    with open(output, 'w') as f:
+        json.dump({'commit': git_commit(), 'python': sys.version.split()[0], 'platform': platform.platform(),
+                   'requests': args.requests, 'concurrency': args.concurrency, 'delay': args.delay,
+                   'results': results}, f, indent=2, sort_keys=True)
+    print('saved {0}'.format(output))
+
+
+if __name__ == '__main__':
+    main()
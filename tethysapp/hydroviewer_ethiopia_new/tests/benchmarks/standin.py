@@ -0,0 +1,201 @@
+"""
+Local stand-in for the upstream services of the app: the GEOGloWS streamflow API, the Streamflow Prediction Tool
+API and GeoServer. Every reach id gets data of the same shape, seeded by the reach id, so any reach can be
+requested. A recorded response can replace a synthetic one by saving it as fixtures/<Method>.<csv|json> next to
+this file (e.g. fixtures/ForecastStats.csv); the historic simulation defaults to workspaces/app_workspace/
+temporary.csv.
+"""
+import datetime as dt
+import json
+import os
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+from .forecastpercent import make_ensemble_csv
+
+FIXTURE_DIR = os.path.join(os.path.dirname(__file__), 'fixtures')
+HISTORIC_CSV = os.path.join(os.path.dirname(__file__), '..', '..', 'workspaces', 'app_workspace', 'temporary.csv')
+
+FORECAST_START = dt.datetime(2020, 6, 10)
+AVAILABLE_DATES = ['20200608.00', '20200609.00', '20200610.00']
+WATERSHEDS = (('nile', 'ethiopia'), ('awash', 'ethiopia'), ('omo', 'ethiopia'))
+# Lon/lat extent of the synthetic warning points and drainage lines
+EXTENT = (33.0, 3.5, 48.0, 15.0)
+
+
+def _recorded(method, extension):
+    file_path = os.path.join(FIXTURE_DIR, '{0}.{1}'.format(method, extension))
+    if os.path.exists(file_path):
+        with open(file_path, 'rb') as f:
+            return f.read()
+    return None
+
+
+def _forecast_hours():
+    return list(range(0, 144, 3)) + list(range(144, 15 * 24, 6))
+
+
+def forecast_stats_csv(comid):
+    rng = np.random.RandomState(comid % 2 ** 32)
+    hours = _forecast_hours()
+    avg = 50 + 30 * np.sin(np.linspace(0, 3, len(hours))) * rng.uniform(0.5, 1.5)
+    lines = ['datetime,flow_25%_m^3/s,flow_75%_m^3/s,flow_avg_m^3/s,flow_max_m^3/s,flow_med_m^3/s,'
+             'flow_min_m^3/s,high_res_m^3/s']
+    for i, (h, a) in enumerate(zip(hours, avg)):
+        stamp = (FORECAST_START + dt.timedelta(hours=h)).strftime('%Y-%m-%d %H:%M:%S')
+        high_res = '{0:.3f}'.format(a * 1.02) if i < 100 else ''
+        lines.append('{0},{1:.3f},{2:.3f},{3:.3f},{4:.3f},{5:.3f},{6:.3f},{7}'.format(
+            stamp, a * 0.8, a * 1.2, a, a * 1.8, a * 0.98, a * 0.4, high_res))
+    return '\n'.join(lines).encode('utf-8')
+
+
+def forecast_ensembles_csv(comid):
+    return make_ensemble_csv(seed=comid % 2 ** 32)
+
+
+def return_periods_csv(comid):
+    return ('rivid,return_period_100,return_period_50,return_period_25,return_period_10,return_period_5,'
+            'return_period_2,max_flow\n{0},260.0,230.0,200.0,160.0,130.0,80.0,300.0\n'.format(comid)).encode('utf-8')
+
+
+def seasonal_average_csv(comid):
+    days = np.arange(366)
+    flows = 40 + 35 * np.sin(days / 366.0 * 2 * np.pi)
+    return ('day_of_year,streamflow_avg_m^3/s\n' +
+            ''.join('{0},{1:.3f}\n'.format(d, f) for d, f in zip(days, flows))).encode('utf-8')
+
+
+def historic_simulation_csv(comid):
+    recorded = _recorded('HistoricSimulation', 'csv')
+    if recorded is not None:
+        return recorded
+    with open(HISTORIC_CSV, 'rb') as f:
+        return f.read()
+
+
+def spt_return_periods(comid):
+    return json.dumps({'max': 300.0, 'twenty': 200.0, 'ten': 160.0, 'two': 80.0}).encode('utf-8')
+
+
+def warning_points_json(watershed, subbasin, return_period, points=300):
+    rng = np.random.RandomState(zlib.crc32('{0}-{1}-{2}'.format(watershed, subbasin, return_period).encode()))
+    lon = rng.uniform(EXTENT[0], EXTENT[2], points)
+    lat = rng.uniform(EXTENT[1], EXTENT[3], points)
+    features = [{'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [x, y]},
+                 'properties': {'comid': 160000000 + i, 'size': int(rng.randint(1, 5))}}
+                for i, (x, y) in enumerate(zip(lon, lat))]
+    return json.dumps({'type': 'FeatureCollection', 'features': features}).encode('utf-8')
+
+
+def feature_types_json(workspace):
+    names = []
+    for watershed, subbasin in WATERSHEDS:
+        names.append('{0}-{1}-drainage_line'.format(watershed, subbasin))
+        names.append('{0}-{1}-catchment'.format(watershed, subbasin))
+    return json.dumps({'featureTypes': {'featureType': [
+        {'name': name, 'href': 'rest/workspaces/{0}/featuretypes/{1}.json'.format(workspace, name)}
+        for name in names]}}).encode('utf-8')
+
+
+def drainage_lines_json(reaches=200):
+    rng = np.random.RandomState(reaches)
+    lon = rng.uniform(EXTENT[0], EXTENT[2], reaches)
+    lat = rng.uniform(EXTENT[1], EXTENT[3], reaches)
+    features = [{'type': 'Feature',
+                 'geometry': {'type': 'LineString', 'coordinates': [[x, y], [x + 0.05, y - 0.05]]},
+                 'properties': {'COMID': 160000000 + i, 'Tot_Drain_': float(rng.uniform(1e7, 1e11)),
+                                'region': 'africa-geoglows', 'derived_fr': 'nile-ethiopia'}}
+                for i, (x, y) in enumerate(zip(lon, lat))]
+    return json.dumps({'type': 'FeatureCollection', 'features': features}).encode('utf-8')
+
+
+GEOGLOWS_METHODS = {
+    'ForecastStats': ('csv', forecast_stats_csv),
+    'ForecastEnsembles': ('csv', forecast_ensembles_csv),
+    'ReturnPeriods': ('csv', return_periods_csv),
+    'SeasonalAverage': ('csv', seasonal_average_csv),
+    'HistoricSimulation': ('csv', historic_simulation_csv),
+}
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, body, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {name: values[0] for name, values in parse_qs(url.query).items()}
+        method = [part for part in url.path.split('/') if part][-1]
+        self.server.count(method)
+        if self.server.delay:
+            time.sleep(self.server.delay)
+
+        if method in GEOGLOWS_METHODS:
+            extension, build = GEOGLOWS_METHODS[method]
+            body = _recorded(method, extension) or build(int(params.get('reach_id', 0)))
+            return self._send(body, 'text/csv')
+        if method == 'AvailableDates':
+            body = _recorded(method, 'json') or json.dumps({'available_dates': AVAILABLE_DATES}).encode('utf-8')
+            return self._send(body, 'application/json')
+        if method == 'GetEnsemble':
+            return self._send(_recorded(method, 'csv') or forecast_ensembles_csv(int(params['reach_id'])),
+                              'text/csv')
+        if method == 'GetReturnPeriods':
+            return self._send(_recorded(method, 'json') or spt_return_periods(int(params['reach_id'])),
+                              'application/json')
+        if method == 'GetWarningPoints':
+            return self._send(_recorded(method, 'json') or warning_points_json(
+                params['watershed_name'], params['subbasin_name'], int(params['return_period'])),
+                'application/json')
+        if method == 'featuretypes.json':
+            return self._send(_recorded('featuretypes', 'json') or feature_types_json(url.path.split('/')[-2]),
+                              'application/json')
+        if method == 'wfs':
+            return self._send(_recorded('wfs', 'json') or drainage_lines_json(), 'application/json')
+
+        self.send_error(404)
+
+
+class StandInServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server answering every upstream route, after delay seconds to emulate the network. The
+    number of calls per method is kept in calls.
+    """
+    daemon_threads = True
+
+    def __init__(self, delay=0.0, port=0):
+        super().__init__(('127.0.0.1', port), StandInHandler)
+        self.delay = delay
+        self.calls = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{0}/'.format(self.server_address[1])
+
+    def count(self, method):
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name='standin', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
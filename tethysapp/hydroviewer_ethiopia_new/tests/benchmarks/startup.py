@@ -0,0 +1,148 @@
+"""
+Measures what a new worker pays before serving: the time to import the controllers of the app, the heavy
+packages they pull in, and the latency of the first and second forecast request against the local stand-in of
+the upstream APIs (see standin.py). Every run is a fresh python process, so nothing is already imported. Each
+run is saved as results/startup-<commit>.json so that two commits can be compared.
+
+Needs a Tethys environment with the app installed. To run:
+    python -m tethysapp.hydroviewer_ethiopia_new.tests.benchmarks.startup
+    python -m tethysapp.hydroviewer_ethiopia_new.tests.benchmarks.startup --compare results/startup-<commit>.json
+    python -m tethysapp.hydroviewer_ethiopia_new.tests.benchmarks.startup --budget 1.5
+
+With --budget the exit status is 1 when the median import time of the controllers goes over it (seconds), so
+the benchmark can fail a build on an import time regression.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import types
+from urllib.parse import urlparse, urlunparse
+
+from .app_setup import make_request, patch_app
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+
+# Packages only some controllers need, which should not be imported with the controllers
+HEAVY_MODULES = ('geoglows', 'plotly', 'scipy')
+REACH = 160064246
+PARAMS = {'watershed': 'nile', 'subbasin': 'ethiopia', 'comid': REACH, 'tot_drain_area': '1520.5',
+          'region': 'africa-geoglows', 'model': 'ECMWF-RAPID'}
+TIMINGS = ('django_seconds', 'import_seconds', 'first_request_seconds', 'second_request_seconds')
+
+
+def redirect_session(session, url):
+    """
+    Sends every request of the upstream session to url. All the upstream calls of the app go through it, so
+    geoglows does not have to be imported beforehand to be redirected.
+    """
+    server = urlparse(url)
+    request = session.request
+
+    def redirected(method, target, *args, **kwargs):
+        return request(method, urlunparse(urlparse(target)._replace(scheme=server.scheme, netloc=server.netloc)),
+                       *args, **kwargs)
+
+    session.request = redirected
+
+
+def child(server_url):
+    """
+    One measurement, in a fresh process. Prints the result as JSON.
+    """
+    start = time.perf_counter()
+    patch_app(types.SimpleNamespace(url=server_url), tempfile.mkdtemp(prefix='hydroviewer-startup-'))
+    django_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    from ... import controllers
+    import_seconds = time.perf_counter() - start
+    imported = [name for name in HEAVY_MODULES if name in sys.modules]
+
+    from ...upstream import session
+    redirect_session(session, server_url)
+    from django.test import RequestFactory
+    factory = RequestFactory()
+
+    requests = []
+    for _ in range(2):
+        request = make_request(factory, '/apps/hydroviewer-ethiopia-new/ecmwf-rapid/get-time-series/', PARAMS)
+        start = time.perf_counter()
+        response = controllers.ecmwf_get_time_series(request)
+        requests.append(time.perf_counter() - start)
+        if b'"error"' in response.content[:64]:
+            raise RuntimeError(json.loads(response.content)['error'])
+
+    print(json.dumps({'django_seconds': django_seconds, 'import_seconds': import_seconds,
+                      'first_request_seconds': requests[0], 'second_request_seconds': requests[1],
+                      'imported_with_controllers': imported}))
+
+
+def measure(server_url):
+    output = subprocess.check_output([sys.executable, '-m', __spec__.name, '--child', server_url])
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(__file__),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def report(result, baseline=None):
+    for name in TIMINGS:
+        line = '{0:<24} {1:9.1f} ms'.format(name.replace('_seconds', ''), result[name] * 1000)
+        if baseline and baseline.get(name):
+            line += '  {0:+.0%} vs baseline'.format(result[name] / baseline[name] - 1)
+        print(line)
+    print('heavy modules imported with the controllers: {0}'.format(
+        ', '.join(result['imported_with_controllers']) or 'none'))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help='fresh processes measured, the median is reported')
+    parser.add_argument('--budget', type=float, help='maximum median import time of the controllers (seconds)')
+    parser.add_argument('--compare', help='results file of another run to compare with')
+    parser.add_argument('--output', default=RESULTS_DIR, help='directory of the results files')
+    parser.add_argument('--child', metavar='URL', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        return child(args.child)
+
+    from .standin import StandInServer
+    server = StandInServer().start()
+    runs = [measure(server.url) for _ in range(args.runs)]
+    server.stop()
+
+    result = {name: statistics.median(run[name] for run in runs) for name in TIMINGS}
+    result['imported_with_controllers'] = sorted({name for run in runs for name in run['imported_with_controllers']})
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['result']
+    report(result, baseline)
+
+    os.makedirs(args.output, exist_ok=True)
+    output = os.path.join(args.output, 'startup-{0}.json'.format(git_commit()))
+    with open(output, 'w') as f:
+        json.dump({'commit': git_commit(), 'python': sys.version.split()[0], 'runs': runs, 'result': result},
+                  f, indent=2, sort_keys=True)
+    print('saved {0}'.format(output))
+
+    if args.budget is not None and result['import_seconds'] > args.budget:
+        print('import of the controllers took {0:.2f} s, over the budget of {1:.2f} s'.format(
+            result['import_seconds'], args.budget))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,8 @@
+"""
+The tests of tests.py use the Tethys test case and database, they are run by `tethys test`. The other tests run
+with pytest alone.
+"""
+from importlib.util import find_spec
+
+if find_spec('tethys_sdk') is None:
+    collect_ignore = ['tests.py']
@@ -0,0 +1,39 @@
+"""
+Fixtures shared by the tests that run without the Tethys stack: a temporary directory per test, Django settings
+for the modules that build responses, and GeoJSON features.
+"""
+import shutil
+import tempfile
+import unittest
+
+
+def configure_django():
+    """
+    Configures the default Django settings, unless the tests run inside a configured project.
+    """
+    from django.conf import settings
+
+    if not settings.configured:
+        settings.configure()
+
+
+class DirectoryTestCase(unittest.TestCase):
+    """
+    TestCase with an empty temporary directory, self.directory, removed after each test.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+
+def feature(geometry, **properties):
+    return {'type': 'Feature', 'geometry': geometry, 'properties': properties}
+
+
+def point(lon, lat, **properties):
+    return feature({'type': 'Point', 'coordinates': [lon, lat]}, **properties)
+
+
+def line(coordinates, **properties):
+    return feature({'type': 'LineString', 'coordinates': coordinates}, **properties)
@@ -0,0 +1,116 @@
+"""
+Tests of the conditional GET decorator: ETags, Last-Modified and 304 answers. Needs Django only.
+
+To run:
+    python -m pytest tethysapp/hydroviewer_ethiopia_new/tests/test_conditional.py
+"""
+import asyncio
+import unittest
+
+from django.http import JsonResponse
+from django.test import RequestFactory
+from django.utils.http import http_date
+
+from ..conditional import conditional, error_response, request_etag
+from .helpers import configure_django
+
+configure_django()
+
+LAST_MODIFIED = 1591747200
+MAX_AGE = 600
+
+
+class ConditionalTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.calls = 0
+        self.version = 'v1'
+
+    def validators(self, request):
+        return request_etag(request, self.version), LAST_MODIFIED, MAX_AGE
+
+    def controller(self, request):
+        self.calls += 1
+        return JsonResponse({'plot': 'figure'})
+
+    def test_etag_and_not_modified(self):
+        view = conditional(self.validators)(self.controller)
+        response = view(self.factory.get('/get-time-series/', {'comid': '160064'}))
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertEqual(response['Last-Modified'], http_date(LAST_MODIFIED))
+        self.assertIn('max-age={0}'.format(MAX_AGE), response['Cache-Control'])
+        self.assertIn('public', response['Cache-Control'])
+
+        # Revalidation is answered before the controller runs
+        response = view(self.factory.get('/get-time-series/', {'comid': '160064'}, HTTP_IF_NONE_MATCH=etag))
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(self.calls, 1)
+
+        response = view(self.factory.get('/get-time-series/', {'comid': '160064'},
+                                         HTTP_IF_MODIFIED_SINCE=http_date(LAST_MODIFIED + 60)))
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.calls, 1)
+
+    def test_etag_changes(self):
+        view = conditional(self.validators)(self.controller)
+        etag = view(self.factory.get('/get-time-series/', {'comid': '160064'}))['ETag']
+        # Another reach, another format or a new forecast cycle
+        for params in ({'comid': '160011'}, {'comid': '160064', 'format': 'compact'}):
+            response = view(self.factory.get('/get-time-series/', params, HTTP_IF_NONE_MATCH=etag))
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], etag)
+        self.version = 'v2'
+        response = view(self.factory.get('/get-time-series/', {'comid': '160064'}, HTTP_IF_NONE_MATCH=etag))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.calls, 4)
+
+    def test_errors_are_not_validated(self):
+        view = conditional(self.validators)(lambda request: error_response('No data found for the selected reach.'))
+        response = view(self.factory.get('/get-time-series/', {'comid': '160064'}))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response)
+        self.assertNotIn('Last-Modified', response)
+        self.assertIn('no-store', response['Cache-Control'])
+        # A body that merely looks like an error is still a response
+        view = conditional(self.validators)(lambda request: JsonResponse({'error_bars': [1, 2]}))
+        self.assertIn('ETag', view(self.factory.get('/get-time-series/', {'comid': '160064'})))
+
+    def test_validated_after_the_controller(self):
+        stored = []
+
+        def validators(request):
+            # The reach is not in the store until the controller downloaded it
+            return self.validators(request) if stored else None
+
+        def controller(request):
+            stored.append(True)
+            return JsonResponse({'plot': 'figure'})
+
+        view = conditional(validators)(controller)
+        response = view(self.factory.get('/get-historic-data/', {'comid': '160064'}))
+        self.assertIn('ETag', response)
+
+    def test_invalid_request(self):
+        def validators(request):
+            return self.validators(request) if int(request.GET['comid']) else None
+
+        view = conditional(validators)(self.controller)
+        response = view(self.factory.get('/get-time-series/', {'comid': 'not a reach'}))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response)
+        self.assertEqual(self.calls, 1)
+
+    def test_async_controller(self):
+        async def controller(request):
+            self.calls += 1
+            return JsonResponse({'plot': 'figure'})
+
+        view = conditional(self.validators)(controller)
+        response = asyncio.run(view(self.factory.get('/get-time-series/', {'comid': '160064'})))
+        self.assertIn('ETag', response)
+        request = self.factory.get('/get-time-series/', {'comid': '160064'}, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(asyncio.run(view(request)).status_code, 304)
+        self.assertEqual(self.calls, 1)
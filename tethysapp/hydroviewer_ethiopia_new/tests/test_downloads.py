@@ -0,0 +1,58 @@
+"""
+Tests of the streamed csv downloads. Needs Django only.
+
+To run:
+    python -m pytest tethysapp/hydroviewer_ethiopia_new/tests/test_downloads.py
+"""
+import gzip
+import unittest
+
+import numpy as np
+import pandas as pd
+from ..downloads import CSV_ROWS, csv_download, forecast_date, gzip_chunks, series_csv_chunks
+from .helpers import configure_django
+
+configure_django()
+
+
+class DownloadsTestCase(unittest.TestCase):
+
+    def test_series_csv_chunks(self):
+        dates = pd.date_range('1979-01-01', periods=CSV_ROWS * 2 + 10, freq='D')
+        values = np.linspace(0, 100, len(dates)).astype(np.float32)
+        series = pd.DataFrame(values.reshape(-1, 1), index=dates, columns=['streamflow_m^3/s'])
+
+        chunks = list(series_csv_chunks(series, 'datetime,streamflow (m3/s)'))
+        # The header, then one chunk per CSV_ROWS rows
+        self.assertEqual(len(chunks), 4)
+        lines = b''.join(chunks).decode('utf-8').splitlines()
+        self.assertEqual(lines[0], 'datetime,streamflow (m3/s)')
+        self.assertEqual(len(lines), len(dates) + 1)
+        self.assertEqual(lines[1], '1979-01-01 00:00:00,0.0')
+        last_date, last_value = lines[-1].split(',')
+        self.assertEqual(last_date, dates[-1].strftime('%Y-%m-%d %H:%M:%S'))
+        self.assertEqual(float(last_value), 100.0)
+
+    def test_forecast_date(self):
+        self.assertIsNone(forecast_date(''))
+        self.assertIsNone(forecast_date(None))
+        self.assertIsNone(forecast_date('most_recent'))
+        self.assertEqual(forecast_date('20200610.00'), '20200610')
+        self.assertEqual(forecast_date('2020-06-10'), '20200610')
+        with self.assertRaises(ValueError):
+            forecast_date('2020-06')
+
+    def test_gzip_chunks(self):
+        chunks = [b'datetime,flow\n'] + ['2020-06-{0:02d},{0}\n'.format(d).encode('utf-8') for d in range(1, 31)]
+        self.assertEqual(gzip.decompress(b''.join(gzip_chunks(iter(chunks)))), b''.join(chunks))
+
+    def test_csv_download(self):
+        response = csv_download(iter([b'a,b\n', b'1,2\n']), 'reach.csv')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename=reach.csv')
+        self.assertEqual(b''.join(response.streaming_content), b'a,b\n1,2\n')
+
+        response = csv_download(iter([b'a,b\n', b'1,2\n']), 'reach.csv', compress=True)
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename=reach.csv.gz')
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), b'a,b\n1,2\n')
@@ -0,0 +1,69 @@
+"""
+Tests of the vectorized forecastpercent engine against the original loops. Pure numpy.
+
+To run:
+    python -m pytest tethysapp/hydroviewer_ethiopia_new/tests/test_exceedance.py
+"""
+import unittest
+
+import numpy as np
+
+from ..exceedance import (HIDDEN_DAYS, exceedance_percent, percent_table, read_ensemble_csv,
+                          read_return_periods)
+from .benchmarks.forecastpercent import MEMBERS, RETURN_PERIODS, legacy_forecastpercent, make_ensemble_csv
+
+
+class ExceedanceTestCase(unittest.TestCase):
+
+    def test_matches_baseline_loop(self):
+        for seed in range(3):
+            ens_content = make_ensemble_csv(seed=seed)
+            legacy = legacy_forecastpercent(ens_content, RETURN_PERIODS)
+
+            timesteps, flows = read_ensemble_csv(ens_content)
+            rpdict = read_return_periods(RETURN_PERIODS)
+            names = ['two', 'ten', 'twenty']
+            days, percent = exceedance_percent(timesteps, flows, [rpdict[name] for name in names])
+
+            day_names = list(np.datetime_as_string(days, unit='D'))
+            self.assertEqual(day_names, sorted(legacy['two']))
+            for name, values in zip(names, percent):
+                # The baseline divides by a hard-coded 51 members, compare the member counts
+                legacy_counts = np.array([legacy[name][day] for day in day_names]) * 51.0 / 100
+                np.testing.assert_allclose(values * MEMBERS / 100, legacy_counts)
+
+    def test_missing_members(self):
+        timesteps = np.array(['2020-06-01T00', '2020-06-01T12', '2020-06-02T00'], dtype='datetime64[s]')
+        flows = np.array([[1.0, 5.0, np.nan, np.nan],
+                          [1.0, 1.0, 5.0, np.nan],
+                          [5.0, 5.0, 1.0, 1.0]])
+        days, percent = exceedance_percent(timesteps, flows, [2.0])
+        self.assertEqual(list(np.datetime_as_string(days, unit='D')), ['2020-06-01', '2020-06-02'])
+        # Day one: 2 of the 3 members with data exceed, day two: 2 of 4
+        np.testing.assert_allclose(percent, [[200.0 / 3, 50.0]])
+
+    def test_no_timesteps(self):
+        days, percent = exceedance_percent(np.array([], dtype='datetime64[s]'), np.zeros((0, 3)), [1.0, 2.0])
+        self.assertEqual(len(days), 0)
+        self.assertEqual(percent.shape, (2, 0))
+
+    def test_percent_table(self):
+        timesteps, flows = read_ensemble_csv(make_ensemble_csv())
+        table = percent_table(timesteps, flows, read_return_periods(RETURN_PERIODS))
+        self.assertEqual(len(table['percdates']), 15 - HIDDEN_DAYS)
+        self.assertEqual(table['percdates'][0], '6-01')
+        self.assertEqual(set(table), {'percdates', 'two', 'ten', 'twenty'})
+        self.assertTrue(all(len(table[name]) == len(table['percdates']) for name in ('two', 'ten', 'twenty')))
+
+    def test_read_ensemble_csv_with_gaps(self):
+        content = (b'datetime,ensemble_01_m^3/s,ensemble_52_m^3/s\n'
+                   b'2020-06-01 00:00:00,1.5,2.5\n'
+                   b'2020-06-01 03:00:00,1.0,\n')
+        timesteps, flows = read_ensemble_csv(content)
+        self.assertEqual(flows.shape, (2, 2))
+        self.assertTrue(np.isnan(flows[1, 1]))
+        self.assertEqual(str(timesteps[1])[:19], '2020-06-01T03:00:00')
+
+    def test_read_return_periods(self):
+        self.assertEqual(read_return_periods(b'{"two": "1.5", "max": 3}'), {'two': 1.5, 'max': 3.0})
+        self.assertEqual(read_return_periods(RETURN_PERIODS)['twenty'], 260.0)
@@ -0,0 +1,112 @@
+"""
+Tests of the flow duration, seasonal and return period kernels. Pure numpy and scipy.
+
+To run:
+    python -m pytest tethysapp/hydroviewer_ethiopia_new/tests/test_flow_stats.py
+"""
+import unittest
+
+import numpy as np
+import pandas as pd
+import scipy.stats as sp
+
+from ..flow_stats import (DAYS_IN_YEAR, RETURN_PERIODS, annual_maxima, day_of_year_stats, exceedance_flows,
+                          gumbel_return_periods)
+
+
+class ExceedanceFlowsTestCase(unittest.TestCase):
+
+    def test_weibull_positions(self):
+        # Nine values, the k-th smallest sits at non-exceedance k / 10
+        values = np.array([5.0, 1.0, 9.0, 3.0, 7.0, 2.0, 8.0, 4.0, 6.0])
+        np.testing.assert_allclose(exceedance_flows(values, [10, 50, 90]), [9.0, 5.0, 1.0])
+        # Between two positions the flow is interpolated, beyond the extreme positions it is the extreme value
+        np.testing.assert_allclose(exceedance_flows(values, [15, 0, 100]), [8.5, 9.0, 1.0])
+
+    def test_matches_ranked_loop(self):
+        values = np.random.RandomState(0).gamma(2.0, 50.0, 1000)
+        exceedance = np.linspace(0, 100, 201)
+        # Exceedance probability of every ranked flow, largest first
+        ranked = sorted(values, reverse=True)
+        probabilities = [100.0 * rank / (len(ranked) + 1) for rank in range(1, len(ranked) + 1)]
+        expected = np.interp(exceedance, probabilities, ranked, left=ranked[0], right=ranked[-1])
+        np.testing.assert_allclose(exceedance_flows(values, exceedance), expected)
+
+    def test_missing_values(self):
+        values = np.array([np.nan, 1.0, 2.0, np.nan, 3.0])
+        np.testing.assert_allclose(exceedance_flows(values, [25, 50, 75]), [3.0, 2.0, 1.0])
+        self.assertTrue(np.isnan(exceedance_flows(np.array([np.nan]), [50, 90])).all())
+        self.assertEqual(len(exceedance_flows(np.array([]), [50, 90])), 2)
+
+
+class DayOfYearStatsTestCase(unittest.TestCase):
+
+    def test_matches_pandas_groupby(self):
+        dates = pd.date_range('1979-01-01', '1990-12-31 21:00', freq='3h')
+        values = np.random.RandomState(1).gamma(2.0, 50.0, len(dates))
+        values[::97] = np.nan
+        average, std = day_of_year_stats(dates, values)
+
+        grouped = pd.Series(values, index=dates).groupby(dates.dayofyear)
+        self.assertEqual(len(average), DAYS_IN_YEAR)
+        np.testing.assert_allclose(average, grouped.mean().reindex(range(1, DAYS_IN_YEAR + 1)).values)
+        np.testing.assert_allclose(std, grouped.std().reindex(range(1, DAYS_IN_YEAR + 1)).values)
+
+    def test_leap_days_and_gaps(self):
+        dates = pd.DatetimeIndex(['2019-12-31', '2020-12-31', '2020-01-01', '2021-01-01', '2021-01-02'])
+        values = np.array([1.0, 3.0, 2.0, 4.0, np.nan])
+        average, std = day_of_year_stats(dates, values)
+        # Dec 31 is day 365 of 2019 and day 366 of 2020
+        np.testing.assert_allclose(average[[0, 364, 365]], [3.0, 1.0, 3.0])
+        self.assertAlmostEqual(std[0], np.sqrt(2.0))
+        # One value has no sample standard deviation, no value has no average either
+        self.assertTrue(np.isnan(std[364]))
+        self.assertTrue(np.isnan(average[1]) and np.isnan(std[1]))
+
+
+class ReturnPeriodsTestCase(unittest.TestCase):
+
+    def test_annual_maxima(self):
+        dates = pd.date_range('1980-01-01', '1983-06-30', freq='D')
+        values = np.vstack([np.arange(len(dates), dtype=np.float64), np.full(len(dates), np.nan)])
+        values[1, :366] = np.random.RandomState(2).uniform(0, 10, 366)
+        values[1, 400] = 50.0
+
+        maxima = annual_maxima(dates, values)
+        self.assertEqual(maxima.shape, (2, 4))
+        expected = pd.Series(values[0], index=dates).groupby(dates.year).max().values
+        np.testing.assert_allclose(maxima[0, :3], expected[:3])
+        # Half of 1983 is not a complete year, and the second reach only covers 1980 and one day of 1981
+        self.assertTrue(np.isnan(maxima[:, 3]).all())
+        self.assertEqual(maxima[1, 0], values[1, :366].max())
+        self.assertTrue(np.isnan(maxima[1, 1:]).all())
+
+    def test_gumbel_matches_scipy(self):
+        maxima = sp.gumbel_r.rvs(loc=[[100.0], [20.0]], scale=[[30.0], [5.0]], size=(2, 40), random_state=3)
+        flows = gumbel_return_periods(maxima)
+        self.assertEqual(flows.shape, (2, len(RETURN_PERIODS)))
+
+        probabilities = 1 - 1.0 / np.array(RETURN_PERIODS, dtype=np.float64)
+        for reach_maxima, reach_flows in zip(maxima, flows):
+            # Method of moments: the Gumbel of the same mean and sample standard deviation
+            scale = np.std(reach_maxima, ddof=1) * np.sqrt(6) / np.pi
+            loc = np.mean(reach_maxima) - np.euler_gamma * scale
+            np.testing.assert_allclose(reach_flows, sp.gumbel_r.ppf(probabilities, loc, scale))
+            np.testing.assert_allclose(sp.gumbel_r.cdf(reach_flows, loc, scale), probabilities)
+            self.assertTrue((np.diff(reach_flows) < 0).all())
+
+    def test_gumbel_converges(self):
+        maxima = sp.gumbel_r.rvs(loc=100.0, scale=30.0, size=(1, 20000), random_state=4)
+        probabilities = 1 - 1.0 / np.array(RETURN_PERIODS, dtype=np.float64)
+        np.testing.assert_allclose(gumbel_return_periods(maxima)[0], sp.gumbel_r.ppf(probabilities, 100.0, 30.0),
+                                   rtol=0.02)
+
+    def test_gumbel_missing_years(self):
+        maxima = np.array([[10.0, np.nan, 14.0, 12.0],
+                           [10.0, np.nan, np.nan, np.nan],
+                           [np.nan, np.nan, np.nan, np.nan]])
+        flows = gumbel_return_periods(maxima)
+        np.testing.assert_allclose(flows[0], gumbel_return_periods(np.array([[10.0, 14.0, 12.0]]))[0])
+        self.assertFalse(np.isnan(flows[0]).any())
+        # Less than two years cannot be fitted
+        self.assertTrue(np.isnan(flows[1:]).all())
@@ -0,0 +1,191 @@
+"""
+Tests of the ensemble forecast store and of the forecast products computed from it. Needs netCDF4 to write the
+region forecast files, the other tests are pure numpy.
+
+To run:
+    python -m pytest tethysapp/hydroviewer_ethiopia_new/tests/test_forecast_store.py
+"""
+import os
+import unittest
+
+import numpy as np
+
+from ..ensemble_store import (ForecastStore, HIGH_RES_MEMBER, STATS_COLUMNS, ensemble_column, forecast_file_url,
+                              forecast_frame, frame_arrays, stats_frame)
+from .helpers import DirectoryTestCase
+
+try:
+    import netCDF4
+except ImportError:
+    netCDF4 = None
+
+RIVIDS = [160064, 160011, 160230, 160102]
+MEMBERS = HIGH_RES_MEMBER
+TIMESTEPS = 8
+FILL_VALUE = -9999.0
+
+
+def write_region_forecast(path, rivids=RIVIDS, members=MEMBERS, timesteps=TIMESTEPS, member_ids=None):
+    """
+    Writes a synthetic region forecast with the layout of the RAPID outputs: Qout(time, ensemble, rivid), unsorted
+    reach ids and a masked last timestep on the ensemble members (only the high resolution run reaches it).
+    Flows are reach id / 1000 + member id + timestep / 10, so any value can be checked. With member_ids, the
+    file has an ensemble coordinate variable with those ids. Returns the flows.
+    """
+    ids = np.arange(1, members + 1) if member_ids is None else np.array(member_ids)
+    flows = (np.array(rivids)[None, None, :] / 1000.0 + ids[None, :, None] +
+             np.arange(timesteps)[:, None, None] / 10.0).astype(np.float32)
+    masked = np.zeros(flows.shape, dtype=bool)
+    masked[-1, ids != HIGH_RES_MEMBER, :] = True
+
+    with netCDF4.Dataset(path, 'w') as dataset:
+        dataset.createDimension('time', timesteps)
+        dataset.createDimension('ensemble', len(ids))
+        if member_ids is not None:
+            dataset.createVariable('ensemble', 'i4', ('ensemble',))[:] = ids
+        dataset.createDimension('rivid', len(rivids))
+        time = dataset.createVariable('time', 'i4', ('time',))
+        time.units = 'hours since 2020-06-10 00:00:00'
+        time[:] = np.arange(timesteps) * 3
+        dataset.createVariable('rivid', 'i4', ('rivid',))[:] = rivids
+        qout = dataset.createVariable('Qout', 'f4', ('time', 'ensemble', 'rivid'), fill_value=FILL_VALUE)
+        qout[:] = np.ma.array(flows, mask=masked)
+    return flows
+
+
+@unittest.skipIf(netCDF4 is None, 'Writing the region forecast files needs netCDF4')
+class ForecastStoreTestCase(DirectoryTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.nc_path = os.path.join(self.directory, 'region.nc')
+        self.flows = write_region_forecast(self.nc_path)
+        self.store = ForecastStore(os.path.join(self.directory, 'store'))
+
+    def test_ingest(self):
+        self.assertEqual(self.store.ingest(self.nc_path, '20200610.00'), len(RIVIDS))
+        self.assertEqual(self.store.cycles(), ['20200610.00'])
+
+        for position, rivid in enumerate(RIVIDS):
+            times, flows = self.store.ensemble_arrays(rivid, '20200610.00')
+            self.assertEqual(flows.shape, (MEMBERS, TIMESTEPS))
+            self.assertEqual(str(times[1]), '2020-06-10T03:00:00')
+            np.testing.assert_allclose(flows[:, :-1], self.flows[:-1, :, position].T)
+            # The masked values are stored as missing
+            self.assertTrue(np.isnan(flows[:HIGH_RES_MEMBER - 1, -1]).all())
+            self.assertEqual(flows[HIGH_RES_MEMBER - 1, -1], self.flows[-1, -1, position])
+
+    def test_unknown_reach_or_cycle(self):
+        self.store.ingest(self.nc_path, '20200610.00')
+        self.assertIsNone(self.store.ensemble_arrays(999999, '20200610.00'))
+        self.assertIsNone(self.store.ensemble_arrays(1, '20200610.00'))
+        self.assertIsNone(self.store.ensemble_arrays(RIVIDS[0], '20200609.00'))
+
+    def test_products(self):
+        self.store.ingest(self.nc_path, '20200610.00')
+
+        arrays = self.store.ensemble_arrays(RIVIDS[0], '20200610.00')
+        ensembles = forecast_frame('forecast_ensembles', *arrays)
+        self.assertEqual(ensembles.shape, (TIMESTEPS, MEMBERS))
+        self.assertEqual(ensembles.columns[0], ensemble_column(1))
+        self.assertAlmostEqual(ensembles[ensemble_column(3)].iloc[0], RIVIDS[0] / 1000.0 + 3, places=3)
+
+        stats = forecast_frame('forecast_stats', *arrays)
+        self.assertEqual(list(stats.columns), list(STATS_COLUMNS))
+        first = stats.iloc[0]
+        self.assertAlmostEqual(first['flow_min_m^3/s'], RIVIDS[0] / 1000.0 + 1, places=3)
+        self.assertAlmostEqual(first['flow_max_m^3/s'], RIVIDS[0] / 1000.0 + 51, places=3)
+        self.assertAlmostEqual(first['flow_med_m^3/s'], RIVIDS[0] / 1000.0 + 26, places=3)
+        self.assertAlmostEqual(first['high_res_m^3/s'], RIVIDS[0] / 1000.0 + HIGH_RES_MEMBER, places=3)
+        # Only the high resolution run reaches the last timestep
+        self.assertTrue(np.isnan(stats['flow_avg_m^3/s'].iloc[-1]))
+        self.assertFalse(np.isnan(stats['high_res_m^3/s'].iloc[-1]))
+
+    def test_member_ids(self):
+        # Members listed out of order and without member 30
+        member_ids = [HIGH_RES_MEMBER] + [m for m in range(1, HIGH_RES_MEMBER) if m != 30]
+        flows = write_region_forecast(self.nc_path, members=len(member_ids), member_ids=member_ids)
+        self.store.ingest(self.nc_path, '20200610.00')
+
+        times, stored = self.store.ensemble_arrays(RIVIDS[1], '20200610.00')
+        self.assertEqual(stored.shape, (HIGH_RES_MEMBER, TIMESTEPS))
+        for position, member in enumerate(member_ids):
+            np.testing.assert_allclose(stored[member - 1, :-1], flows[:-1, position, 1])
+        self.assertTrue(np.isnan(stored[29]).all())
+
+        stats = forecast_frame('forecast_stats', times, stored)
+        self.assertAlmostEqual(stats['high_res_m^3/s'].iloc[0], RIVIDS[1] / 1000.0 + HIGH_RES_MEMBER, places=3)
+        self.assertAlmostEqual(stats['flow_max_m^3/s'].iloc[0], RIVIDS[1] / 1000.0 + 51, places=3)
+
+    def test_missing_high_res(self):
+        self.store.ingest(self.nc_path, '20200610.00')
+        ensembles = forecast_frame('forecast_ensembles', *self.store.ensemble_arrays(RIVIDS[0], '20200610.00'))
+        with self.assertRaises(ValueError):
+            frame_arrays(ensembles.drop(columns=[ensemble_column(HIGH_RES_MEMBER)]))
+
+        write_region_forecast(self.nc_path, members=HIGH_RES_MEMBER - 1)
+        with self.assertRaises(ValueError):
+            self.store.ingest(self.nc_path, '20200611.00')
+        self.assertEqual(self.store.cycles(), ['20200610.00'])
+
+    def test_frame_arrays_members(self):
+        self.store.ingest(self.nc_path, '20200610.00')
+        ensembles = forecast_frame('forecast_ensembles', *self.store.ensemble_arrays(RIVIDS[0], '20200610.00'))
+        # Columns out of order and without member 7
+        columns = [ensemble_column(m) for m in range(HIGH_RES_MEMBER, 0, -1) if m != 7]
+        times, flows = frame_arrays(ensembles[columns])
+        self.assertEqual(flows.shape, (HIGH_RES_MEMBER, TIMESTEPS))
+        self.assertTrue(np.isnan(flows[6]).all())
+        np.testing.assert_array_equal(flows[HIGH_RES_MEMBER - 1], ensembles[ensemble_column(HIGH_RES_MEMBER)])
+
+    def test_reach_files(self):
+        self.store.ingest(self.nc_path, '20200610.00')
+        arrays = self.store.ensemble_arrays(RIVIDS[0], '20200610.00')
+        ensembles = forecast_frame('forecast_ensembles', *arrays)
+
+        # A reach outside of the region forecast, saved from its forecast_ensembles DataFrame
+        times, flows = self.store.save_reach(42, '20200610.00', *frame_arrays(ensembles))
+        self.assertEqual(flows.dtype, np.float32)
+        np.testing.assert_array_equal(times, arrays[0])
+        np.testing.assert_array_equal(flows, arrays[1])
+        self.assertIsNotNone(self.store.ensemble_arrays(42, '20200610.00'))
+        self.assertIsNone(self.store.ensemble_arrays(42, '20200611.00'))
+        self.assertEqual(self.store.cycles(), ['20200610.00'])
+
+    def test_keep_cycles(self):
+        for cycle in ('20200608.00', '20200609.00', '20200610.00'):
+            self.store.ingest(self.nc_path, cycle)
+        self.assertEqual(self.store.cycles(), ['20200609.00', '20200610.00'])
+        self.assertIsNone(self.store.ensemble_arrays(RIVIDS[0], '20200608.00'))
+
+        times, flows = self.store.ensemble_arrays(RIVIDS[0], '20200610.00')
+        for cycle in ('20200610.00', '20200610.12', '20200611.00'):
+            self.store.save_reach(42, cycle, times, flows)
+        self.store.purge()
+        self.assertIsNone(self.store.ensemble_arrays(42, '20200610.00'))
+        self.assertIsNotNone(self.store.ensemble_arrays(42, '20200611.00'))
+
+    def test_replace_cycle(self):
+        self.store.ingest(self.nc_path, '20200610.00')
+        self.store.ensemble_arrays(RIVIDS[0], '20200610.00')
+        write_region_forecast(self.nc_path, rivids=[1, 2])
+        self.assertEqual(self.store.ingest(self.nc_path, '20200610.00'), 2)
+        self.assertIsNone(self.store.ensemble_arrays(RIVIDS[0], '20200610.00'))
+        self.assertIsNotNone(self.store.ensemble_arrays(2, '20200610.00'))
+        self.assertEqual(self.store.cycles(), ['20200610.00'])
+        self.assertEqual(os.listdir(self.store.path), ['20200610.00'])
+
+
+class ForecastProductsTestCase(unittest.TestCase):
+
+    def test_stats_without_high_res(self):
+        times = np.array(['2020-06-10T00:00', '2020-06-10T03:00'], dtype='datetime64[s]')
+        stats = stats_frame(times, np.array([[1.0, 2.0], [3.0, 4.0]]))
+        self.assertEqual(list(stats['flow_avg_m^3/s']), [2.0, 3.0])
+        self.assertTrue(stats['high_res_m^3/s'].isna().all())
+
+    def test_forecast_file_url(self):
+        template = 'https://example.org/{date}/{hour}/Qout_{cycle}.nc'
+        self.assertEqual(forecast_file_url(template, '20200610.12'),
+                         'https://example.org/20200610/12/Qout_20200610.12.nc')
+        self.assertEqual(forecast_file_url('/data/{date}.nc', '20200610'), '/data/20200610.nc')
@@ -0,0 +1,84 @@
+"""
+Tests of the Prometheus metrics and their aggregation over worker processes. Pure python.
+
+To run:
+    python -m pytest tethysapp/hydroviewer_ethiopia_new/tests/test_metrics.py
+"""
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from ..metrics import DEAD_FILE, STALE_AFTER, Counter, Histogram, _SharedDirectory
+from .helpers import DirectoryTestCase
+
+
+class MetricsTestCase(DirectoryTestCase):
+
+    def test_merge_processes(self):
+        counter = Counter('test_total', 'Test counter.', ('endpoint',))
+        histogram = Histogram('test_seconds', 'Test histogram.', ('endpoint',), (0.1, 1))
+        counter.inc('ecmwf')
+        histogram.observe(0.05, 'ecmwf')
+        other_counter = [[['ecmwf'], 2], [['get_time_series'], 1]]
+        other_histogram = [[['ecmwf'], [0, 1], 1, 0.5]]
+
+        self.assertEqual(counter.expose([counter.state(), other_counter])[2:],
+                         ['test_total{endpoint="ecmwf"} 3', 'test_total{endpoint="get_time_series"} 1'])
+        self.assertEqual(histogram.expose([histogram.state(), other_histogram])[2:],
+                         ['test_seconds_bucket{endpoint="ecmwf",le="0.1"} 1',
+                          'test_seconds_bucket{endpoint="ecmwf",le="1"} 2',
+                          'test_seconds_bucket{endpoint="ecmwf",le="+Inf"} 2',
+                          'test_seconds_sum{endpoint="ecmwf"} 0.55',
+                          'test_seconds_count{endpoint="ecmwf"} 2'])
+
+    def _write_process(self, name, value):
+        with open(os.path.join(self.directory, name), 'w') as f:
+            json.dump({'hydroviewer_errors_total': [[['ecmwf', 'spt'], value]]}, f)
+
+    def _total(self, shared):
+        return sum(value for states in shared.states().get('hydroviewer_errors_total', [])
+                   for _, value in states)
+
+    def test_shared_directory(self):
+        shared = _SharedDirectory(self.directory)
+        shared.write()
+        self.assertTrue(os.path.exists(os.path.join(self.directory, shared.name)))
+
+        # A live worker and one that exited
+        live = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(30)'])
+        dead = subprocess.Popen([sys.executable, '-c', 'pass'])
+        dead.wait()
+        host = socket.gethostname()
+        try:
+            self._write_process('{0}-{1}.json'.format(host, live.pid), 1)
+            self._write_process('{0}-{1}.json'.format(host, dead.pid), 2)
+
+            # The process answering the scrape exposes its own metrics live, not from its file
+            self.assertEqual(self._total(shared), 3)
+            self.assertFalse(os.path.exists(os.path.join(self.directory, '{0}-{1}.json'.format(host, dead.pid))))
+            self.assertTrue(os.path.exists(os.path.join(self.directory, DEAD_FILE)))
+
+            # The values of exited workers add up and never go away
+            dead = subprocess.Popen([sys.executable, '-c', 'pass'])
+            dead.wait()
+            self._write_process('{0}-{1}.json'.format(host, dead.pid), 4)
+            self.assertEqual(self._total(shared), 7)
+            self.assertEqual(self._total(shared), 7)
+        finally:
+            live.kill()
+            live.wait()
+
+    def test_other_host(self):
+        shared = _SharedDirectory(self.directory)
+        # Pids of another host are not checked here, its files are gone once they stop being written
+        self._write_process('elsewhere-1.json', 1)
+        self._write_process('elsewhere-2.json', 2)
+        stale = time.time() - STALE_AFTER - 1
+        os.utime(os.path.join(self.directory, 'elsewhere-2.json'), (stale, stale))
+
+        self.assertEqual(self._total(shared), 3)
+        self.assertTrue(os.path.exists(os.path.join(self.directory, 'elsewhere-1.json')))
+        self.assertFalse(os.path.exists(os.path.join(self.directory, 'elsewhere-2.json')))
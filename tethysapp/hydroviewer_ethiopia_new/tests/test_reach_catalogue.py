@@ -0,0 +1,115 @@
+"""
+Tests of the SQLite reach catalogue. Pure python.
+
+To run:
+    python -m pytest tethysapp/hydroviewer_ethiopia_new/tests/test_reach_catalogue.py
+"""
+import os
+import unittest
+
+from ..reach_catalogue import LOAD_BATCH, ReachCatalogue, _bbox, feature_row, region_subbasin
+from .helpers import DirectoryTestCase, feature, line
+
+
+def reach(comid, downstream=None, geometry=None, **properties):
+    properties.update({'COMID': comid, 'NextDownID': downstream if downstream is not None else -1,
+                       'Tot_Drain_': comid * 1e6})
+    if geometry is None:
+        return line([[38.0, 9.0], [38.0 + comid, 9.5]], **properties)
+    return feature(geometry, **properties)
+
+
+class BboxTestCase(unittest.TestCase):
+
+    def test_geometry_types(self):
+        geometries = [
+            ({'type': 'Point', 'coordinates': [38.0, 9.0]}, (38.0, 9.0, 38.0, 9.0)),
+            ({'type': 'MultiPoint', 'coordinates': [[38.0, 9.0], [37.0, 10.0]]}, (37.0, 9.0, 38.0, 10.0)),
+            ({'type': 'LineString', 'coordinates': [[38.0, 9.0, 1200.0], [38.5, 8.5, 1100.0]]},
+             (38.0, 8.5, 38.5, 9.0)),
+            ({'type': 'MultiLineString', 'coordinates': [[[38.0, 9.0], [38.5, 8.5]], [[39.0, 7.0], [39.5, 7.5]]]},
+             (38.0, 7.0, 39.5, 9.0)),
+            ({'type': 'Polygon', 'coordinates': [[[36, 8], [37, 8], [37, 9], [36, 8]]]}, (36, 8, 37, 9)),
+            ({'type': 'MultiPolygon', 'coordinates': [[[[36, 8], [37, 8], [37, 9], [36, 8]]],
+                                                      [[[40, 5], [41, 5], [41, 6], [40, 5]]]]}, (36, 5, 41, 9)),
+            ({'type': 'GeometryCollection', 'geometries': [{'type': 'Point', 'coordinates': [35.0, 12.0]},
+                                                           {'type': 'LineString', 'coordinates': [[36, 8], [37, 9]]}]},
+             (35.0, 8, 37, 12.0)),
+        ]
+        for geometry, bbox in geometries:
+            self.assertEqual(_bbox(geometry), bbox, geometry['type'])
+
+    def test_unbounded_geometries(self):
+        for geometry in (None, {}, {'type': 'LineString', 'coordinates': []},
+                         {'type': 'Point', 'coordinates': 'nowhere'}, {'type': 'Point'},
+                         {'type': 'GeometryCollection', 'geometries': []}):
+            self.assertEqual(_bbox(geometry), (None, None, None, None))
+
+
+class ReachCatalogueTestCase(DirectoryTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.catalogue = ReachCatalogue(os.path.join(self.directory, 'catalogue', 'reaches.sqlite3'))
+
+    def test_region_subbasin(self):
+        self.assertEqual(region_subbasin('nile-ethiopia'), ('nile', 'ethiopia'))
+        self.assertEqual(region_subbasin('Nile-Ethiopia-geoglows'), ('nile', 'ethiopia'))
+        for region in (None, '', 'africa', 'nile-'):
+            self.assertEqual(region_subbasin(region), (None, None))
+
+    def test_watershed_of_a_feature(self):
+        self.assertEqual(feature_row(reach(1, derived_fr='Nile-Ethiopia'), 'rift', 'kenya')[2:4],
+                         ('nile', 'ethiopia'))
+        self.assertEqual(feature_row(reach(1, watershed='Nile', subbasin='Sudan'), 'rift', 'kenya')[2:4],
+                         ('nile', 'sudan'))
+        self.assertEqual(feature_row(reach(1), 'nile', 'ethiopia')[2:4], ('nile', 'ethiopia'))
+        # derived_fr without a subbasin
+        self.assertEqual(feature_row(reach(1, derived_fr='Nile', watershed='Nile', subbasin='Sudan'))[2:4],
+                         ('nile', 'sudan'))
+        self.assertEqual(feature_row(reach(1, derived_fr='nile-'), 'rift', 'kenya')[2:4], ('rift', 'kenya'))
+
+    def test_load_and_lookups(self):
+        self.assertEqual(self.catalogue.version(), 0)
+        features = [reach(1, downstream=3), reach(2, downstream=3), reach(3, watershed='rift', subbasin='kenya'),
+                    reach(4, geometry={'type': 'Point', 'coordinates': [40.0, 10.0]})]
+        self.assertEqual(self.catalogue.load(features, 'nile', 'ethiopia'), 4)
+        self.assertGreater(self.catalogue.version(), 0)
+        self.assertEqual(self.catalogue.count(), 4)
+
+        entry = self.catalogue.get(3)
+        self.assertEqual(entry['upstream'], [1, 2])
+        self.assertIsNone(entry['downstream'])
+        self.assertEqual(entry['drain_area'], 3.0)
+        self.assertEqual((entry['min_lon'], entry['min_lat'], entry['max_lon'], entry['max_lat']),
+                         (38.0, 9.0, 41.0, 9.5))
+        self.assertEqual(self.catalogue.get(1)['downstream'], 3)
+        self.assertEqual(self.catalogue.get(4)['min_lon'], 40.0)
+        self.assertIsNone(self.catalogue.get(99))
+
+        self.assertEqual(self.catalogue.subbasin_reaches('nile', 'ethiopia'), [1, 2, 4])
+        self.assertEqual(self.catalogue.subbasin_reaches('rift', 'kenya'), [3])
+
+    def test_replace(self):
+        self.catalogue.load([reach(n) for n in range(1, LOAD_BATCH + 2)], 'nile', 'ethiopia')
+        self.assertEqual(self.catalogue.count(), LOAD_BATCH + 1)
+        self.catalogue.load([reach(1, derived_fr='nile-sudan')])
+        self.assertEqual(self.catalogue.get(1)['subbasin'], 'sudan')
+        self.assertEqual(self.catalogue.load([reach(7)], 'nile', 'ethiopia', replace=True), 1)
+        self.assertEqual(self.catalogue.subbasin_reaches('nile', 'ethiopia'), [7])
+
+    def test_failed_replace(self):
+        self.catalogue.load([reach(1), reach(2)], 'nile', 'ethiopia')
+        version = self.catalogue.version()
+
+        def features():
+            # More than a batch is written before the layer turns out to be broken
+            for n in range(10, LOAD_BATCH + 20):
+                yield reach(n)
+            yield feature(None, derived_fr='nile-ethiopia')
+
+        with self.assertRaises(KeyError):
+            self.catalogue.load(features(), 'nile', 'ethiopia', replace=True)
+        self.assertEqual(self.catalogue.count(), 2)
+        self.assertEqual(self.catalogue.subbasin_reaches('nile', 'ethiopia'), [1, 2])
+        self.assertEqual(self.catalogue.version(), version)
@@ -0,0 +1,72 @@
+"""
+Tests of the drainage line index. Needs shapely.
+
+To run:
+    python -m pytest tethysapp/hydroviewer_ethiopia_new/tests/test_reach_index.py
+"""
+import json
+import os
+import threading
+from unittest import mock
+
+from .. import reach_index as reach_index_module
+from ..reach_index import INDEX_DIR, ReachIndex, reach_index
+from .helpers import DirectoryTestCase, feature, line
+
+GEOSERVER = 'https://geoserver.example.org/geoserver/'
+
+
+FEATURES = [line([[38.0, 9.0], [38.1, 9.1]], COMID=1), line([[38.0, 9.2], [38.1, 9.3]], COMID=2),
+            feature(None, COMID=3)]
+
+
+class ReachIndexTestCase(DirectoryTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.workspace = self.directory
+        os.makedirs(os.path.join(self.workspace, INDEX_DIR))
+        for layer in ('drainage', 'slow'):
+            with open(os.path.join(self.workspace, INDEX_DIR, 'ws-{0}.geojson'.format(layer)), 'w') as f:
+                json.dump({'features': FEATURES}, f)
+        self.addCleanup(reach_index_module._indexes.clear)
+
+    def test_nearest(self):
+        index = ReachIndex(FEATURES)
+        self.assertEqual(len(index), 2)
+        properties, distance = index.nearest(38.05, 9.06)
+        self.assertEqual(properties['COMID'], 1)
+        self.assertAlmostEqual(distance, 0.01 / 2 ** 0.5)
+        self.assertIsNone(index.nearest(40.0, 12.0))
+
+    def test_built_once(self):
+        index = reach_index(self.workspace, GEOSERVER, 'ws', 'drainage')
+        self.assertIs(reach_index(self.workspace, GEOSERVER, 'ws', 'drainage'), index)
+        self.assertEqual(len(index), 2)
+
+    def test_layers_do_not_block_each_other(self):
+        building, release = threading.Event(), threading.Event()
+        layer_features = reach_index_module.layer_features
+        builds = []
+
+        def slow_features(workspace_path, geoserver_url, workspace, layer_name, refresh=False):
+            builds.append(layer_name)
+            if layer_name == 'slow':
+                building.set()
+                release.wait(10)
+            return layer_features(workspace_path, geoserver_url, workspace, layer_name, refresh)
+
+        with mock.patch.object(reach_index_module, 'layer_features', slow_features):
+            threads = [threading.Thread(target=reach_index, args=(self.workspace, GEOSERVER, 'ws', 'slow'))
+                       for _ in range(3)]
+            for thread in threads:
+                thread.start()
+            self.assertTrue(building.wait(10))
+            # Another layer is indexed while the slow one is still downloading
+            self.assertEqual(len(reach_index(self.workspace, GEOSERVER, 'ws', 'drainage')), 2)
+            release.set()
+            for thread in threads:
+                thread.join(10)
+
+        # The threads waiting for the slow layer used the index built by the first one
+        self.assertEqual(sorted(builds), ['drainage', 'slow'])
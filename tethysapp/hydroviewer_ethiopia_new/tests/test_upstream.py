@@ -0,0 +1,123 @@
+"""
+Tests of the circuit breaker and retries of the upstream session. Needs requests.
+
+To run:
+    python -m pytest tethysapp/hydroviewer_ethiopia_new/tests/test_upstream.py
+"""
+import unittest
+from unittest import mock
+
+import requests
+from requests.adapters import BaseAdapter
+
+from ..upstream import CircuitBreaker, CircuitOpenError, UpstreamSession
+
+HOST = 'geoglows.ecmwf.int'
+
+
+class ScriptedAdapter(BaseAdapter):
+    """
+    Answers with the next status code of a script, None raising a connection error, and counts the calls.
+    """
+
+    def __init__(self, statuses):
+        super().__init__()
+        self.statuses = list(statuses)
+        self.calls = 0
+
+    def send(self, request, **kwargs):
+        self.calls += 1
+        status = self.statuses.pop(0)
+        if status is None:
+            raise requests.ConnectionError('connection refused')
+        response = requests.Response()
+        response.status_code = status
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+class CircuitBreakerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch('time.time', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker(failures=3, cooldown=30)
+
+    def test_opens_after_consecutive_failures(self):
+        for _ in range(2):
+            self.breaker.failure(HOST)
+            self.assertTrue(self.breaker.allow(HOST))
+        self.breaker.failure(HOST)
+        self.assertFalse(self.breaker.allow(HOST))
+        self.assertEqual(self.breaker.status(), {HOST: {'failures': 3, 'open': True}})
+        # Other hosts are not affected
+        self.assertTrue(self.breaker.allow('tethys2.byu.edu'))
+
+    def test_success_resets_the_count(self):
+        for _ in range(2):
+            self.breaker.failure(HOST)
+        self.breaker.success(HOST)
+        for _ in range(2):
+            self.breaker.failure(HOST)
+        self.assertTrue(self.breaker.allow(HOST))
+        self.assertEqual(self.breaker.status(), {HOST: {'failures': 2, 'open': False}})
+
+    def test_half_open_probe_succeeds(self):
+        for _ in range(3):
+            self.breaker.failure(HOST)
+        self.now += 29
+        self.assertFalse(self.breaker.allow(HOST))
+        self.now += 1
+        # A single request is let through once the cooldown is over
+        self.assertTrue(self.breaker.allow(HOST))
+        self.assertFalse(self.breaker.allow(HOST))
+        self.breaker.success(HOST)
+        self.assertTrue(self.breaker.allow(HOST))
+        self.assertEqual(self.breaker.status(), {})
+
+    def test_half_open_probe_fails(self):
+        for _ in range(3):
+            self.breaker.failure(HOST)
+        self.now += 30
+        self.assertTrue(self.breaker.allow(HOST))
+        self.breaker.failure(HOST)
+        # The failed probe opens the circuit for a whole new cooldown
+        self.now += 29
+        self.assertFalse(self.breaker.allow(HOST))
+        self.now += 1
+        self.assertTrue(self.breaker.allow(HOST))
+
+
+@mock.patch('time.sleep', lambda seconds: None)
+class UpstreamSessionTestCase(unittest.TestCase):
+
+    def session(self, statuses, failures=3):
+        session = UpstreamSession(retries=2, breaker=CircuitBreaker(failures=failures, cooldown=30))
+        adapter = ScriptedAdapter(statuses)
+        session.mount('https://', adapter)
+        return session, adapter
+
+    def test_retries_idempotent_requests(self):
+        session, adapter = self.session([503, None, 200])
+        self.assertEqual(session.get('https://' + HOST + '/api/').status_code, 200)
+        self.assertEqual(adapter.calls, 3)
+        self.assertEqual(session.breaker.status(), {})
+
+    def test_does_not_retry_posts(self):
+        session, adapter = self.session([503])
+        self.assertEqual(session.post('https://' + HOST + '/api/').status_code, 503)
+        self.assertEqual(adapter.calls, 1)
+
+    def test_fails_fast_while_open(self):
+        session, adapter = self.session([None, None, None])
+        with self.assertRaises(requests.ConnectionError):
+            session.get('https://' + HOST + '/api/')
+        with self.assertRaises(CircuitOpenError):
+            session.get('https://' + HOST + '/api/')
+        self.assertEqual(adapter.calls, 3)
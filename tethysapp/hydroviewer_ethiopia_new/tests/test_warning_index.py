@@ -0,0 +1,58 @@
+"""
+Tests of the warning point grid index and its clusters. Pure numpy.
+
+To run:
+    python -m pytest tethysapp/hydroviewer_ethiopia_new/tests/test_warning_index.py
+"""
+import unittest
+
+import numpy as np
+
+from ..warning_index import CLUSTER_MAX_ZOOM, WarningIndex, warning_index
+from .helpers import point
+
+
+def random_warnings(count=500, seed=0):
+    rng = np.random.RandomState(seed)
+    lons, lats = rng.uniform(33, 48, count), rng.uniform(3, 15, count)
+    return {rp: [point(lon, lat, comid=i) for i, (lon, lat) in enumerate(zip(lons, lats)) if i % 3 == n]
+            for n, rp in enumerate((20, 10, 2))}
+
+
+class WarningIndexTestCase(unittest.TestCase):
+
+    def test_query_matches_brute_force(self):
+        index = WarningIndex(random_warnings())
+        for bbox in ((35, 5, 36.3, 7.1), (33, 3, 48, 15), (40.01, 10.01, 40.02, 10.02), (-10, -10, -5, -5)):
+            minx, miny, maxx, maxy = bbox
+            lon, lat = index.coordinates[:, 0], index.coordinates[:, 1]
+            expected = np.flatnonzero((lon >= minx) & (lon <= maxx) & (lat >= miny) & (lat <= maxy))
+            np.testing.assert_array_equal(index.query(bbox), expected)
+
+    def test_visible_without_clustering(self):
+        warnings = {20: [point(38.0, 9.0, comid=1)], 10: [],
+                    2: [point(38.1, 9.1, comid=2), point(45.0, 14.0, comid=3)]}
+        visible = WarningIndex(warnings).visible((37.5, 8.5, 38.5, 9.5), CLUSTER_MAX_ZOOM)
+        self.assertEqual(visible[20], warnings[20])
+        self.assertEqual(visible[10], [])
+        self.assertEqual([f['properties']['comid'] for f in visible[2]], [2])
+
+    def test_clusters(self):
+        warnings = {2: [point(38.0, 9.0, comid=1, size=2), point(38.01, 9.01, comid=2, size=5),
+                        point(44.0, 12.0, comid=3, size=1)]}
+        visible = WarningIndex(warnings).visible((33, 3, 48, 15), 5)
+        clusters = sorted(visible[2], key=lambda f: f['properties']['point_count'])
+        self.assertEqual([c['properties']['point_count'] for c in clusters], [1, 2])
+        self.assertEqual(clusters[1]['properties']['size'], 5)
+        np.testing.assert_allclose(clusters[1]['geometry']['coordinates'], [38.005, 9.005])
+
+    def test_empty(self):
+        index = WarningIndex({20: [], 10: [], 2: []})
+        self.assertEqual(len(index.query((33, 3, 48, 15))), 0)
+        self.assertEqual(index.visible((33, 3, 48, 15), 3), {20: [], 10: [], 2: []})
+
+    def test_rebuilt_when_warnings_change(self):
+        warnings = random_warnings(10)
+        index = warning_index('nile', 'ethiopia', warnings)
+        self.assertIs(warning_index('nile', 'ethiopia', warnings), index)
+        self.assertIsNot(warning_index('nile', 'ethiopia', random_warnings(10)), index)
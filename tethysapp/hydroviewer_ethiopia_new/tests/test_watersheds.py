@@ -0,0 +1,57 @@
+"""
+Tests of the watershed list read from GeoServer. Needs requests.
+
+To run:
+    python -m pytest tethysapp/hydroviewer_ethiopia_new/tests/test_watersheds.py
+"""
+import unittest
+from unittest import mock
+
+from .. import watersheds
+from ..watersheds import CATALOGUE_TTL, FAILURE_TTL, parse_watersheds, watershed_names
+
+SERVER = ('http://geoserver/', 'admin', 'geoserver', 'hydroviewer', 'nile')
+
+
+class WatershedNamesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        for state in (watersheds._catalogues, watersheds._failures):
+            self.addCleanup(state.clear)
+        self.now = 1000.0
+        patcher = mock.patch.object(watersheds.time, 'time', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_parse(self):
+        feature_types = [{'name': 'nile-ethiopia-drainage_line'}, {'name': 'nile-ethiopia-catchment'},
+                         {'name': 'blue_nile-sudan-drainage_line'}, {'name': 'nile-ethiopia-drainage_line'}]
+        self.assertEqual(parse_watersheds(feature_types, 'nile'), ['Nile (Ethiopia)', 'Blue Nile (Sudan)'])
+
+    def test_first_load_fails(self):
+        with mock.patch.object(watersheds, '_load', side_effect=OSError('GeoServer down')) as load:
+            with self.assertRaisesRegex(RuntimeError, 'GeoServer down'):
+                watershed_names(*SERVER)
+            # The failure is served from memory instead of asking GeoServer on every page load
+            with self.assertRaisesRegex(RuntimeError, 'GeoServer down'):
+                watershed_names(*SERVER)
+            self.assertEqual(load.call_count, 1)
+
+        self.now += FAILURE_TTL + 1
+        with mock.patch.object(watersheds, '_load', return_value=['Nile (Ethiopia)']):
+            self.assertEqual(watershed_names(*SERVER), ['Nile (Ethiopia)'])
+
+    def test_keep_last_good_list(self):
+        with mock.patch.object(watersheds, '_load', return_value=['Nile (Ethiopia)']):
+            watershed_names(*SERVER)
+
+        self.now += CATALOGUE_TTL + 1
+        with mock.patch.object(watersheds, '_load', side_effect=OSError('GeoServer down')):
+            # The stale list is served while the reload fails in the background
+            with mock.patch.object(watersheds.threading, 'Thread') as thread:
+                self.assertEqual(watershed_names(*SERVER), ['Nile (Ethiopia)'])
+                watersheds._refresh(thread.call_args.kwargs['args'][0])
+            self.assertEqual(watershed_names(*SERVER), ['Nile (Ethiopia)'])
+            # A forced refresh reports the error
+            with self.assertRaisesRegex(RuntimeError, 'GeoServer down'):
+                watershed_names(*SERVER, refresh=True)
@@ -0,0 +1,167 @@
+import asyncio
+import random
+import threading
+import time
+import weakref
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import httpx
+except ImportError:
+    # Only needed by the async views
+    httpx = None
+
+# (connect, read) timeouts in seconds when the caller does not give one
+DEFAULT_TIMEOUT = (5, 30)
+# Keep-alive connections kept per host, and hosts with a pool
+POOL_MAXSIZE = 16
+POOL_CONNECTIONS = 8
+# Retries of idempotent requests, waiting a random time up to BACKOFF * 2 ** attempt (at most BACKOFF_MAX)
+RETRIES = 2
+BACKOFF = 0.25
+BACKOFF_MAX = 2.0
+RETRY_STATUS = (502, 503, 504)
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS')
+# Consecutive failures that open the circuit of a host, and seconds before a request is let through again
+BREAKER_FAILURES = 5
+BREAKER_COOLDOWN = 30
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """
+    Raised without contacting a host while its circuit is open.
+    """
+
+
+class CircuitBreaker(object):
+    """
+    Counts the consecutive failures of a host. Once there are too many, requests fail fast for cooldown seconds,
+    then a single request is let through: its success closes the circuit, its failure opens it again.
+    """
+
+    def __init__(self, failures=BREAKER_FAILURES, cooldown=BREAKER_COOLDOWN):
+        self.failures = failures
+        self.cooldown = cooldown
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def allow(self, host):
+        with self._lock:
+            state = self._hosts.get(host)
+            if state is None or state['opened'] is None:
+                return True
+            if state['probing'] or time.time() - state['opened'] < self.cooldown:
+                return False
+            state['probing'] = True
+            return True
+
+    def success(self, host):
+        with self._lock:
+            self._hosts.pop(host, None)
+
+    def failure(self, host):
+        with self._lock:
+            state = self._hosts.setdefault(host, {'count': 0, 'opened': None, 'probing': False})
+            state['count'] += 1
+            if state['probing'] or state['count'] >= self.failures:
+                state['opened'] = time.time()
+            state['probing'] = False
+
+    def status(self):
+        with self._lock:
+            return {host: {'failures': state['count'], 'open': state['opened'] is not None}
+                    for host, state in self._hosts.items()}
+
+
+class UpstreamSession(requests.Session):
+    """
+    Session shared by every upstream call of the app (GEOGloWS, the SPT API and GeoServer): keep-alive pools per
+    host, a default timeout, retries with jittered backoff for idempotent requests and a circuit breaker per host.
+    Being a requests.Session, it can also be handed to geoglows.
+    """
+
+    def __init__(self, retries=RETRIES, breaker=None):
+        super().__init__()
+        self.retries = retries
+        self.breaker = breaker or CircuitBreaker()
+        adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE)
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+
+    def request(self, method, url, *args, **kwargs):
+        kwargs.setdefault('timeout', DEFAULT_TIMEOUT)
+        host = urlparse(url).netloc
+        attempts = self.retries + 1 if method.upper() in IDEMPOTENT_METHODS else 1
+
+        for attempt in range(attempts):
+            if not self.breaker.allow(host):
+                raise CircuitOpenError('{0} is unavailable, not retrying for a while'.format(host))
+            try:
+                response = super().request(method, url, *args, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                self.breaker.failure(host)
+                if attempt == attempts - 1:
+                    raise
+            except Exception:
+                # Not the fault of the host (e.g. an invalid request), do not hold its circuit
+                self.breaker.success(host)
+                raise
+            else:
+                if response.status_code not in RETRY_STATUS:
+                    self.breaker.success(host)
+                    return response
+                self.breaker.failure(host)
+                if attempt == attempts - 1:
+                    return response
+                response.close()
+            time.sleep(random.uniform(0, min(BACKOFF_MAX, BACKOFF * 2 ** attempt)))
+
+
+session = UpstreamSession()
+
+# One async client per event loop and verify flag, they cannot be shared between loops
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def _async_client(verify):
+    if httpx is None:
+        raise ImportError('The async views need the httpx package')
+    clients = _async_clients.setdefault(asyncio.get_running_loop(), {})
+    if verify not in clients:
+        clients[verify] = httpx.AsyncClient(verify=verify, limits=httpx.Limits(
+            max_connections=POOL_MAXSIZE * POOL_CONNECTIONS, max_keepalive_connections=POOL_MAXSIZE))
+    return clients[verify]
+
+
+async def async_get(url, params=None, headers=None, auth=None, timeout=DEFAULT_TIMEOUT, verify=True):
+    """
+    GET with the same retries, backoff and circuit breaker as the shared session (the breaker itself is shared,
+    so both see when a host is down), on an httpx client pooled per event loop.
+    """
+    client = _async_client(verify)
+    host = urlparse(url).netloc
+    timeout = httpx.Timeout(timeout[1], connect=timeout[0])
+
+    for attempt in range(session.retries + 1):
+        if not session.breaker.allow(host):
+            raise CircuitOpenError('{0} is unavailable, not retrying for a while'.format(host))
+        try:
+            response = await client.get(url, params=params, headers=headers, auth=auth, timeout=timeout)
+        except httpx.TransportError:
+            session.breaker.failure(host)
+            if attempt == session.retries:
+                raise
+        except Exception:
+            session.breaker.success(host)
+            raise
+        else:
+            if response.status_code not in RETRY_STATUS:
+                session.breaker.success(host)
+                return response
+            session.breaker.failure(host)
+            if attempt == session.retries:
+                return response
+        await asyncio.sleep(random.uniform(0, min(BACKOFF_MAX, BACKOFF * 2 ** attempt)))
@@ -0,0 +1,80 @@
+import datetime as dt
+
+from .cache import CYCLE_TTL, forecast_cycle
+from .conditional import request_etag
+from .downloads import forecast_date
+from .historic_store import historic_store
+from .model import catalogue
+from .return_periods import return_period_table
+
+# Seconds browsers and proxies may reuse a response without revalidating it. The most recent forecast is
+# checked upstream every CYCLE_TTL seconds, a forecast picked by date and the historic simulation do not change.
+FORECAST_MAX_AGE = CYCLE_TTL
+FIXED_MAX_AGE = 24 * 3600
+# Plots also show the return periods and drainage area of the reach, which change when the reach is fitted in the
+# background or the reach catalogue is reloaded
+PLOT_MAX_AGE = 15 * 60
+
+
+def _comid(request):
+    return int(request.GET.get('comid') or request.GET['reach_id'])
+
+
+def _forecast(request, comid):
+    # (cycle, initialization timestamp, max age) of the forecast a response shows
+    date = forecast_date(request.GET.get('startdate', ''))
+    if date is None:
+        cycle, max_age = forecast_cycle(comid), FORECAST_MAX_AGE
+    else:
+        cycle, max_age = date, FIXED_MAX_AGE
+    init_time = dt.datetime.strptime(cycle[:8], '%Y%m%d').replace(tzinfo=dt.timezone.utc)
+    if '.' in cycle:
+        # Hour of the forecast cycle, e.g. 20200610.12
+        init_time += dt.timedelta(hours=int(cycle.split('.')[1] or 0))
+    return cycle, init_time.timestamp(), max_age
+
+
+def _plot_versions(comid):
+    return return_period_table.version(comid), catalogue.version()
+
+
+def forecast_validators(request):
+    """
+    Returns (etag, last modified timestamp, max age) of a forecast response, from the initialization date of the
+    forecast it shows. Only the date of the most recent forecast may be looked up (and is cached for CYCLE_TTL).
+    """
+    cycle, init_time, max_age = _forecast(request, _comid(request))
+    return request_etag(request, cycle), init_time, max_age
+
+
+def forecast_plot_validators(request):
+    """
+    forecast_validators of a forecast plot, which also depends on the return periods and the reach catalogue.
+    """
+    comid = _comid(request)
+    cycle, init_time, max_age = _forecast(request, comid)
+    versions = _plot_versions(comid)
+    return request_etag(request, (cycle,) + versions), max((init_time,) + versions), min(max_age, PLOT_MAX_AGE)
+
+
+def historic_validators(request):
+    """
+    Returns (etag, last modified timestamp, max age) of a response built from the historic simulation of a reach,
+    or None while the reach is not in the historic store.
+    """
+    comid = _comid(request)
+    if not historic_store.has(comid):
+        return None
+    version = historic_store.version(comid)
+    return request_etag(request, version), version, FIXED_MAX_AGE
+
+
+def historic_plot_validators(request):
+    """
+    historic_validators of a plot, which also depends on the return periods and the reach catalogue.
+    """
+    comid = _comid(request)
+    if not historic_store.has(comid):
+        return None
+    versions = (historic_store.version(comid),) + _plot_versions(comid)
+    return request_etag(request, versions), max(versions), PLOT_MAX_AGE
@@ -0,0 +1,118 @@
+import threading
+
+import numpy as np
+
+# Size in degrees of the cells of the index grid
+CELL_SIZE = 0.25
+# Below this zoom level the points of a return period are merged into clusters
+CLUSTER_MAX_ZOOM = 9
+# Approximate cluster radius in screen pixels
+CLUSTER_PIXELS = 40
+
+
+class WarningIndex(object):
+    """
+    Uniform grid over the warning points of one forecast cycle, for every return period at once.
+    """
+
+    def __init__(self, warnings, cell_size=CELL_SIZE):
+        self.source = warnings
+        self.cell_size = cell_size
+        self.features = []
+        return_periods, coordinates = [], []
+        for return_period, features in warnings.items():
+            for feature in features:
+                self.features.append(feature)
+                return_periods.append(return_period)
+                coordinates.append(feature['geometry']['coordinates'][:2])
+
+        self.return_periods = np.array(return_periods, dtype=int)
+        self.coordinates = np.array(coordinates, dtype=float).reshape(-1, 2)
+
+        self.cells = {}
+        if len(self.features):
+            keys = np.floor(self.coordinates / cell_size).astype(int)
+            unique_keys, inverse = np.unique(keys, axis=0, return_inverse=True)
+            order = np.argsort(inverse.ravel(), kind='stable')
+            bounds = np.cumsum(np.bincount(inverse.ravel(), minlength=len(unique_keys)))[:-1]
+            for key, members in zip(map(tuple, unique_keys), np.split(order, bounds)):
+                self.cells[key] = members
+
+    def query(self, bbox):
+        """
+        Returns the indices of the points inside bbox = (minx, miny, maxx, maxy) in lon/lat.
+        """
+        minx, miny, maxx, maxy = bbox
+        x0, y0 = int(np.floor(minx / self.cell_size)), int(np.floor(miny / self.cell_size))
+        x1, y1 = int(np.floor(maxx / self.cell_size)), int(np.floor(maxy / self.cell_size))
+
+        if (x1 - x0 + 1) * (y1 - y0 + 1) > len(self.cells):
+            # The box covers more cells than are occupied, walk the occupied ones instead
+            candidates = [m for (x, y), m in self.cells.items() if x0 <= x <= x1 and y0 <= y <= y1]
+        else:
+            candidates = [self.cells[(x, y)] for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)
+                          if (x, y) in self.cells]
+        if not candidates:
+            return np.array([], dtype=int)
+
+        candidates = np.concatenate(candidates)
+        lon, lat = self.coordinates[candidates, 0], self.coordinates[candidates, 1]
+        inside = (lon >= minx) & (lon <= maxx) & (lat >= miny) & (lat <= maxy)
+        return np.sort(candidates[inside])
+
+    def visible(self, bbox, zoom):
+        """
+        Returns the points inside bbox as {return_period: [features]}. Below CLUSTER_MAX_ZOOM nearby points of the
+        same return period are merged into one feature located at their centroid, whose properties give the
+        number of points (point_count) and the largest size among them.
+        """
+        indices = self.query(bbox)
+        visible = {return_period: [] for return_period in self.source}
+        if zoom >= CLUSTER_MAX_ZOOM:
+            for i in indices:
+                visible[int(self.return_periods[i])].append(self.features[i])
+            return visible
+
+        # Degrees covered by CLUSTER_PIXELS on 256 pixel web mercator tiles at this zoom level
+        cluster_size = CLUSTER_PIXELS * 360.0 / (256 * 2 ** zoom)
+        for return_period in visible:
+            members = indices[self.return_periods[indices] == return_period]
+            if not len(members):
+                continue
+            coordinates = self.coordinates[members]
+            keys = np.floor(coordinates / cluster_size).astype(int)
+            _, inverse = np.unique(keys, axis=0, return_inverse=True)
+            inverse = inverse.ravel()
+            counts = np.bincount(inverse)
+            centroids = np.stack([np.bincount(inverse, coordinates[:, 0]),
+                                  np.bincount(inverse, coordinates[:, 1])], axis=1) / counts[:, np.newaxis]
+            sizes = np.array([self.features[i]['properties'].get('size', 1) for i in members], dtype=float)
+            max_sizes = np.zeros(len(counts))
+            np.maximum.at(max_sizes, inverse, sizes)
+
+            for (lon, lat), count, size in zip(centroids, counts, max_sizes):
+                visible[return_period].append({
+                    'type': 'Feature',
+                    'geometry': {'type': 'Point', 'coordinates': [lon, lat]},
+                    'properties': {'size': size, 'point_count': int(count)},
+                })
+        return visible
+
+
+_indexes = {}
+_lock = threading.Lock()
+
+
+def warning_index(watershed, subbasin, warnings):
+    """
+    Returns the index of the warnings of a watershed/subbasin, rebuilt only when the warnings change
+    (i.e. once per forecast cycle).
+    """
+    key = (watershed, subbasin)
+    with _lock:
+        index = _indexes.get(key)
+    if index is None or index.source is not warnings:
+        index = WarningIndex(warnings)
+        with _lock:
+            _indexes[key] = index
+    return index
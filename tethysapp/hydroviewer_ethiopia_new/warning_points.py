@@ -0,0 +1,98 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .cache import forecast_cycle, forecast_cycle_async
+from .metrics import record_cache, submit, upstream
+from .upstream import async_get, session
+
+RETURN_PERIODS = (20, 10, 2)
+# (connect, read) timeouts in seconds for each GetWarningPoints call
+WARNING_TIMEOUT = (5, 30)
+
+_executor = ThreadPoolExecutor(max_workers=12)
+_warnings = {}
+_lock = threading.Lock()
+
+
+def _get_warning_points(api_source, spt_token, watershed, subbasin, return_period):
+    with upstream('spt'):
+        res = session.get(api_source + '/apps/streamflow-prediction-tool/api/GetWarningPoints/',
+                          params=dict(watershed_name=watershed, subbasin_name=subbasin, return_period=return_period),
+                          headers={'Authorization': 'Token ' + spt_token}, timeout=WARNING_TIMEOUT, verify=False)
+    res.raise_for_status()
+    return res.json()['features']
+
+
+async def _get_warning_points_async(api_source, spt_token, watershed, subbasin, return_period):
+    with upstream('spt'):
+        res = await async_get(api_source + '/apps/streamflow-prediction-tool/api/GetWarningPoints/',
+                              params=dict(watershed_name=watershed, subbasin_name=subbasin,
+                                          return_period=return_period),
+                              headers={'Authorization': 'Token ' + spt_token}, timeout=WARNING_TIMEOUT,
+                              verify=False)
+    res.raise_for_status()
+    return res.json()['features']
+
+
+def _cached_warnings(key, cycle):
+    with _lock:
+        cached = _warnings.get(key)
+    record_cache('warning_points', cached is not None and cached[0] == cycle)
+    if cached is not None and cached[0] == cycle:
+        return cached[1]
+    return None
+
+
+def warning_points(api_source, spt_token, watershed, subbasin):
+    """
+    Returns the warning point features of a watershed/subbasin as a dict keyed by return period. The return
+    periods are fetched concurrently and the result is kept in memory for the rest of the forecast cycle.
+    """
+    cycle = forecast_cycle()
+    key = (watershed, subbasin)
+    cached = _cached_warnings(key, cycle)
+    if cached is not None:
+        return cached
+
+    futures = {rp: submit(_executor, _get_warning_points, api_source, spt_token, watershed, subbasin, rp)
+               for rp in RETURN_PERIODS}
+    warnings = {rp: future.result() for rp, future in futures.items()}
+
+    with _lock:
+        _warnings[key] = (cycle, warnings)
+    return warnings
+
+
+async def warning_points_async(api_source, spt_token, watershed, subbasin):
+    """
+    warning_points for the async views, sharing the same cache.
+    """
+    cycle = await forecast_cycle_async()
+    key = (watershed, subbasin)
+    cached = _cached_warnings(key, cycle)
+    if cached is not None:
+        return cached
+
+    features = await asyncio.gather(*[_get_warning_points_async(api_source, spt_token, watershed, subbasin, rp)
+                                      for rp in RETURN_PERIODS])
+    warnings = dict(zip(RETURN_PERIODS, features))
+
+    with _lock:
+        _warnings[key] = (cycle, warnings)
+    return warnings
+
+
+def warning_reaches(api_source, spt_token, watersheds=()):
+    """
+    Returns the reach ids of the warning points of the current forecast cycle, for the given
+    (watershed, subbasin) pairs and every watershed already loaded by this process.
+    """
+    with _lock:
+        watersheds = set(watersheds) | set(_warnings)
+    reaches = set()
+    for watershed, subbasin in watersheds:
+        warnings = warning_points(api_source, spt_token, watershed, subbasin)
+        reaches.update(int(feature['properties']['comid']) for features in warnings.values()
+                       for feature in features if 'comid' in feature.get('properties', {}))
+    return reaches
@@ -0,0 +1,106 @@
+import threading
+import time
+
+from requests.auth import HTTPBasicAuth
+
+from .metrics import record_cache, record_error, upstream
+from .upstream import session
+
+# Seconds before the watershed list is refreshed from GeoServer
+CATALOGUE_TTL = 6 * 3600
+# Seconds before GeoServer is asked again after a failed load
+FAILURE_TTL = 60
+
+_catalogues = {}
+_failures = {}
+_refreshing = set()
+_lock = threading.Lock()
+
+
+def parse_watersheds(feature_types, keywords):
+    """
+    Returns the display names of the drainage line layers matching any of the comma separated keywords,
+    without duplicates and in GeoServer order.
+    """
+    keywords = [n for n in keywords.replace(' ', '').split(',') if n]
+    watersheds = {}
+    for feature_type in feature_types:
+        raw_feature = feature_type['name']
+        if 'drainage_line' in raw_feature and any(n in raw_feature for n in keywords):
+            parts = raw_feature.split('-')
+            feat_name = parts[0].replace('_', ' ').title() + ' (' + parts[1].replace('_', ' ').title() + ')'
+            watersheds.setdefault(feat_name, None)
+    return list(watersheds)
+
+
+def watershed_key(display_name):
+    """
+    Returns the (watershed, subbasin) names used by the SPT API for a dropdown name such as "Nile (Ethiopia)",
+    converted the same way as in wms.js.
+    """
+    watershed, subbasin = display_name.split(' (')[:2]
+    return watershed.replace(' ', '_', 1).lower(), subbasin.replace(')', '').lower()
+
+
+def _load(geoserver_url, username, password, workspace, keywords):
+    with upstream('geoserver'):
+        res = session.get(geoserver_url + 'rest/workspaces/' + workspace + '/featuretypes.json',
+                          auth=HTTPBasicAuth(username, password), verify=False)
+    res.raise_for_status()
+    # An empty workspace answers with "featureTypes": ""
+    feature_types = (res.json()['featureTypes'] or {}).get('featureType', [])
+    return parse_watersheds(feature_types, keywords)
+
+
+def _refresh(key):
+    # Returns the error if the load failed, the last good list is kept and reloaded in FAILURE_TTL seconds
+    try:
+        watersheds = _load(*key)
+    except Exception as e:
+        print(str(e))
+        record_error('watersheds')
+        with _lock:
+            _failures[key] = (time.time(), str(e))
+            cached = _catalogues.get(key)
+            if cached is not None:
+                _catalogues[key] = (time.time() - CATALOGUE_TTL + FAILURE_TTL, cached[1])
+        return str(e)
+    else:
+        with _lock:
+            _catalogues[key] = (time.time(), watersheds)
+            _failures.pop(key, None)
+        return None
+    finally:
+        with _lock:
+            _refreshing.discard(key)
+
+
+def watershed_names(geoserver_url, username, password, workspace, keywords, refresh=False):
+    """
+    Returns the watershed names of the catalogue. Only the first call of a process, or a forced refresh, waits
+    for GeoServer; once the list is older than CATALOGUE_TTL it is served as is while a background thread
+    reloads it. Raises a RuntimeError with the GeoServer error if there is no list to serve (failures are
+    remembered for FAILURE_TTL seconds) or if a forced refresh fails.
+    """
+    key = (geoserver_url, username, password, workspace, keywords)
+    with _lock:
+        cached = _catalogues.get(key)
+        failure = _failures.get(key)
+        stale = cached is not None and time.time() - cached[0] > CATALOGUE_TTL and key not in _refreshing
+        if stale:
+            _refreshing.add(key)
+    record_cache('watersheds', cached is not None and not refresh)
+
+    if cached is None or refresh:
+        if cached is None and not refresh and failure is not None and time.time() - failure[0] < FAILURE_TTL:
+            error = failure[1]
+        else:
+            error = _refresh(key)
+        if error is not None:
+            raise RuntimeError('The watershed list could not be loaded from GeoServer: {0}'.format(error))
+        with _lock:
+            return _catalogues[key][1]
+
+    if stale:
+        threading.Thread(target=_refresh, args=(key,), daemon=True).start()
+    return cached[1]